@@ -1,7 +1,14 @@
 import os
 import time
-import subprocess 
-import sys 
+import re
+import json
+import hashlib
+import shutil
+import tempfile
+import threading
+import argparse
+from concurrent.futures import ThreadPoolExecutor, Future
+import contextlib
 from dotenv import load_dotenv
 from selenium import webdriver
 from selenium.webdriver.common.by import By
@@ -9,13 +16,25 @@ from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from webdriver_manager.chrome import ChromeDriverManager
-from selenium.common.exceptions import TimeoutException, NoSuchElementException, WebDriverException, ElementClickInterceptedException, StaleElementReferenceException
+from selenium.common.exceptions import TimeoutException, NoSuchElementException, WebDriverException, ElementClickInterceptedException
 from selenium.webdriver.remote.webelement import WebElement
 
 # --- Load environment variables ---
 # User should create a .env file in the same directory. See .env.example.
 load_dotenv()
 
+def env_int(env_name, default_value, minimum=1):
+    """Reads an int >= minimum (positive by default) from the environment, falling back to default_value if unset or invalid."""
+    try:
+        value = int(os.environ.get(env_name) or default_value)
+        return value if value >= minimum else default_value
+    except (ValueError, TypeError): return default_value
+
+def env_flag(env_name, default_value):
+    """Reads an on/off switch from the environment ("1", "true" or "yes" mean on), falling back to default_value if unset."""
+    value = (os.environ.get(env_name) or "").strip().lower()
+    return value in ("1", "true", "yes") if value else default_value
+
 # --- 1. USER CONFIGURATION (Primary place to edit for new users) ---
 
 # Path to the project folder to upload.
@@ -38,9 +57,19 @@ CHROME_USER_DATA_DIR = os.environ.get("CHROME_USER_DATA_DIR_PATH") or "/path/to/
 CHROME_PROFILE_DIRECTORY = os.environ.get("CHROME_PROFILE_DIR_NAME") or "Profile 1" # e.g., "Default", "Profile 1"
 
 # --- File Scanning Configuration ---
+SITEMAP_FILENAME = "project_structure_sitemap.xml" # Name for the generated file tree
+# Manifest of uploaded file fingerprints (path, size, mtime, sha256), stored next to the sitemap in TARGET_FOLDER.
+MANIFEST_FILENAME = ".gemini_upload_manifest.json"
+# Checkpoint journal (JSONL, stored in TARGET_FOLDER): every batch's files and status are appended as the upload runs,
+# so "python Gemini_File_Uploader.py --resume" can continue the same conversation from the first unfinished batch.
+JOURNAL_FILENAME = ".gemini_upload_journal.jsonl"
+# "full" (default) uploads every selected file. "incremental" uploads only files added or modified since the
+# last successful upload recorded in the manifest, plus the refreshed sitemap. Can be set in .env as UPLOAD_MODE.
+UPLOAD_MODE = (os.environ.get("UPLOAD_MODE") or "full").strip().lower()
 # Subfolders within TARGET_FOLDER to explicitly scan. "" means the root of TARGET_FOLDER.
 SUBFOLDERS_TO_SCAN = ["", "src", "lib", "components", "pages", "utils", "styles", "scripts", "tests", "app", "server", "api"] 
-# Folder names to completely ignore during scanning.
+# Folder names to completely ignore during scanning (whole subtree is skipped). Glob patterns work (e.g. "*.egg-info");
+# an entry containing "/" is matched against the path relative to TARGET_FOLDER (e.g. "src/generated").
 FOLDERS_TO_IGNORE_NAMES = [
     ".git", "node_modules", "__pycache__", ".venv", "venv", 
     "dist", "build", "out", "target", # Common build/output directories
@@ -49,14 +78,18 @@ FOLDERS_TO_IGNORE_NAMES = [
     "temp", "tmp", "backup",
     "assets", "static", "media", "images", "fonts" # Often contain binary files not suitable for direct upload
 ] 
-# Specific filenames to ignore. (Supports wildcards via fnmatch if implemented, but currently exact match)
+# Filenames to ignore. Same pattern rules as FOLDERS_TO_IGNORE_NAMES (globs like "*.log" match at any depth).
 FILES_TO_IGNORE_NAMES = [
     ".gitignore", ".env", ".DS_Store", "Thumbs.db",
     "package-lock.json", "yarn.lock", "pnpm-lock.yaml", "poetry.lock", "Pipfile.lock",
-    "*.log", "*.tmp", "*.bak", "*.swp", "*.swo", # Common temp/backup files (Note: wildcard matching would need fnmatch)
+    "*.log", "*.tmp", "*.bak", "*.swp", "*.swo", # Common temp/backup files
     "LICENSE", "CONTRIBUTING.md", "CODE_OF_CONDUCT.md", # Often not needed for code context
-    SITEMAP_FILENAME # The generated sitemap itself should not be in the tree if already handled
+    SITEMAP_FILENAME, # The generated sitemap itself should not be in the tree if already handled
+    MANIFEST_FILENAME, JOURNAL_FILENAME # Upload manifest and journal are bookkeeping for this script, never uploaded
 ] 
+# Also honour the target project's own .gitignore files (root and nested, including "!" re-includes).
+# Can be set in .env as USE_GITIGNORE.
+USE_GITIGNORE = env_flag("USE_GITIGNORE", True)
 # Allowed file extensions for upload. Add or remove as needed.
 ALLOWED_EXTENSIONS = [
     '.txt', '.md', '.py', '.js', '.ts', '.jsx', '.tsx', '.html', '.css', '.scss', '.less', 
@@ -69,15 +102,135 @@ ALLOWED_EXTENSIONS = [
     # '.png', '.jpg', '.jpeg', '.gif', '.svg', '.ico', (Gemini might not process images well this way)
     # '.zip', '.tar.gz', '.jar', '.dll', '.exe' (Definitely exclude these large/binary files)
 ]
-SITEMAP_FILENAME = "project_structure_sitemap.xml" # Name for the generated file tree
 
-# --- PyAutoGUI Helper Script Configuration (for NATIVE Chrome pop-up) ---
-# This script should be in the same directory as this main script.
-NATIVE_POPUP_CLICKER_SCRIPT_NAME = "click_image_on_screen.py" # Assumes the PyAutoGUI script is named this
+# --- Content Classification ---
+# Before upload, each file's size and first CLASSIFY_SNIFF_BYTES are checked (in a thread pool); binaries, minified or
+# generated files and files over the size/line limits are excluded and listed in the report and at the end of the sitemap.
+# Verdicts are cached in the manifest by (path, size, mtime). Each limit can be overridden in .env with the same name.
+CLASSIFY_FILES = env_flag("CLASSIFY_FILES", True)
+MAX_UPLOAD_FILE_BYTES = 5 * 1024 * 1024 # Larger files are excluded.
+MAX_UPLOAD_FILE_LINES = 50_000 # Estimated from the sniffed sample's line density (files are never read in full).
+MINIFIED_AVG_LINE_LENGTH = 300 # Average line length (chars) above which a file counts as minified.
+CLASSIFY_SNIFF_BYTES = 4096
+CLASSIFY_WORKERS = 8
+GENERATED_FILE_MARKERS = [b"@generated", b"do not edit", b"code generated by", b"autogenerated", b"auto-generated"] # Checked in the first 1 KB, lowercased.
+
+# --- Deduplication ---
+# Byte-identical files (same sha256) are uploaded once; the other paths are listed as aliases at the end of the sitemap.
+# Hashes come from the manifest check (cached by size/mtime, changed files hashed in parallel). Can be set in .env as DEDUPE_FILES.
+DEDUPE_FILES = env_flag("DEDUPE_FILES", True)
+HASH_WORKERS = 8
+
+# --- Upload Batching Configuration ---
+# Batches are bin-packed up to all three limits below. Each can be overridden in .env with the same name.
+UPLOAD_BATCH_SIZE = 10 # Max files per batch (Gemini currently accepts 10 files per message).
+UPLOAD_BATCH_MAX_BYTES = 2 * 1024 * 1024 # Max total bytes per batch.
+UPLOAD_BATCH_MAX_TOKENS = 500_000 # Max estimated tokens per batch.
+ESTIMATED_BYTES_PER_TOKEN = 4 # Rough bytes-per-token ratio for source code/text, used for token estimates.
+
+# --- Bundle Mode Configuration ---
+# Set BUNDLE_MODE="true" in .env to concatenate many small files into a few bundle files (with clear path headers)
+# in a temp directory and upload those instead of the originals. Files bigger than BUNDLE_MAX_BYTES are uploaded as-is.
+BUNDLE_MODE = env_flag("BUNDLE_MODE", False)
+BUNDLE_MAX_BYTES = 1024 * 1024 # Size cap per bundle file. Can be overridden in .env as BUNDLE_MAX_BYTES.
+BUNDLE_INDEX_FILENAME = "bundle_index.json" # Maps each original path to its bundle and byte offset (uploaded with the sitemap).
+
+# --- Payload Compaction (opt-in) ---
+# True: compacted copies of the selected files are written to a temp workspace and uploaded instead of the originals:
+# trailing whitespace and blank-line runs removed, license headers stripped, giant literals/lines truncated and,
+# with COMPACT_STRIP_COMMENTS, full-line comments dropped. Results are cached in COMPACT_CACHE_DIR by path/size/mtime.
+COMPACT_MODE = env_flag("COMPACT_MODE", False)
+COMPACT_STRIP_COMMENTS = env_flag("COMPACT_STRIP_COMMENTS", False)
+COMPACT_MAX_LITERAL_CHARS = 400 # String literals longer than this keep only their first part.
+COMPACT_MAX_LINE_CHARS = 2000 # Any longer line is cut here (embedded data blobs, long arrays).
+COMPACT_LICENSE_SCAN_LINES = 60 # Only a leading comment block that ends within this many lines can be a license header.
+COMPACT_CACHE_DIR = os.environ.get("COMPACT_CACHE_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), ".compact_cache")
+# Comment syntax per extension: (line comment prefixes, (block start, block end) or None).
+COMPACT_COMMENT_SYNTAX = {
+    **{ext: (("#",), None) for ext in ('.py', '.sh', '.rb', '.pl', '.yaml', '.yml', '.toml', '.cfg', '.ps1', '.dockerfile')},
+    **{ext: (("//",), ("/*", "*/")) for ext in ('.js', '.ts', '.jsx', '.tsx', '.java', '.kt', '.swift', '.c', '.cpp', '.h', '.hpp', '.cs', '.go', '.php', '.scss', '.less')},
+    '.css': ((), ("/*", "*/")), '.ini': ((";", "#"), None), '.sql': (("--",), ("/*", "*/")), '.bat': (("REM ", "rem ", "::"), None),
+    '.html': ((), ("<!--", "-->")), '.xml': ((), ("<!--", "-->")), '.md': ((), ("<!--", "-->")),
+}
+# String quote characters per code extension. Only these get giant literals truncated (outside comments);
+# prose and markup (.md, .txt, .csv, .html, ...) only get the COMPACT_MAX_LINE_CHARS cap, since apostrophes are not quotes there.
+COMPACT_STRING_QUOTES = {
+    **{ext: "\"'" for ext in ('.py', '.rb', '.pl', '.php', '.sh', '.ps1', '.yaml', '.yml', '.toml', '.sql', '.scss', '.less', '.css')},
+    **{ext: "\"'`" for ext in ('.js', '.ts', '.jsx', '.tsx')},
+    **{ext: '"' for ext in ('.java', '.kt', '.swift', '.c', '.cpp', '.h', '.hpp', '.cs', '.json')}, '.go': '"`',
+}
+# Delimiters of strings that can span lines. Lines inside them are string contents: kept verbatim, never treated as comments.
+COMPACT_MULTILINE_STRINGS = {
+    **{ext: ('"""', "'''") for ext in ('.py', '.toml')}, **{ext: ('"""',) for ext in ('.kt', '.swift', '.java')},
+    **{ext: ('`',) for ext in ('.js', '.ts', '.jsx', '.tsx', '.go')},
+}
+
+# --- Pipeline Configuration ---
+# True (default): scanning, hashing, bundling and batch packing run in a worker thread while Chrome starts, logs in
+# and selects the model; the upload loop takes the finished plan from a Future. False: prepare first, then start Chrome.
+OVERLAP_PREPARE_WITH_STARTUP = env_flag("OVERLAP_PREPARE_WITH_STARTUP", True)
+
+# --- Batch Retry Configuration ---
+# A failed batch is retried BATCH_RETRIES times, each time after reloading the conversation and waiting
+# BATCH_RETRY_BACKOFF_SECONDS (doubled on every retry). If it still fails, a batch of several files is split in half
+# and each half gets the same treatment before the upload gives up. Can be set in .env with the same names (0 turns retries off).
+BATCH_RETRIES = 2
+BATCH_RETRY_BACKOFF_SECONDS = 5
+SPLIT_FAILED_BATCHES = env_flag("SPLIT_FAILED_BATCHES", True)
+
+# --- Adaptive Batch Size Configuration ---
+# True (default): the number of files per message is tuned between batches from what the previous batch showed (AIMD).
+# A fast, clean batch that used the whole limit adds 1 file (up to UPLOAD_BATCH_SIZE). Missing chips or failed attempts halve
+# the limit. A slow batch (chips slower than ADAPTIVE_SLOW_CHIP_SECONDS per file, or Gemini slower than
+# ADAPTIVE_SLOW_READY_SECONDS to answer) cuts it by a quarter. It never drops below ADAPTIVE_BATCH_MIN_FILES.
+# The byte and token budgets always apply. Can be set in .env with the same names.
+ADAPTIVE_BATCH_SIZE = env_flag("ADAPTIVE_BATCH_SIZE", True)
+ADAPTIVE_BATCH_MIN_FILES = 2
+ADAPTIVE_SLOW_CHIP_SECONDS = 2 # Chip appearance time per file above which a batch counts as slow.
+ADAPTIVE_SLOW_READY_SECONDS = 90 # wait_for_gemini_ready time above which a batch counts as slow.
+
+# --- Parallel Upload Configuration ---
+# Number of independent browser sessions (each with its own fresh profile directory and conversation).
+# With more than 1, the files are sharded by top-level directory and each shard gets its own sitemap slice.
+# Can be set in .env as UPLOAD_WORKERS. Not available with USE_CHROME_PROFILE (a profile can only be open once).
+UPLOAD_WORKERS = 1
+
+# --- Browser Launch Profile ---
+# "standard" (default) is the original launch: headed, maximized, every resource loaded, renderer accessibility forced on.
+# "lean" uses a fixed LEAN_WINDOW_SIZE viewport, blocks images/fonts/media through CDP (LEAN_BLOCKED_EXTENSIONS), adds
+# memory-saving flags (LEAN_CHROME_FLAGS) and runs headless where the flow allows it: LEAN_HEADLESS="auto" goes headless only
+# with USE_CHROME_PROFILE (already signed in, so no password form and no native pop-up to click); "true"/"false" force it.
+# Compare both with: python benchmark_uploader.py launch. Can be set in .env as BROWSER_PROFILE and LEAN_HEADLESS.
+BROWSER_PROFILE = (os.environ.get("BROWSER_PROFILE") or "standard").strip().lower()
+LEAN_HEADLESS = (os.environ.get("LEAN_HEADLESS") or "auto").strip().lower()
+LEAN_WINDOW_SIZE = (1280, 900)
+LEAN_BLOCKED_EXTENSIONS = [
+    "png", "jpg", "jpeg", "gif", "webp", "avif", "ico", "bmp", # Images (UI icons are font ligatures or inline SVG)
+    "woff", "woff2", "ttf", "otf", # Web fonts (locators match aria-labels and icon names, not rendered glyphs)
+    "mp4", "webm", "mp3", "ogg", "wav", # Media
+]
+# CDP patterns match the whole URL ("*" = anything): each extension is blocked with and without a query string.
+LEAN_BLOCKED_URL_PATTERNS = [p for ext in LEAN_BLOCKED_EXTENSIONS for p in (f"*.{ext}", f"*.{ext}?*")] + [
+    "*googletagmanager.com*", "*google-analytics.com*", # Analytics beacons
+]
+LEAN_CHROME_FLAGS = [
+    "--disable-background-networking", "--disable-features=Translate,MediaRouter,OptimizationHints,AutofillServerCommunication",
+    "--renderer-process-limit=2", "--disk-cache-size=33554432", "--mute-audio", "--blink-settings=imagesEnabled=false",
+]
+
+# --- Tracing Configuration ---
+# Each run writes a JSONL trace of timed spans (scan, driver install, login, model selection and every batch phase)
+# to TRACE_DIR. Aggregate traces across runs with: python trace_report.py [TRACE_DIR]
+TRACE_ENABLED = env_flag("TRACE_ENABLED", True)
+TRACE_DIR = os.environ.get("TRACE_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "upload_traces")
+
+# --- Native Pop-up Clicker Configuration (for NATIVE Chrome pop-up) ---
+# The pop-up button is found in-process by image_locator.py (NumPy template matching on a screenshot) and clicked with PyAutoGUI.
 # Image for the NATIVE Chrome "Make Chrome your own" pop-up dismiss button.
 # User MUST capture this image, name it (e.g., "chrome_guest_button.png"), 
 # and place it in the same directory as the scripts.
 NATIVE_POPUP_DISMISS_IMAGE = "chrome_guest_button_example.png" # Placeholder - user must update this
+NATIVE_POPUP_SEARCH_WINDOW_ONLY = env_flag("NATIVE_POPUP_SEARCH_WINDOW_ONLY", True) # Search only the browser window's screen area.
 
 # --- Other Global Settings ---
 GEMINI_URL = "https://gemini.google.com/app"
@@ -88,67 +241,306 @@ GEMINI_LOADING_SPINNER_XPATH = "//div[contains(@class, 'spinner') or contains(@c
 GEMINI_ERROR_MESSAGE_XPATH = "//*[contains(text(), 'Something went wrong') or contains(@class, 'error-message') or contains(text(), 'An error occurred') or contains(text(), 'Unable to reach Gemini') or contains(@class, 'response-error')]"
 GEMINI_JUST_A_SEC_XPATH = "//*[contains(text(), 'Just a sec...') or contains(text(), 'Generating...')]" # More general
 
+# --- Adaptive Waits ---
+# Every former fixed time.sleep() in the flow is now a condition wait that returns as soon as its condition holds.
+# These are the ceilings (seconds) for each wait; on timeout the flow continues exactly as it did after the old sleep.
+ADAPTIVE_WAIT_CEILINGS = {
+    "post_login_redirect": 20, # Was time.sleep(8) after submitting the password.
+    "model_menu_open": 10, "model_menu_close": 5, # Were time.sleep(3.0) / time.sleep(1.5) around the model switcher.
+    "upload_menu_open": 10, # Was time.sleep(3.0) after clicking the Add/Attach icon.
+    "file_input_ready": 10, # Was time.sleep(3.5) after clicking "Upload files".
+    "send_button_ready": 5, # Was time.sleep(0.5) after typing the batch message.
+}
 
-# --- 2. HELPER FUNCTIONS ---
-def generate_file_tree_text(root_dir, subfolders_to_scan, folders_to_ignore_names, files_to_ignore_names, allowed_extensions):
-    """Generates a text representation of the file tree, attempting to avoid duplicates."""
-    tree_lines = []
-    processed_paths_for_tree = set() 
-    abs_root_dir = os.path.abspath(root_dir)
+# --- Readiness Detection ---
+# True: wait_for_gemini_ready blocks on a MutationObserver injected into the page and returns the moment Gemini is ready.
+# False (or if the observer cannot run): the original polling loop is used.
+USE_EVENT_DRIVEN_WAIT = True
+READY_SETTLE_MS = 800 # The ready state must hold this long (no stop button/spinner re-appearing) before it counts.
+
+GEMINI_FILE_CHIP_CSS = "div[data-test-id='file-preview']" # One per attached file in the prompt area.
+GEMINI_SEND_BUTTON_XPATHS = ["//button[@aria-label='Send message']", "//button[@data-testid='send-button']"]
+
+# Shared JS probe: evaluates every UI locator above in one pass and returns a compact page-state dict.
+# Used by get_page_state() (one execute_script round trip) and by the readiness observer below.
+GEMINI_PAGE_PROBE_JS = """
+function probePage(cfg) {
+  const visible = el => !!el && el.getClientRects().length > 0 && getComputedStyle(el).visibility !== 'hidden';
+  const firstVisible = xp => {
+    const it = document.evaluate(xp, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+    for (let i = 0; i < it.snapshotLength; i++) { if (visible(it.snapshotItem(i))) return it.snapshotItem(i); }
+    return null;
+  };
+  const prompt = cfg.promptCss ? document.querySelector(cfg.promptCss) : null;
+  const editable = prompt ? (prompt.querySelector("[contenteditable='true']") || prompt) : null;
+  const err = firstVisible(cfg.errorXp);
+  let send = null;
+  for (const xp of cfg.sendXps) { send = firstVisible(xp); if (send) break; }
+  return {
+    error: err ? ((err.innerText || err.textContent || '').trim().slice(0, 300) || 'error element visible') : null,
+    busy: !!firstVisible(cfg.busyXp), stop: !!firstVisible(cfg.stopXp), spinner: !!firstVisible(cfg.spinnerXp),
+    prompt: visible(prompt) && !prompt.disabled && prompt.getAttribute('aria-disabled') !== 'true',
+    prompt_empty: editable ? (editable.value !== undefined ? editable.value : (editable.innerText || '')).trim() === '' : null,
+    chips: document.querySelectorAll(cfg.chipCss).length,
+    send: !!send && !send.disabled && send.getAttribute('aria-disabled') !== 'true'
+  };
+}
+"""
+GEMINI_PAGE_STATE_JS = GEMINI_PAGE_PROBE_JS + "return probePage(arguments[0]);"
+
+# Injected by wait_for_gemini_ready_event(). Resolves with {status: 'ready'|'error'|'timeout', reason, elapsed_ms, state}.
+GEMINI_READY_OBSERVER_JS = GEMINI_PAGE_PROBE_JS + """
+const [cfg, timeoutMs, settleMs] = arguments;
+const done = arguments[arguments.length - 1];
+const started = performance.now();
+const isReady = st => st.prompt && !st.stop && !st.spinner && !st.busy;
+let settleTimer = null, finished = false, observer = null, deadline = null;
+const finish = (status, reason, state) => {
+  if (finished) return; finished = true;
+  if (observer) observer.disconnect(); clearTimeout(settleTimer); clearTimeout(deadline);
+  done({status: status, reason: reason, elapsed_ms: Math.round(performance.now() - started), state: state});
+};
+const evaluate = () => {
+  if (finished) return;
+  const st = probePage(cfg);
+  if (st.error) return finish('error', 'gemini_error: ' + st.error, st);
+  if (!isReady(st)) { clearTimeout(settleTimer); settleTimer = null; return; }
+  if (!settleTimer) settleTimer = setTimeout(() => {
+    settleTimer = null; const again = probePage(cfg);
+    if (again.error) return finish('error', 'gemini_error: ' + again.error, again);
+    if (isReady(again)) finish('ready', 'ready', again);
+  }, settleMs);
+};
+let scheduled = false;
+// setTimeout, not requestAnimationFrame: rAF is paused while the window is hidden (minimized or covered during a long upload).
+observer = new MutationObserver(() => {
+  if (scheduled) return; scheduled = true;
+  setTimeout(() => { scheduled = false; evaluate(); }, 50);
+});
+observer.observe(document.documentElement, {childList: true, subtree: true, attributes: true, characterData: true});
+deadline = setTimeout(() => {
+  const st = probePage(cfg);
+  if (st.error) return finish('error', 'gemini_error: ' + st.error, st);
+  if (isReady(st)) return finish('ready', 'ready_at_deadline', st); // Ready, but the settle window had not elapsed yet.
+  const why = !st.prompt ? 'prompt_not_editable' : st.stop ? 'stop_button_visible' : st.spinner ? 'spinner_visible' : st.busy ? 'gemini_busy' : 'not_settled';
+  finish('timeout', why, st);
+}, timeoutMs);
+evaluate();
+"""
+
+# --- Locator Learning ---
+# Each group of alternative locators (sign-in button, model switcher, Add/Attach icon, Upload files button, file input,
+# send button) remembers which locator worked and how fast, persisted in LOCATOR_STATS_PATH between runs.
+# The last winner is tried first with LOCATOR_WINNER_TIMEOUT; the others follow, ordered by success rate.
+LOCATOR_LEARNING_ENABLED = env_flag("LOCATOR_LEARNING_ENABLED", True)
+LOCATOR_STATS_PATH = os.environ.get("LOCATOR_STATS_PATH") or os.path.join(os.path.dirname(os.path.abspath(__file__)), ".gemini_locator_stats.json")
+LOCATOR_WINNER_TIMEOUT = 3 # Seconds for the last winner's first try (it gets the full timeout again if every alternative fails).
 
-    scan_roots_to_process = []
-    if "" in subfolders_to_scan and os.path.isdir(abs_root_dir):
-        scan_roots_to_process.append(abs_root_dir)
+# --- Fast File Attach ---
+# True: each batch feeds the page's file input directly (found once per browser session and cached), falling back to
+# a synthetic drop event on the prompt area, and only then to the Add/Attach -> "Upload files" menu clicks.
+FAST_ATTACH_ENABLED = env_flag("FAST_ATTACH_ENABLED", True)
+FAST_ATTACH_VERIFY_SECONDS = 5 # A fast path only counts if the first new file chip shows up within this time.
+FILE_INPUT_CACHE = {} # driver.session_id -> file input WebElement (one per browser session, so parallel workers don't share).
+FAST_ATTACH_FAILED = {} # driver.session_id -> fast paths ("cached_input", "drop") Gemini ignored; skipped for the rest of that session.
+
+# Finds the page's own file input (not our drop helper); prefers one that accepts multiple files.
+GEMINI_FIND_FILE_INPUT_JS = """
+const inputs = Array.from(document.querySelectorAll("input[type='file']")).filter(i => i.id !== 'gemini-uploader-drop-input');
+return inputs.find(i => i.multiple) || inputs[0] || null;
+"""
+
+# Materializes an offscreen helper file input for the drop fallback (Selenium can only hand files to a file input).
+GEMINI_DROP_INPUT_JS = """
+let input = document.getElementById('gemini-uploader-drop-input');
+if (!input) {
+  input = document.createElement('input'); input.type = 'file'; input.multiple = true; input.id = 'gemini-uploader-drop-input';
+  input.style.cssText = 'position:fixed;left:-9999px;top:0;width:1px;height:1px;opacity:0;';
+  document.body.appendChild(input);
+}
+input.value = '';
+return input;
+"""
+
+# Moves the helper input's files into a DataTransfer and drops them on the prompt area (arguments: input, target).
+GEMINI_DROP_FILES_JS = """
+const [input, target] = arguments;
+const dt = new DataTransfer();
+for (const f of input.files) dt.items.add(f);
+for (const type of ['dragenter', 'dragover', 'drop']) {
+  target.dispatchEvent(new DragEvent(type, {bubbles: true, cancelable: true, composed: true, dataTransfer: dt}));
+}
+input.value = '';
+return dt.files.length;
+"""
+
+
+# --- 2. HELPER FUNCTIONS ---
+def _resolve_scan_roots(abs_root_dir, subfolders_to_scan):
+    """Returns the absolute scan roots in config order, skipping missing dirs and duplicates."""
+    scan_roots = []
+    if "" in subfolders_to_scan and os.path.isdir(abs_root_dir): scan_roots.append(abs_root_dir)
     for subfolder_rel_path in subfolders_to_scan:
-        if subfolder_rel_path: 
+        if subfolder_rel_path:
             path_to_add = os.path.abspath(os.path.join(abs_root_dir, subfolder_rel_path))
-            if os.path.isdir(path_to_add) and path_to_add not in scan_roots_to_process:
-                 scan_roots_to_process.append(path_to_add)
+            if os.path.isdir(path_to_add) and path_to_add not in scan_roots: scan_roots.append(path_to_add)
+    return scan_roots
+
+def _glob_to_regex(pattern):
+    """Translates a gitignore-style glob into a regex over "/"-separated paths (* and ? never cross "/", ** does)."""
+    out = []; i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith("**/", i): out.append("(?:.*/)?"); i += 3; continue
+        if pattern.startswith("**", i): out.append(".*"); i += 2; continue
+        if c == "*": out.append("[^/]*")
+        elif c == "?": out.append("[^/]")
+        elif c == "\\" and i + 1 < len(pattern): out.append(re.escape(pattern[i + 1])); i += 2; continue
+        elif c == "[" and pattern.find("]", i + 2) != -1:
+            j = pattern.find("]", i + 2); body = pattern[i + 1:j]
+            if body[0] in "!^": body = "^" + body[1:]
+            out.append("[" + body.replace("\\", "\\\\") + "]"); i = j + 1; continue
+        else: out.append(re.escape(c))
+        i += 1
+    return "".join(out)
 
-    if abs_root_dir in scan_roots_to_process and abs_root_dir not in processed_paths_for_tree:
-        tree_lines.append(f"{os.path.basename(abs_root_dir)}/")
-        processed_paths_for_tree.add(abs_root_dir)
+def _pattern_to_regex(pattern):
+    """One ignore pattern -> regex fragment. Without an inner "/" it matches the name at any depth, otherwise it is anchored."""
+    anchored = "/" in pattern.rstrip("/")
+    fragment = _glob_to_regex(pattern.strip("/"))
+    return fragment if anchored else "(?:.*/)?" + fragment
 
-    for current_scan_root in scan_roots_to_process:
-        if current_scan_root != abs_root_dir and current_scan_root not in processed_paths_for_tree:
-            relative_to_main_root_for_sub_scan_root = os.path.relpath(current_scan_root, abs_root_dir)
-            depth_for_sub_scan_root = relative_to_main_root_for_sub_scan_root.count(os.sep) if relative_to_main_root_for_sub_scan_root != '.' else 0
-            indent_for_sub_scan_root = '  ' * depth_for_sub_scan_root
-            tree_lines.append(f"{indent_for_sub_scan_root}├── {os.path.basename(current_scan_root)}/")
-            processed_paths_for_tree.add(current_scan_root) 
+def _combine_regexes(fragments):
+    return re.compile("(?:" + "|".join(fragments) + ")") if fragments else None
 
-        for dirpath, dirnames, filenames in os.walk(current_scan_root, topdown=True):
-            abs_dirpath = os.path.abspath(dirpath)
-            dirnames[:] = [d for d in dirnames if d not in folders_to_ignore_names] 
+def compile_ignore_rules(folder_patterns, file_patterns):
+    """Compiles the configured ignore lists into one regex for directories and one for files (matched with fullmatch)."""
+    return {"dirs": _combine_regexes([_pattern_to_regex(p) for p in folder_patterns]),
+            "files": _combine_regexes([_pattern_to_regex(p) for p in file_patterns])}
 
+def compile_gitignore(lines, base=""):
+    """Compiles .gitignore lines into a rule set {"base", "ignore", "negate"}; each is a single regex over base-relative paths.
+
+    Directory-only rules ("build/") match the "/"-terminated form that directories are tested with. "!" rules re-include
+    anything an ignore rule of the same file matched (the common "*.log" + "!keep.log" case; strict last-match-wins
+    ordering within one file is not modelled). Returns None if the file has no rules.
+    """
+    ignore = []; negate = []
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if not line.endswith("\\ "): line = line.rstrip()
+        if not line or line.startswith("#"): continue
+        target = ignore
+        if line.startswith("!"): target = negate; line = line[1:]
+        if not line.strip("/"): continue
+        target.append(_pattern_to_regex(line) + ("/" if line.endswith("/") else "/?"))
+    if not ignore and not negate: return None
+    return {"base": base, "ignore": _combine_regexes(ignore), "negate": _combine_regexes(negate)}
+
+def load_gitignore(abs_dir, base):
+    """Reads and compiles abs_dir/.gitignore (None if missing, empty or unreadable)."""
+    try:
+        with open(os.path.join(abs_dir, ".gitignore"), "r", encoding="utf-8", errors="replace") as f: return compile_gitignore(f, base)
+    except OSError: return None
+
+def is_gitignored(rule_sets, rel_path, is_dir):
+    """Applies .gitignore rule sets from the root down; a deeper .gitignore overrides its parents. rel_path uses "/"."""
+    path = rel_path + "/" if is_dir else rel_path; ignored = False
+    for rules in rule_sets:
+        if not path.startswith(rules["base"]): continue
+        sub_path = path[len(rules["base"]):]
+        if rules["ignore"] and rules["ignore"].fullmatch(sub_path): ignored = True
+        if ignored and rules["negate"] and rules["negate"].fullmatch(sub_path): ignored = False
+    return ignored
+
+def _ancestor_gitignores(abs_root_dir, abs_dirpath):
+    """Rule sets from the .gitignore files between the root and abs_dirpath (exclusive), for scan roots below the root."""
+    rule_sets = []; rel_parts = os.path.relpath(abs_dirpath, abs_root_dir).split(os.sep)
+    if rel_parts == ["."]: return rule_sets
+    for depth in range(len(rel_parts)):
+        base = "/".join(rel_parts[:depth]) + "/" if depth else ""
+        rules = load_gitignore(os.path.join(abs_root_dir, *rel_parts[:depth]), base)
+        if rules: rule_sets.append(rules)
+    return rule_sets
+
+def scan_project(root_dir, subfolders_to_scan, folders_to_ignore_names, files_to_ignore_names, allowed_extensions, sitemap_filename=SITEMAP_FILENAME):
+    """Walks every directory under the scan roots exactly once (os.scandir) and returns a shared scan result.
+
+    The result dict holds the sitemap tree text, the sorted upload list and the (size, mtime) stat data
+    of every selected file, so later stages never need to walk or stat the tree again.
+    """
+    scan_start = time.time()
+    abs_root_dir = os.path.abspath(root_dir)
+    scan_roots = _resolve_scan_roots(abs_root_dir, subfolders_to_scan)
+    explicit_roots = set(scan_roots)
+    ignore_rules = compile_ignore_rules(folders_to_ignore_names, files_to_ignore_names)
+    ignored_dir_re = ignore_rules["dirs"]; ignored_file_re = ignore_rules["files"]
+    allowed_extensions = set(allowed_extensions)
+    tree_lines = []; selected_files = []; file_stats = {}; visited_dirs = set(); dirs_scanned = 0; dirs_pruned = 0; files_ignored = 0
+
+    if abs_root_dir in explicit_roots: tree_lines.append(f"{os.path.basename(abs_root_dir)}/")
+    for current_scan_root in scan_roots:
+        if current_scan_root in visited_dirs: continue # Already covered by an enclosing scan root.
+        stack = [(current_scan_root, _ancestor_gitignores(abs_root_dir, current_scan_root) if USE_GITIGNORE else [])]
+        while stack:
+            abs_dirpath, rule_sets = stack.pop()
+            if abs_dirpath in visited_dirs: continue
+            visited_dirs.add(abs_dirpath); dirs_scanned += 1
             relative_to_main_root = os.path.relpath(abs_dirpath, abs_root_dir)
             depth = relative_to_main_root.count(os.sep) if relative_to_main_root != '.' else 0
-            indent = '  ' * depth
-            current_dir_basename = os.path.basename(abs_dirpath)
+            if abs_dirpath != abs_root_dir: tree_lines.append(f"{'  ' * depth}├── {os.path.basename(abs_dirpath)}/")
+            rel_dir_prefix = relative_to_main_root.replace(os.sep, "/") + "/" if relative_to_main_root != '.' else ""
 
-            if abs_dirpath not in scan_roots_to_process and abs_dirpath not in processed_paths_for_tree:
-                tree_lines.append(f"{indent}├── {current_dir_basename}/")
-                processed_paths_for_tree.add(abs_dirpath)
-            
-            filenames.sort()
-            dir_files_to_list = []
-            for fn_item in filenames:
-                if fn_item != SITEMAP_FILENAME and \
-                   fn_item not in files_to_ignore_names and \
-                   os.path.splitext(fn_item)[1].lower() in allowed_extensions:
-                    dir_files_to_list.append(fn_item)
-
-            file_indent = '  ' * (depth + 1) 
-            for i, fn_item in enumerate(dir_files_to_list):
-                is_last = (i == len(dir_files_to_list) - 1)
-                prefix = "└── " if is_last and not dirnames else "├── " 
+            subdirs = []; tree_files = []
+            try:
+                with os.scandir(abs_dirpath) as dir_iter: dir_entries = list(dir_iter)
+                if USE_GITIGNORE and any(entry.name == ".gitignore" for entry in dir_entries):
+                    dir_rules = load_gitignore(abs_dirpath, rel_dir_prefix)
+                    if dir_rules: rule_sets = rule_sets + [dir_rules]
+                for entry in dir_entries:
+                    try:
+                        rel_path = rel_dir_prefix + entry.name
+                        if entry.is_dir():
+                            if entry.is_symlink(): continue
+                            # Ignored directories are pruned here, before descending. Explicit scan roots are always walked.
+                            if entry.path not in explicit_roots and ((ignored_dir_re and ignored_dir_re.fullmatch(rel_path))
+                                                                     or (rule_sets and is_gitignored(rule_sets, rel_path, True))):
+                                dirs_pruned += 1; continue
+                            subdirs.append(entry.name); continue
+                        fn_item = entry.name
+                        is_sitemap = bool(sitemap_filename) and fn_item == sitemap_filename
+                        if not is_sitemap and ((ignored_file_re and ignored_file_re.fullmatch(rel_path))
+                                               or (rule_sets and is_gitignored(rule_sets, rel_path, False))):
+                            files_ignored += 1; continue
+                        if not is_sitemap and os.path.splitext(fn_item)[1].lower() not in allowed_extensions: continue
+                        st = entry.stat()
+                        selected_files.append(entry.path); file_stats[entry.path] = (st.st_size, st.st_mtime)
+                        if not is_sitemap: tree_files.append(fn_item)
+                    except OSError as e_entry: print(f"  Warning: Could not read '{entry.path}': {e_entry}")
+            except OSError as e_dir:
+                print(f"  Warning: Could not scan directory '{abs_dirpath}': {e_dir}"); continue
+
+            subdirs.sort(); tree_files.sort()
+            file_indent = '  ' * (depth + 1)
+            for i, fn_item in enumerate(tree_files):
+                is_last = (i == len(tree_files) - 1)
+                prefix = "└── " if is_last and not subdirs else "├── "
                 tree_lines.append(f"{file_indent}{prefix}{fn_item}")
-            
-            if current_scan_root == abs_root_dir: 
-                 dirnames[:] = [d for d in dirnames if os.path.abspath(os.path.join(abs_dirpath, d)) not in scan_roots_to_process or os.path.abspath(os.path.join(abs_dirpath, d)) == abs_dirpath]
+            stack.extend((os.path.join(abs_dirpath, d), rule_sets) for d in reversed(subdirs))
 
     if not tree_lines: tree_lines.append("(No files or folders matching criteria found after filtering.)")
-    return "\n".join(tree_lines)
+    selected_files.sort()
+    return {"root": abs_root_dir, "tree_text": "\n".join(tree_lines), "files": selected_files, "file_stats": file_stats,
+            "dirs_scanned": dirs_scanned, "dirs_pruned": dirs_pruned, "files_ignored": files_ignored, "scan_seconds": time.time() - scan_start}
+
+def include_file_in_scan(scan_result, file_path):
+    """Adds a file created after the scan (e.g. the sitemap) to a scan result, keeping the list sorted and stats filled."""
+    file_path = os.path.abspath(file_path)
+    if not os.path.isfile(file_path): return scan_result
+    st = os.stat(file_path); scan_result["file_stats"][file_path] = (st.st_size, st.st_mtime)
+    if file_path not in scan_result["files"]:
+        scan_result["files"].append(file_path); scan_result["files"].sort()
+    return scan_result
 
 def save_tree_as_sitemap(file_tree_content, target_folder_path, sitemap_name):
     sitemap_path = os.path.join(target_folder_path, sitemap_name)
@@ -158,65 +550,719 @@ def save_tree_as_sitemap(file_tree_content, target_folder_path, sitemap_name):
         return sitemap_path
     except IOError as e: print(f"ERROR: Could not write sitemap: {e}"); return None
 
-def get_all_files_to_process(root_dir, subfolders_to_scan, folders_to_ignore_names, files_to_ignore_names, allowed_extensions, sitemap_filename_to_ensure_included=None):
-    all_selected_files = set()
+def hash_file(file_path, chunk_size=1024 * 1024):
+    """Returns the sha256 hex digest of a file, read in fixed-size chunks."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""): digest.update(chunk)
+    return digest.hexdigest()
+
+def load_manifest(target_folder_path, manifest_name=MANIFEST_FILENAME):
+    """Loads the upload manifest ({relative_path: {size, mtime, sha256}}). Returns an empty one if missing or unreadable."""
+    manifest_path = os.path.join(target_folder_path, manifest_name)
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f: manifest = json.load(f)
+        if isinstance(manifest.get("files"), dict): return manifest
+        print(f"Warning: Manifest '{manifest_path}' has an unexpected format. Ignoring it.")
+    except FileNotFoundError: pass
+    except (IOError, ValueError) as e: print(f"Warning: Could not read manifest '{manifest_path}': {e}")
+    return {"version": 1, "files": {}}
+
+def save_manifest(manifest, target_folder_path, manifest_name=MANIFEST_FILENAME):
+    """Writes the manifest atomically (temp file + replace) so an interrupted run never leaves it half-written."""
+    manifest_path = os.path.join(target_folder_path, manifest_name)
+    tmp_path = manifest_path + ".tmp"
+    try:
+        manifest["updated_at"] = time.strftime('%Y-%m-%d %H:%M:%S')
+        with open(tmp_path, "w", encoding="utf-8") as f: json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, manifest_path)
+        print(f"Upload manifest saved to: {manifest_path} ({len(manifest['files'])} files)")
+        return manifest_path
+    except (IOError, OSError) as e: print(f"ERROR: Could not write manifest: {e}"); return None
+
+def compute_upload_delta(scan_result, manifest, skip_paths=()):
+    """Compares a scan result against the manifest using a stat-first / hash-on-change strategy.
+
+    Files whose size and mtime match their manifest entry are unchanged and never read. Files whose stat
+    changed are hashed; if the hash still matches they only get their stat refreshed. Returns a dict with
+    the "added", "modified", "unchanged" and "removed" relative paths plus the fingerprint "entries" of
+    every current file (ready to be merged into the manifest after a successful upload). Changed files are
+    hashed in a thread pool (HASH_WORKERS).
+    """
+    root = scan_result["root"]; old_entries = manifest.get("files", {})
+    delta = {"added": [], "modified": [], "unchanged": [], "removed": [], "entries": {}, "hashed": 0}
+    to_hash = []
+    for abs_path in scan_result["files"]:
+        if abs_path in skip_paths: continue
+        rel_path = os.path.relpath(abs_path, root).replace(os.sep, "/")
+        size, mtime = scan_result["file_stats"].get(abs_path) or (None, None)
+        if size is None:
+            st = os.stat(abs_path); size, mtime = st.st_size, st.st_mtime
+        old = old_entries.get(rel_path)
+        if old and old.get("size") == size and old.get("mtime") == mtime and old.get("limits") == limits:
+            delta["unchanged"].append(rel_path); delta["entries"][rel_path] = old; continue
+        to_hash.append((abs_path, rel_path, size, mtime, old))
+
+    def safe_hash(item):
+        try: return hash_file(item[0])
+        except (IOError, OSError) as e: print(f"  Warning: Could not hash '{item[0]}': {e}"); return None
+    with ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="hash") as pool:
+        for (abs_path, rel_path, size, mtime, old), sha in zip(to_hash, pool.map(safe_hash, to_hash)):
+            delta["hashed"] += sha is not None
+            delta["entries"][rel_path] = {"size": size, "mtime": mtime, "sha256": sha}
+            if not old: delta["added"].append(rel_path)
+            elif sha is None or old.get("sha256") != sha: delta["modified"].append(rel_path)
+            else: delta["unchanged"].append(rel_path) # Touched but identical content.
+    delta["removed"] = sorted(set(old_entries) - set(delta["entries"]))
+    return delta
+
+def dedupe_files(file_paths, delta_entries, root):
+    """Keeps one representative (first in sorted order) per sha256. Returns (representatives, {representative: [aliases]}).
+
+    Files without a hash (unreadable) are always kept.
+    """
+    first_by_hash = {}; representatives = []; aliases = {}
+    for abs_path in sorted(file_paths):
+        sha = delta_entries.get(os.path.relpath(abs_path, root).replace(os.sep, "/"), {}).get("sha256")
+        representative = first_by_hash.get(sha) if sha else None
+        if representative is None:
+            representatives.append(abs_path)
+            if sha: first_by_hash[sha] = abs_path
+        else: aliases.setdefault(representative, []).append(abs_path)
+    return representatives, aliases
+
+def alias_sitemap_section(aliases, root):
+    """Text appended to the sitemap listing each identical copy and the uploaded file that holds its content."""
+    if not aliases: return ""
+    rel = lambda p: os.path.relpath(p, root).replace(os.sep, "/")
+    lines = ["", "", "Identical copies (content uploaded once, as the file after '='):"]
+    for representative, alias_paths in sorted(aliases.items()):
+        lines.extend(f"  {rel(alias_path)} = {rel(representative)}" for alias_path in alias_paths)
+    return "\n".join(lines)
+
+def record_uploaded_files(manifest, delta, uploaded_abs_paths, root):
+    """Merges the fingerprints of successfully uploaded files into the manifest and drops removed files."""
+    for rel_path in delta["unchanged"]: manifest["files"][rel_path] = delta["entries"][rel_path] # Refreshes stat of touched-but-identical files.
+    for abs_path in uploaded_abs_paths:
+        rel_path = os.path.relpath(abs_path, root).replace(os.sep, "/")
+        if rel_path in delta["entries"]: manifest["files"][rel_path] = delta["entries"][rel_path]
+    for rel_path in delta["removed"]: manifest["files"].pop(rel_path, None)
+    return manifest
+
+def new_journal(path=None):
+    """Checkpoint state for one conversation. Without a path it is kept in memory only (retries still use it)."""
+    return {"path": path, "conversation": None, "done": {}, "complete": False}
+
+def load_journal(target_folder_path, journal_name=JOURNAL_FILENAME):
+    """Reads the checkpoint journal of the last upload. Returns the journal state, or None if there is none.
+
+    "done" maps every project file recorded in a finished batch to its sha256. A torn last line (crash mid-write)
+    is skipped; all earlier records were fsynced before the next batch started.
+    """
+    journal = new_journal(os.path.join(target_folder_path, journal_name))
+    try:
+        with open(journal["path"], "r", encoding="utf-8") as f:
+            for line in f:
+                try: record = json.loads(line)
+                except ValueError: continue
+                kind = record.get("type")
+                if kind == "run": journal["complete"] = False
+                elif kind == "conversation": journal["conversation"] = record.get("url")
+                elif kind == "batch" and record.get("status") == "done": journal["done"].update(record.get("files", {}))
+                elif kind == "end": journal["complete"] = record.get("status") == "complete"
+    except FileNotFoundError: return None
+    except (IOError, OSError) as e: print(f"Warning: Could not read checkpoint journal '{journal['path']}': {e}"); return None
+    return journal
+
+def start_journal(target_folder_path, resume_from=None, journal_name=JOURNAL_FILENAME):
+    """Begins the journal for this run: a fresh upload replaces the previous journal, a resumed one appends to it."""
+    journal = resume_from or new_journal(os.path.join(target_folder_path, journal_name))
+    if not resume_from:
+        try: os.remove(journal["path"])
+        except FileNotFoundError: pass
+        except OSError as e: print(f"Warning: Could not remove old checkpoint journal: {e}")
+    append_journal(journal, {"type": "run", "resumed": bool(resume_from), "target": os.path.abspath(target_folder_path)})
+    return journal
+
+def append_journal(journal, record):
+    """Appends one record and fsyncs it, so a batch reported done survives a crash right after it."""
+    if not journal or not journal["path"]: return
+    record["time"] = time.strftime('%Y-%m-%d %H:%M:%S')
+    try:
+        with open(journal["path"], "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n"); f.flush(); os.fsync(f.fileno())
+    except (IOError, OSError) as e: print(f"Warning: Could not write checkpoint journal: {e}")
+
+def journal_batch(journal, i_batch, upload_paths, upload_plan, status, **fields):
+    """Records a batch (or one half of a split batch) with the project files it carries and their sha256."""
+    if not journal or not journal["path"]: return
+    root = upload_plan["scan_result"]["root"]; entries = upload_plan["upload_delta"]["entries"]; files = {}
+    for upload_path in upload_paths:
+        for abs_path in upload_plan["upload_members"].get(upload_path, []):
+            rel_path = os.path.relpath(abs_path, root).replace(os.sep, "/"); files[rel_path] = entries.get(rel_path, {}).get("sha256")
+    if status == "done": journal["done"].update(files)
+    append_journal(journal, dict({"type": "batch", "batch": i_batch + 1, "status": status, "files": files}, **fields))
+
+def note_conversation_url(journal, driver):
+    """Journals the conversation URL once Gemini has assigned one (after the first message), for --resume."""
+    try: url = driver.current_url
+    except WebDriverException: return
+    if journal is None or not url or url == journal["conversation"] or url.rstrip("/") == GEMINI_URL.rstrip("/"): return
+    journal["conversation"] = url; append_journal(journal, {"type": "conversation", "url": url})
+
+_TEXT_BYTES = bytes({7, 8, 9, 10, 12, 13, 27} | set(range(0x20, 0x100)) - {0x7f}) # Bytes that occur in text files.
+
+def format_bytes(size):
+    """Human-readable size: MB from 1 MB up, KB from 1 KB up, else bytes."""
+    if size >= 1048576: return f"{size / 1048576:.1f} MB"
+    return f"{size / 1024:.1f} KB" if size >= 1024 else f"{size} bytes"
+
+def classify_limits():
+    """The settings a sniff verdict depends on; cached verdicts made under different limits are sniffed again."""
+    return (f"{env_int('MAX_UPLOAD_FILE_BYTES', MAX_UPLOAD_FILE_BYTES)}|{env_int('MAX_UPLOAD_FILE_LINES', MAX_UPLOAD_FILE_LINES)}|"
+            f"{env_int('MINIFIED_AVG_LINE_LENGTH', MINIFIED_AVG_LINE_LENGTH)}|{CLASSIFY_SNIFF_BYTES}|{b','.join(GENERATED_FILE_MARKERS).decode()}")
+
+def sniff_file(abs_path, size, max_bytes=None, max_lines=None):
+    """Classifies one file from its size and a bounded read of its head. Returns None if uploadable, else the exclusion reason."""
+    max_bytes = max_bytes or env_int("MAX_UPLOAD_FILE_BYTES", MAX_UPLOAD_FILE_BYTES); max_lines = max_lines or env_int("MAX_UPLOAD_FILE_LINES", MAX_UPLOAD_FILE_LINES)
+    if size > max_bytes: return f"too large ({format_bytes(size)} > {format_bytes(max_bytes)})"
+    if size == 0: return None
+    with open(abs_path, "rb") as f: sample = f.read(CLASSIFY_SNIFF_BYTES)
+    if not sample: return None
+    if b"\0" in sample: return "binary (NUL bytes)"
+    if len(sample.translate(None, _TEXT_BYTES)) > len(sample) * 0.3: return "binary (non-text bytes)"
+    newlines = sample.count(b"\n")
+    estimated_lines = size * newlines / len(sample) if size > len(sample) else newlines + 1
+    if estimated_lines > max_lines: return f"too many lines (~{int(estimated_lines):,} > {max_lines:,})"
+    average_line = len(sample) / (newlines + 1)
+    if len(sample) >= 1024 and average_line > env_int("MINIFIED_AVG_LINE_LENGTH", MINIFIED_AVG_LINE_LENGTH):
+        return f"minified (average line {int(average_line):,} chars)"
+    head = sample[:1024].lower()
+    marker = next((m for m in GENERATED_FILE_MARKERS if m in head), None)
+    if marker: return f"generated ('{marker.decode()}' marker)"
+    return None
+
+def classify_files(scan_result, manifest, skip_paths=()):
+    """Sniffs every scanned file (thread pool, cached by path/size/mtime and classify_limits() in manifest["classified"]).
+
+    Returns {"excluded": {abs_path: reason}, "sniffed": n, "cached": n} and refreshes the manifest cache in place.
+    """
+    root = scan_result["root"]; old_cache = manifest.get("classified", {}); new_cache = {}
+    excluded = {}; to_sniff = []; cached = 0; limits = classify_limits()
+    for abs_path in scan_result["files"]:
+        if abs_path in skip_paths: continue
+        rel_path = os.path.relpath(abs_path, root).replace(os.sep, "/")
+        size, mtime = scan_result["file_stats"][abs_path]
+        old = old_cache.get(rel_path)
+        if old and old.get("size") == size and old.get("mtime") == mtime and old.get("limits") == limits:
+            new_cache[rel_path] = old; cached += 1
+            if old.get("reason"): excluded[abs_path] = old["reason"]
+        else: to_sniff.append((abs_path, rel_path, size, mtime))
+
+    def sniff(item):
+        abs_path, _, size, _ = item
+        try: return sniff_file(abs_path, size)
+        except OSError as e: return f"unreadable ({e.strerror or e})"
+    if to_sniff:
+        with ThreadPoolExecutor(max_workers=CLASSIFY_WORKERS, thread_name_prefix="classify") as pool:
+            for (abs_path, rel_path, size, mtime), reason in zip(to_sniff, pool.map(sniff, to_sniff)):
+                new_cache[rel_path] = {"size": size, "mtime": mtime, "limits": limits, "reason": reason}
+                if reason: excluded[abs_path] = reason
+    manifest["classified"] = new_cache
+    return {"excluded": excluded, "sniffed": len(to_sniff), "cached": cached}
+
+def print_exclusion_report(excluded, root, max_listed=10):
+    """Prints excluded files grouped by reason (largest groups first)."""
+    if not excluded: return
+    by_kind = {}
+    for abs_path, reason in excluded.items(): by_kind.setdefault(reason.split(" (")[0], []).append((abs_path, reason))
+    print(f"Excluded {len(excluded)} files after content checks (listed at the end of the sitemap):")
+    for kind, items in sorted(by_kind.items(), key=lambda kv: -len(kv[1])):
+        print(f"  {kind}: {len(items)} files")
+        for abs_path, reason in sorted(items)[:max_listed]: print(f"    {os.path.relpath(abs_path, root)} - {reason}")
+        if len(items) > max_listed: print(f"    ... and {len(items) - max_listed} more")
+
+def exclusion_sitemap_section(excluded, root):
+    """Text appended to the sitemap so the model still knows which files exist but were not uploaded, and why."""
+    if not excluded: return ""
+    lines = ["", "", "Not uploaded (content checks):"]
+    lines.extend(f"  {os.path.relpath(p, root).replace(os.sep, '/')} - {reason}" for p, reason in sorted(excluded.items()))
+    return "\n".join(lines)
+
+def estimate_tokens(size_bytes):
+    """Rough token estimate for a text file of the given size."""
+    return -(-size_bytes // ESTIMATED_BYTES_PER_TOKEN)
+
+def pack_file_batches(file_list, file_stats, max_files=None, max_bytes=None, max_tokens=None, pinned_first=None):
+    """Bin-packs files into as few batches as possible within the file-count, byte and estimated-token budgets.
+
+    Uses first-fit decreasing on the sizes already collected by scan_project (file_stats). A file that is
+    larger than a whole budget gets a batch of its own. pinned_first (a path or list of paths, e.g. the
+    sitemap) is always placed in the first batch. Returns (batches, packing_report).
+    """
+    max_files = max_files or env_int("UPLOAD_BATCH_SIZE", UPLOAD_BATCH_SIZE)
+    max_bytes = max_bytes or env_int("UPLOAD_BATCH_MAX_BYTES", UPLOAD_BATCH_MAX_BYTES)
+    max_tokens = max_tokens or env_int("UPLOAD_BATCH_MAX_TOKENS", UPLOAD_BATCH_MAX_TOKENS)
+    if not file_list: return [], {"batches": 0, "files": 0}
+
+    def size_of(path):
+        if path in file_stats: return file_stats[path][0]
+        try: return os.path.getsize(path)
+        except OSError: return 0
+
+    sizes = {path: size_of(path) for path in file_list}
+    pinned = [p for p in ([pinned_first] if isinstance(pinned_first, str) else (pinned_first or [])) if p in sizes]
+    items = sorted((p for p in file_list if p not in pinned), key=lambda p: (-sizes[p], p))
+    smallest = min(sizes[p] for p in items) if items else 0
+    batches = [] # Each batch: [paths, bytes, tokens]
+    open_batches = [] # Batches that can still take at least the smallest remaining file.
+    if pinned:
+        first = [list(pinned), sum(sizes[p] for p in pinned), sum(estimate_tokens(sizes[p]) for p in pinned)]
+        batches.append(first); open_batches.append(first)
+    oversized = 0
+    for path in items:
+        size = sizes[path]; tokens = estimate_tokens(size); target = None
+        for batch in open_batches:
+            if len(batch[0]) < max_files and batch[1] + size <= max_bytes and batch[2] + tokens <= max_tokens:
+                target = batch; break
+        if target is None:
+            if size > max_bytes or tokens > max_tokens: oversized += 1
+            target = [[], 0, 0]; batches.append(target); open_batches.append(target)
+        target[0].append(path); target[1] += size; target[2] += tokens
+        if len(target[0]) >= max_files or target[1] + smallest > max_bytes or target[2] + estimate_tokens(smallest) > max_tokens:
+            open_batches.remove(target)
+
+    head = [batches.pop(0)] if pinned else []
+    for batch in head + batches: batch[0] = [p for p in batch[0] if p in pinned] + sorted(p for p in batch[0] if p not in pinned)
+    batches = head + sorted(batches, key=lambda b: b[0][0])
+
+    total_bytes = sum(sizes.values()); n = len(batches)
+    report = {"batches": n, "files": len(file_list), "bytes": total_bytes,
+              "fixed_count_batches": -(-len(file_list) // max_files), "oversized_files": oversized,
+              "fill_files": len(file_list) / (n * max_files), "fill_bytes": total_bytes / (n * max_bytes),
+              "fill_tokens": sum(b[2] for b in batches) / (n * max_tokens)}
+    print(f"Packed {report['files']} files ({total_bytes / 1024:.1f} KB) into {n} batches "
+          f"(fixed-count batching would need {report['fixed_count_batches']}). Limits: {max_files} files, "
+          f"{max_bytes / 1024:.0f} KB, {max_tokens} est. tokens per batch.")
+    print(f"  Packing efficiency: files {report['fill_files']:.0%}, bytes {report['fill_bytes']:.0%}, "
+          f"tokens {report['fill_tokens']:.0%} of batch capacity used on average.")
+    if oversized: print(f"  Warning: {oversized} file(s) exceed a whole batch budget on their own and were given their own batch.")
+    return [b[0] for b in batches], report
+
+def bundle_files(file_list, root_dir, file_stats, max_bundle_bytes=None, output_dir=None, keep_separate=(), source_paths=None):
+    """Streams files into a few size-capped bundle files with path headers and writes an index of where each file landed.
+
+    Each file is written as "===== FILE: <relative path> (<n> bytes) =====", its content, then "===== END FILE: <relative path> =====".
+    Files in keep_separate (e.g. the sitemap) and files larger than the cap are passed through unbundled.
+    source_paths maps workspace copies (e.g. compacted files) to the project file they stand for, for headers and members.
+    Returns a dict with "dir", "upload_list" (bundles + pass-through files), "members" ({upload_path: [original paths]})
+    and "index_path".
+    """
+    max_bundle_bytes = max_bundle_bytes or env_int("BUNDLE_MAX_BYTES", BUNDLE_MAX_BYTES)
+    output_dir = output_dir or tempfile.mkdtemp(prefix="gemini_bundles_")
+    os.makedirs(output_dir, exist_ok=True) # A caller-chosen output_dir (e.g. a shard's bundles/) may not exist yet.
+    abs_root_dir = os.path.abspath(root_dir); source_paths = source_paths or {}
+    members = {}; index = {"bundles": {}, "files": {}}
+    bundle_f = None; bundle_path = None; bundle_bytes = 0
+
+    def start_bundle():
+        nonlocal bundle_f, bundle_path, bundle_bytes
+        if bundle_f: bundle_f.close()
+        bundle_path = os.path.join(output_dir, f"bundle_{len(index['bundles']) + 1:03d}.txt")
+        bundle_f = open(bundle_path, "wb"); bundle_bytes = 0
+        index["bundles"][os.path.basename(bundle_path)] = []; members[bundle_path] = []
+
+    try:
+        for abs_path in file_list:
+            size = file_stats[abs_path][0] if abs_path in file_stats else os.path.getsize(abs_path)
+            source_path = source_paths.get(abs_path, abs_path)
+            if abs_path in keep_separate or size > max_bundle_bytes:
+                members[abs_path] = [source_path]; continue
+            rel_path = os.path.relpath(source_path, abs_root_dir).replace(os.sep, "/")
+            header = f"===== FILE: {rel_path} ({size} bytes) =====\n".encode("utf-8")
+            footer = f"===== END FILE: {rel_path} =====\n\n".encode("utf-8")
+            if bundle_f is None or bundle_bytes + len(header) + size + len(footer) + 1 > max_bundle_bytes: start_bundle()
+            offset = bundle_bytes
+            bundle_f.write(header)
+            with open(abs_path, "rb") as src:
+                shutil.copyfileobj(src, bundle_f, 1024 * 1024)
+                ends_with_newline = True
+                if size: src.seek(-1, os.SEEK_END); ends_with_newline = src.read(1) == b"\n"
+            if not ends_with_newline: bundle_f.write(b"\n")
+            bundle_f.write(footer)
+            bundle_bytes = bundle_f.tell()
+            bundle_name = os.path.basename(bundle_path)
+            index["files"][rel_path] = {"bundle": bundle_name, "offset": offset, "length": bundle_bytes - offset}
+            index["bundles"][bundle_name].append(rel_path); members[bundle_path].append(source_path)
+    finally:
+        if bundle_f: bundle_f.close()
+
+    index_path = os.path.join(output_dir, BUNDLE_INDEX_FILENAME)
+    with open(index_path, "w", encoding="utf-8") as f: json.dump(index, f, indent=1)
+    members[index_path] = []
+    bundled_count = len(index["files"])
+    print(f"Bundle mode: packed {bundled_count} files into {len(index['bundles'])} bundles in '{output_dir}' "
+          f"({len(members) - len(index['bundles']) - 1} files uploaded unbundled). Index: {index_path}")
+    return {"dir": output_dir, "upload_list": list(members), "members": members, "index_path": index_path}
+
+_LICENSE_MARKERS = ("license", "copyright", "spdx-license-identifier", "(c)", "all rights reserved")
+
+def _truncate_giant_literals(line, max_literal, max_line, quotes="", comment_starts=()):
+    """Shortens over-long string literals (quotes = the language's quote characters; none for prose) in the code part
+    of the line, before any trailing comment, then cuts the line itself if it is still longer than max_line."""
+    if quotes and len(line) > max_literal:
+        code_end = _trailing_comment_start(line, quotes, comment_starts)
+        line = _literal_regex(max_literal, quotes).sub(lambda m: m.group(1) + m.group(2)[:max_literal // 2] + f"...[{len(m.group(2)) - max_literal // 2} chars truncated]" + m.group(1), line[:code_end]) + line[code_end:]
+    if len(line) > max_line: line = line[:max_line] + f" ...[{len(line) - max_line} chars truncated]"
+    return line
+
+def _trailing_comment_start(line, quotes, comment_starts):
+    """Index where a comment starts outside string literals, or len(line)."""
+    quote = None; i = 0
+    while i < len(line):
+        ch = line[i]
+        if quote:
+            if ch == "\\": i += 1
+            elif ch == quote: quote = None
+        elif ch in quotes: quote = ch
+        elif comment_starts and line.startswith(comment_starts, i): return i
+        i += 1
+    return len(line)
+
+_LITERAL_REGEX_CACHE = {}
+
+def _literal_regex(min_length, quotes):
+    """Regex for a literal in one of the quote characters longer than min_length (escapes respected, single line)."""
+    if (min_length, quotes) not in _LITERAL_REGEX_CACHE:
+        _LITERAL_REGEX_CACHE[(min_length, quotes)] = re.compile(r"""([%s])((?:(?!\1)[^\\\n]|\\.){%d,})\1""" % (re.escape(quotes), min_length + 1))
+    return _LITERAL_REGEX_CACHE[(min_length, quotes)]
+
+def _open_multiline_string(line, open_string, quotes, delimiters, comment_starts):
+    """Returns the multi-line string delimiter still open at the end of line (None if none), given the one open at its start."""
+    i = 0
+    while i < len(line):
+        if open_string:
+            if line[i] == "\\": i += 2; continue
+            if line.startswith(open_string, i): i += len(open_string); open_string = None; continue
+            i += 1; continue
+        opener = next((d for d in delimiters if line.startswith(d, i)), None)
+        if opener: open_string = opener; i += len(opener); continue
+        if line[i] in quotes: # A single-line literal: skip to its closing quote.
+            j = i + 1
+            while j < len(line) and line[j] != line[i]: j += 2 if line[j] == "\\" else 1
+            i = j + 1; continue
+        if comment_starts and line.startswith(comment_starts, i): return None
+        i += 1
+    return open_string
+
+def _leading_comment_block(lines, line_prefixes, block):
+    """Returns (start, end) line indexes of the comment block at the top of the file (after shebang/encoding lines), or None."""
+    i = 0
+    while i < len(lines) and (lines[i].startswith("#!") or (i < 2 and lines[i].startswith("#") and "coding" in lines[i])): i += 1
+    while i < len(lines) and not lines[i].strip(): i += 1
+    start = i
+    if block and i < len(lines) and lines[i].lstrip().startswith(block[0]):
+        rest = lines[i].lstrip()[len(block[0]):]
+        while block[1] not in rest:
+            i += 1
+            if i >= len(lines): return None
+            rest = lines[i]
+        if rest.split(block[1], 1)[1].strip(): return None # Code continues after the comment on the same line.
+        return (start, i + 1)
+    while i < len(lines) and line_prefixes and lines[i].lstrip().startswith(line_prefixes): i += 1
+    return (start, i) if i > start else None
+
+def compact_text(text, ext, strip_comments=False, max_literal=COMPACT_MAX_LITERAL_CHARS, max_line=COMPACT_MAX_LINE_CHARS):
+    """Applies the compaction passes to one file's text. Returns the compacted text."""
+    line_prefixes, block = COMPACT_COMMENT_SYNTAX.get(ext, ((), None))
+    lines = text.split("\n")
+    header = _leading_comment_block(lines[:COMPACT_LICENSE_SCAN_LINES + 5], line_prefixes, block)
+    if header and header[1] <= COMPACT_LICENSE_SCAN_LINES and any(m in "\n".join(lines[header[0]:header[1]]).lower() for m in _LICENSE_MARKERS):
+        note = f"{line_prefixes[0]} [license header removed]" if line_prefixes else f"{block[0]} [license header removed] {block[1]}"
+        lines = lines[:header[0]] + [note] + lines[header[1]:]
+    quotes = COMPACT_STRING_QUOTES.get(ext, ""); comment_starts = tuple(line_prefixes) + ((block[0],) if block else ())
+    delimiters = COMPACT_MULTILINE_STRINGS.get(ext, ()); open_string = None
+    out = []; in_block = False; in_comment = False; previous_blank = True
+    for i, line in enumerate(lines):
+        if open_string: # Inside a multi-line string (docstring, template literal): its contents are kept as they are.
+            open_string = _open_multiline_string(line, open_string, quotes, delimiters, ())
+            out.append(line.rstrip("\r")); previous_blank = False; continue
+        line = line.rstrip(); stripped = line.lstrip()
+        comment_line = in_comment or bool(line_prefixes and stripped.startswith(line_prefixes)) # Comment text is prose: no literal truncation.
+        if in_comment: in_comment = block[1] not in stripped
+        elif block and stripped.startswith(block[0]): comment_line = True; in_comment = block[1] not in stripped[len(block[0]):]
+        if strip_comments:
+            stripped = line.lstrip()
+            if in_block:
+                if block[1] in stripped: in_block = False
+                continue
+            if block and stripped.startswith(block[0]) and not stripped.startswith(block[0] + "!"):
+                end_at = stripped.find(block[1], len(block[0]))
+                if end_at == -1: in_block = True; continue
+                if not stripped[end_at + len(block[1]):].strip(): continue # Whole line is one block comment.
+            if line_prefixes and stripped.startswith(line_prefixes) and not (i == 0 and stripped.startswith("#!")): continue
+        if not line:
+            if previous_blank: continue
+            previous_blank = True; out.append(line); continue
+        previous_blank = False
+        if delimiters and not comment_line: open_string = _open_multiline_string(line, None, quotes, delimiters, comment_starts)
+        out.append(_truncate_giant_literals(line, max_literal, max_line, "" if comment_line else quotes, comment_starts))
+    while out and not out[-1]: out.pop()
+    return "\n".join(out) + "\n" if out else ""
+
+def _compaction_cache_key(abs_path, size, mtime, strip_comments):
+    options = f"{strip_comments}|{COMPACT_MAX_LITERAL_CHARS}|literals-v2|multiline-strings|{COMPACT_MAX_LINE_CHARS}|{COMPACT_LICENSE_SCAN_LINES}"
+    return hashlib.sha256(f"{abs_path}|{size}|{mtime}|{options}".encode("utf-8", "surrogateescape")).hexdigest()
+
+def compact_files(file_list, root_dir, file_stats, output_dir=None, strip_comments=None, cache_dir=None):
+    """Writes compacted copies of file_list into a workspace that mirrors the project layout.
+
+    Each file goes through compact_text; results are cached in cache_dir by path, size, mtime and options,
+    so unchanged files are copied from the cache instead of being transformed again.
+    Files that would not shrink are left out of "paths" and uploaded unchanged.
+    Returns {"dir", "paths" ({original: compacted copy}), "files" ([(original, bytes_before, bytes_after)]), "cached"}.
+    """
+    strip_comments = COMPACT_STRIP_COMMENTS if strip_comments is None else strip_comments
+    output_dir = output_dir or tempfile.mkdtemp(prefix="gemini_compact_")
+    cache_dir = cache_dir or COMPACT_CACHE_DIR
     abs_root_dir = os.path.abspath(root_dir)
-    actual_scan_paths = []
-    if "" in subfolders_to_scan and os.path.isdir(abs_root_dir): actual_scan_paths.append(abs_root_dir)
-    for subfolder_rel_path in subfolders_to_scan:
-        if subfolder_rel_path:
-            current_scan_path = os.path.abspath(os.path.join(abs_root_dir, subfolder_rel_path))
-            if os.path.isdir(current_scan_path) and current_scan_path not in actual_scan_paths: actual_scan_paths.append(current_scan_path)
-    if not actual_scan_paths: print(f"No valid dirs to scan in root: '{abs_root_dir}'."); return []
-    for scan_path_abs in actual_scan_paths:
-        for dirpath, dirnames, filenames in os.walk(scan_path_abs, topdown=True):
-            dirnames[:] = [d for d in dirnames if d not in folders_to_ignore_names]
-            for filename in filenames:
-                if filename in files_to_ignore_names and filename != sitemap_filename_to_ensure_included: continue
-                if os.path.splitext(filename)[1].lower() in allowed_extensions or \
-                   (sitemap_filename_to_ensure_included and filename == sitemap_filename_to_ensure_included):
-                    all_selected_files.add(os.path.join(dirpath, filename))
-    if sitemap_filename_to_ensure_included: 
-        sitemap_full_path = os.path.join(abs_root_dir, sitemap_filename_to_ensure_included)
-        if os.path.exists(sitemap_full_path) and sitemap_full_path not in all_selected_files: 
-            all_selected_files.add(sitemap_full_path)
-    if not all_selected_files: print("No files matching criteria found for upload.")
-    else: print(f"Found {len(all_selected_files)} unique files to process for upload.")
-    return sorted(list(all_selected_files))
-
-def batch_files(file_list, default_batch_size=10):
-    """Splits a list of files into batches. Batch size can be configured via .env UPLOAD_BATCH_SIZE."""
-    if not file_list: return []
+    try: os.makedirs(cache_dir, exist_ok=True)
+    except OSError: cache_dir = None
+    paths = {}; report = []; cached = 0
+    for abs_path in file_list:
+        size, mtime = file_stats[abs_path] if abs_path in file_stats else (os.path.getsize(abs_path), os.path.getmtime(abs_path))
+        out_path = os.path.join(output_dir, os.path.relpath(abs_path, abs_root_dir))
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        cache_path = os.path.join(cache_dir, _compaction_cache_key(abs_path, size, mtime, strip_comments)) if cache_dir else None
+        if cache_path and os.path.isfile(cache_path):
+            shutil.copyfile(cache_path, out_path); cached += 1
+        else:
+            try:
+                with open(abs_path, "r", encoding="utf-8", errors="surrogateescape") as src: text = src.read()
+                compacted = compact_text(text, os.path.splitext(abs_path)[1].lower(), strip_comments)
+                with open(out_path, "w", encoding="utf-8", errors="surrogateescape", newline="\n") as dst: dst.write(compacted)
+            except (OSError, ValueError) as e:
+                print(f"  Warning: Could not compact '{abs_path}' ({e}), uploading it unchanged."); continue
+            if cache_path:
+                try: shutil.copyfile(out_path, cache_path)
+                except OSError: pass
+        compacted_size = os.path.getsize(out_path)
+        if compacted_size >= size: # Nothing to gain; upload the original file as-is.
+            os.remove(out_path); report.append((abs_path, size, size)); continue
+        paths[abs_path] = out_path; report.append((abs_path, size, compacted_size))
+    return {"dir": output_dir, "paths": paths, "files": report, "cached": cached}
+
+def print_compaction_report(compaction, root, top=10):
+    """Prints total bytes/estimated tokens saved and the files that shrank the most."""
+    before = sum(r[1] for r in compaction["files"]); after = sum(r[2] for r in compaction["files"])
+    print(f"Compaction: {len(compaction['files'])} files ({compaction['cached']} from cache), {before / 1024:.1f} KB -> {after / 1024:.1f} KB, "
+          f"saved {(before - after) / 1024:.1f} KB (~{estimate_tokens(before) - estimate_tokens(after):,} tokens, "
+          f"{100 * (before - after) / before if before else 0:.0f}%).")
+    for abs_path, size_before, size_after in sorted(compaction["files"], key=lambda r: r[2] - r[1])[:top]:
+        if size_before <= size_after: break
+        print(f"  {os.path.relpath(abs_path, root)}: {size_before:,} -> {size_after:,} bytes (~{estimate_tokens(size_before) - estimate_tokens(size_after):,} tokens saved)")
+
+def cleanup_upload_plan(upload_plan):
+    """Removes the temp bundle and compaction workspaces of an upload plan."""
+    if not upload_plan: return
+    for key in ("bundle_result", "compaction"):
+        if upload_plan.get(key): shutil.rmtree(upload_plan[key]["dir"], ignore_errors=True)
+
+_TRACE_STATE = {"file": None, "run_id": None, "lock": threading.Lock()}
+
+def _write_trace_record(record):
+    with _TRACE_STATE["lock"]:
+        if _TRACE_STATE["file"]:
+            _TRACE_STATE["file"].write(json.dumps(record, default=str) + "\n"); _TRACE_STATE["file"].flush()
+
+def start_trace(trace_dir=TRACE_DIR, **run_info):
+    """Opens this run's JSONL trace file and writes a run_start record. Returns the trace path (None if disabled/failed)."""
+    if not TRACE_ENABLED: return None
+    run_id = time.strftime('%Y%m%d-%H%M%S') + f"-{os.getpid()}"
     try:
-        batch_size_env = os.environ.get("UPLOAD_BATCH_SIZE")
-        batch_size = int(batch_size_env) if batch_size_env else default_batch_size
-        if batch_size <= 0: batch_size = default_batch_size
-    except (ValueError, TypeError): # Catch if UPLOAD_BATCH_SIZE is not a valid int or not set
-        batch_size = default_batch_size
-    print(f"Using batch size: {batch_size} for file uploads.")
-    for i in range(0, len(file_list), batch_size): 
-        yield file_list[i:i + batch_size]
-
-def call_pyautogui_image_clicker(image_filename_to_click, clicker_script_name=NATIVE_POPUP_CLICKER_SCRIPT_NAME, timeout_subproc=20, confidence=0.8, attempts=5):
-    """Calls the PyAutoGUI script that clicks based on an image (for native OS pop-ups)."""
-    current_script_dir = os.path.dirname(os.path.abspath(__file__))
-    clicker_script_full_path = os.path.join(current_script_dir, clicker_script_name)
-    # Image filename is passed; clicker script assumes it's in its own directory
-    
-    if not os.path.exists(clicker_script_full_path):
-        print(f"SELENIUM_ERROR: PyAutoGUI (image) clicker script '{clicker_script_name}' not found at '{clicker_script_full_path}'.")
-        return False
-    
-    print(f"SELENIUM: Running PyAutoGUI (image) to click native pop-up button image: '{image_filename_to_click}'")
+        os.makedirs(trace_dir, exist_ok=True)
+        trace_path = os.path.join(trace_dir, f"trace_{run_id}.jsonl")
+        _TRACE_STATE["file"] = open(trace_path, "a", encoding="utf-8"); _TRACE_STATE["run_id"] = run_id
+    except OSError as e: print(f"Warning: Could not open trace file in '{trace_dir}': {e}"); return None
+    _write_trace_record({"type": "run_start", "run": run_id, "ts": time.time(), **run_info})
+    print(f"Tracing this run to: {trace_path}")
+    return trace_path
+
+def end_trace(**summary):
+    """Writes the run_end record and closes the trace file."""
+    if not _TRACE_STATE["file"]: return
+    _write_trace_record({"type": "run_end", "run": _TRACE_STATE["run_id"], "ts": time.time(), **summary})
+    with _TRACE_STATE["lock"]:
+        _TRACE_STATE["file"].close(); _TRACE_STATE["file"] = None
+
+@contextlib.contextmanager
+def trace_span(phase, **attrs):
+    """Times a phase and writes it as one span record (phase, start, end, duration, ok, plus attrs such as batch/files/bytes).
+
+    Yields the attrs dict so the body can add values found along the way (e.g. span["chips"] = n).
+    """
+    start = time.time(); ok = True; error = None
+    try: yield attrs
+    except BaseException as e: ok = False; error = str(e).splitlines()[0] if str(e) else type(e).__name__; raise
+    finally:
+        end = time.time()
+        _write_trace_record({"type": "span", "run": _TRACE_STATE["run_id"], "phase": phase, "start": start, "end": end,
+                             "duration": end - start, "ok": ok, "error": error, **attrs})
+
+WAIT_RECORDS = [] # One entry per adaptive wait: {"name", "elapsed", "replaced_sleep", "met"}.
+REMOVED_SLEEPS = [] # One entry per fixed sleep that was deleted outright (nothing waits in its place): {"name", "seconds"}.
+
+def record_wait(wait_name, elapsed, replaced_sleep=0.0, met=True):
+    """Records how long a wait actually took versus the fixed sleep it replaced."""
+    WAIT_RECORDS.append({"name": wait_name, "elapsed": elapsed, "replaced_sleep": replaced_sleep, "met": met})
+
+def record_removed_sleep(sleep_name, seconds):
+    """Records a fixed sleep that was deleted without a wait replacing it."""
+    REMOVED_SLEEPS.append({"name": sleep_name, "seconds": seconds})
+
+def adaptive_wait(driver, wait_name, condition, replaced_sleep=0.0, ceiling=None, required=False, poll_frequency=0.1):
+    """Waits until condition(driver) is truthy, up to the configured ceiling for wait_name, and records the actual duration.
+
+    On timeout it returns None (like the fixed sleep it replaces, the flow just continues) unless required=True,
+    in which case the TimeoutException is re-raised.
+    """
+    ceiling = ceiling or ADAPTIVE_WAIT_CEILINGS.get(wait_name, 10)
+    start_time = time.time()
     try:
-        command = [sys.executable, clicker_script_full_path, "--image", image_filename_to_click,
-                   "--confidence", str(confidence), "--attempts", str(attempts)]
-        run_result = subprocess.run(command, capture_output=True, text=True, timeout=timeout_subproc, check=False)
-        print(f"  PyAutoGUI (image) script for '{image_filename_to_click}' finished with code: {run_result.returncode}")
-        if run_result.stdout: print(f"    PyAutoGUI (image) Output: {run_result.stdout.strip()}")
-        if run_result.stderr: print(f"    PyAutoGUI (image) Error: {run_result.stderr.strip()}")
-        return run_result.returncode == 0
-    except Exception as e: print(f"SELENIUM_ERROR running PyAutoGUI (image) for '{image_filename_to_click}': {e}"); return False
+        result = WebDriverWait(driver, ceiling, poll_frequency=poll_frequency).until(condition)
+        record_wait(wait_name, time.time() - start_time, replaced_sleep, True); return result
+    except TimeoutException:
+        record_wait(wait_name, time.time() - start_time, replaced_sleep, False)
+        if required: raise
+        print(f"  Note: '{wait_name}' condition not met within {ceiling}s, continuing.")
+        return None
+
+def print_wait_summary():
+    """Prints how much fixed-sleep time the adaptive waits and the deleted sleeps saved in this run."""
+    if REMOVED_SLEEPS:
+        removed_by_name = {}
+        for r in REMOVED_SLEEPS: agg = removed_by_name.setdefault(r["name"], [0, 0.0]); agg[0] += 1; agg[1] += r["seconds"]
+        print(f"\nSleeps removed: {len(REMOVED_SLEEPS)} fixed sleeps ({sum(r['seconds'] for r in REMOVED_SLEEPS):.1f}s) deleted outright.")
+        for sleep_name, (count, seconds) in sorted(removed_by_name.items()): print(f"  {sleep_name}: {count}x, {seconds:.1f}s")
+    if not WAIT_RECORDS: return
+    replaced = sum(r["replaced_sleep"] for r in WAIT_RECORDS); actual = sum(r["elapsed"] for r in WAIT_RECORDS)
+    print(f"\nAdaptive waits: {len(WAIT_RECORDS)} waits took {actual:.1f}s in place of {replaced:.1f}s of fixed sleeps "
+          f"({replaced - actual:.1f}s removed).")
+    by_name = {}
+    for r in WAIT_RECORDS:
+        agg = by_name.setdefault(r["name"], [0, 0.0, 0.0, 0]); agg[0] += 1; agg[1] += r["elapsed"]; agg[2] += r["replaced_sleep"]; agg[3] += 0 if r["met"] else 1
+    for wait_name, (count, elapsed, replaced_sleep, timeouts) in sorted(by_name.items()):
+        print(f"  {wait_name}: {count}x, {elapsed:.1f}s actual vs {replaced_sleep:.1f}s fixed" + (f", {timeouts} hit the ceiling" if timeouts else ""))
+
+_LOCATOR_REGISTRY = {"stats": None, "lock": threading.Lock(), "lost": {}} # lost: group -> [failed attempts, seconds] this run.
+
+def _locator_key(locator): return f"{locator[0]}={locator[1]}"
+
+def load_locator_stats():
+    """Loads (once) the persisted {group: {"last_winner", "locators": {key: {"ok", "failed", "ok_seconds"}}}} stats."""
+    with _LOCATOR_REGISTRY["lock"]:
+        if _LOCATOR_REGISTRY["stats"] is None:
+            stats = {}
+            if LOCATOR_LEARNING_ENABLED and os.path.isfile(LOCATOR_STATS_PATH):
+                try:
+                    with open(LOCATOR_STATS_PATH, "r", encoding="utf-8") as f: stats = json.load(f)
+                except (OSError, ValueError) as e: print(f"Warning: Could not read locator stats '{LOCATOR_STATS_PATH}' ({e}), starting fresh.")
+            _LOCATOR_REGISTRY["stats"] = stats
+        return _LOCATOR_REGISTRY["stats"]
+
+def save_locator_stats():
+    """Writes the locator stats atomically (temp file + replace)."""
+    if not LOCATOR_LEARNING_ENABLED or _LOCATOR_REGISTRY["stats"] is None: return
+    with _LOCATOR_REGISTRY["lock"]:
+        tmp_path = LOCATOR_STATS_PATH + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f: json.dump(_LOCATOR_REGISTRY["stats"], f, indent=1, sort_keys=True)
+            os.replace(tmp_path, LOCATOR_STATS_PATH)
+        except OSError as e: print(f"Warning: Could not save locator stats to '{LOCATOR_STATS_PATH}': {e}")
+
+def order_locators(group, locators):
+    """Returns the locators in try order: last winner first, then by success rate (Laplace-smoothed), ties in listed order."""
+    group_stats = load_locator_stats().get(group, {}); per_locator = group_stats.get("locators", {})
+
+    def success_rate(locator):
+        st = per_locator.get(_locator_key(locator), {})
+        return (st.get("ok", 0) + 1) / (st.get("ok", 0) + st.get("failed", 0) + 2)
+    ordered = sorted(locators, key=lambda loc: -success_rate(loc)) # sorted() is stable, so unseen locators keep their order.
+    winner = next((loc for loc in ordered if _locator_key(loc) == group_stats.get("last_winner")), None)
+    return ([winner] + [loc for loc in ordered if loc != winner]) if winner else ordered
+
+def record_locator_result(group, locator, succeeded, elapsed):
+    """Updates the stats for one locator attempt; failed attempts count towards this run's lost time."""
+    load_locator_stats()
+    with _LOCATOR_REGISTRY["lock"]:
+        group_stats = _LOCATOR_REGISTRY["stats"].setdefault(group, {"last_winner": None, "locators": {}})
+        st = group_stats["locators"].setdefault(_locator_key(locator), {"ok": 0, "failed": 0, "ok_seconds": 0.0})
+        if succeeded: st["ok"] += 1; st["ok_seconds"] += elapsed; group_stats["last_winner"] = _locator_key(locator)
+        else:
+            st["failed"] += 1
+            lost = _LOCATOR_REGISTRY["lost"].setdefault(group, [0, 0.0]); lost[0] += 1; lost[1] += elapsed
+
+def find_with_locators(driver, group, locators, action="click", timeout=10, element_description="element"):
+    """Tries a group of alternative locators in learned order. Returns the clicked/found element's result, or None/False.
+
+    action is "click" (click_element_robustly), "present" or "visible" (WebDriverWait on the matching condition).
+    The last winner gets LOCATOR_WINNER_TIMEOUT first; if everything fails it is retried once with the full timeout.
+    """
+    def attempt(locator, attempt_timeout):
+        start = time.time()
+        if action == "click": result = click_element_robustly(driver, locator, element_description=element_description, timeout=attempt_timeout)
+        else:
+            condition = EC.visibility_of_element_located(locator) if action == "visible" else EC.presence_of_element_located(locator)
+            try: result = WebDriverWait(driver, attempt_timeout).until(condition)
+            except TimeoutException: result = None
+        record_locator_result(group, locator, bool(result), time.time() - start)
+        return result
+
+    if not LOCATOR_LEARNING_ENABLED:
+        for locator in locators:
+            result = attempt(locator, timeout)
+            if result: return result
+        return False if action == "click" else None
+    ordered = order_locators(group, locators)
+    has_winner = load_locator_stats().get(group, {}).get("last_winner") == _locator_key(ordered[0])
+    short_first = has_winner and len(ordered) > 1 and LOCATOR_WINNER_TIMEOUT < timeout
+    for i, locator in enumerate(ordered):
+        result = attempt(locator, LOCATOR_WINNER_TIMEOUT if short_first and i == 0 else timeout)
+        if result: return result
+    if short_first: # The winner may just have been slow to render.
+        result = attempt(ordered[0], timeout)
+        if result: return result
+    return False if action == "click" else None
+
+def print_locator_summary():
+    """Prints this run's time lost to failed locator attempts and saves the learned stats."""
+    lost = _LOCATOR_REGISTRY["lost"]
+    if lost:
+        print(f"\nLocators: {sum(v[1] for v in lost.values()):.1f}s lost to {sum(v[0] for v in lost.values())} failed locator attempts.")
+        stats = load_locator_stats()
+        for group, (failed, seconds) in sorted(lost.items()):
+            print(f"  {group}: {failed} failed, {seconds:.1f}s lost (winner now: {stats.get(group, {}).get('last_winner')})")
+    save_locator_stats()
+
+def call_pyautogui_image_clicker(image_filename_to_click, confidence=0.8, attempts=5, region=None):
+    """Finds an image on screen in-process (image_locator.py) and clicks it, for native OS pop-ups. region = (left, top, width, height)."""
+    image_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), image_filename_to_click)
+    if not os.path.isfile(image_path):
+        print(f"SELENIUM_ERROR: Native pop-up button image '{image_filename_to_click}' not found at '{image_path}'."); return False
+    try: import image_locator # NumPy, Pillow and PyAutoGUI are only needed for this step.
+    except ImportError as e: print(f"SELENIUM_ERROR: Image locator unavailable ({e}). Install with: pip install numpy pyautogui Pillow"); return False
+
+    print(f"SELENIUM: Looking for native pop-up button image '{image_filename_to_click}'" + (f" in screen region {region}." if region else " on the whole screen."))
+    try: match = image_locator.click_image(image_path, region=region, confidence=confidence, attempts=attempts)
+    except Exception as e: print(f"SELENIUM_ERROR locating/clicking '{image_filename_to_click}': {e}"); return False
+    if match and match["found"]:
+        print(f"  Clicked '{image_filename_to_click}' at ({match['x']}, {match['y']}), confidence {match['confidence']:.3f} ({match['method']} search, {match['seconds'] * 1000:.0f} ms)."); return True
+    print(f"  '{image_filename_to_click}' not found after {attempts} attempt(s)" + (f" (best confidence {match['confidence']:.3f} < {confidence})." if match else ".")); return False
+
+def browser_window_region(driver):
+    """The browser window's (left, top, width, height) on screen, or None if the driver can't tell."""
+    try: rect = driver.get_window_rect(); return (rect["x"], rect["y"], rect["width"], rect["height"])
+    except Exception: return None
 
 def click_element_robustly(driver, element_or_locator, by_type=None, element_description="element", timeout=10):
     """Robustly finds, scrolls to, and clicks a web element."""
@@ -226,7 +1272,8 @@ def click_element_robustly(driver, element_or_locator, by_type=None, element_des
             temp_locator = element_or_locator if isinstance(element_or_locator, tuple) else (by_type, element_or_locator)
             try:
                 el_for_scroll = WebDriverWait(driver, max(2, timeout // 2)).until(EC.presence_of_element_located(temp_locator))
-                driver.execute_script("arguments[0].scrollIntoView({behavior: 'smooth', block: 'center', inline: 'center'});", el_for_scroll); time.sleep(0.3)
+                driver.execute_script("arguments[0].scrollIntoView({behavior: 'instant', block: 'center', inline: 'center'});", el_for_scroll)
+                record_removed_sleep("click_scroll_settle", 0.3) # Instant scroll needs no settle time.
             except: pass # Proceed to main wait if initial scroll fails
 
         if isinstance(element_or_locator, WebElement):
@@ -243,282 +1290,922 @@ def click_element_robustly(driver, element_or_locator, by_type=None, element_des
         
         if not isinstance(found_element, WebElement): print(f"Error: {desc_log} did not resolve to a WebElement after wait."); return False
 
-        driver.execute_script("arguments[0].scrollIntoView({behavior: 'smooth', block: 'center', inline: 'center'});", found_element); time.sleep(0.5)
-        found_element.click(); print(f"Clicked {desc_log} (standard)."); time.sleep(0.7); return True
+        driver.execute_script("arguments[0].scrollIntoView({behavior: 'instant', block: 'center', inline: 'center'});", found_element)
+        found_element.click(); print(f"Clicked {desc_log} (standard).")
+        record_removed_sleep("click_settle", 0.5 + 0.7); return True # Callers wait on the click's effect instead.
     except ElementClickInterceptedException:
         print(f"Click intercepted for {desc_log}. Trying JS click.")
         try:
             if not isinstance(found_element, WebElement): return False
-            driver.execute_script("arguments[0].scrollIntoView({behavior: 'smooth', block: 'center', inline: 'center'});", found_element); time.sleep(0.3)
+            driver.execute_script("arguments[0].scrollIntoView({behavior: 'instant', block: 'center', inline: 'center'});", found_element)
             if not found_element.is_displayed(): print(f"JS Click Error: Element {desc_log} not displayed after scroll for JS."); return False
-            driver.execute_script("arguments[0].click();", found_element); print(f"Clicked {desc_log} (JS)."); time.sleep(0.7); return True
+            driver.execute_script("arguments[0].click();", found_element); print(f"Clicked {desc_log} (JS).")
+            record_removed_sleep("click_settle", 0.3 + 0.7); return True
         except Exception as js_e: print(f"JS click failed for {desc_log}: {js_e}"); return False
     except TimeoutException: print(f"Timeout waiting for {desc_log} to be clickable/visible."); return False
     except Exception as e: print(f"Other error clicking {desc_log}: {e}"); return False
 
+def _page_probe_config(prompt_selector_css=None):
+    """Locator bundle passed to the injected page probe."""
+    return {"promptCss": prompt_selector_css, "stopXp": GEMINI_STOP_GENERATING_XPATH, "spinnerXp": GEMINI_LOADING_SPINNER_XPATH,
+            "errorXp": GEMINI_ERROR_MESSAGE_XPATH, "busyXp": GEMINI_JUST_A_SEC_XPATH, "chipCss": GEMINI_FILE_CHIP_CSS,
+            "sendXps": GEMINI_SEND_BUTTON_XPATHS}
+
+def get_page_state(driver, prompt_selector_css=None):
+    """Snapshots all Gemini UI probes in a single execute_script round trip.
+
+    Returns {"error": text or None, "busy", "stop", "spinner", "prompt" (visible and enabled), "prompt_empty",
+    "chips" (file chip count), "send" (send button enabled)}.
+    """
+    return driver.execute_script(GEMINI_PAGE_STATE_JS, _page_probe_config(prompt_selector_css))
+
+def is_page_ready(page_state):
+    """True if a page-state snapshot shows Gemini idle with an editable prompt."""
+    return bool(page_state["prompt"]) and not (page_state["stop"] or page_state["spinner"] or page_state["busy"])
+
+def wait_for_gemini_ready_event(driver, prompt_selector_css, timeout_seconds=120, settle_ms=READY_SETTLE_MS):
+    """Blocks on a MutationObserver injected into the page until Gemini is ready, errors, or times out.
+
+    Returns the structured result from GEMINI_READY_OBSERVER_JS: {"status", "reason", "elapsed_ms", "state"}.
+    """
+    driver.set_script_timeout(timeout_seconds + 10)
+    return driver.execute_async_script(GEMINI_READY_OBSERVER_JS, _page_probe_config(prompt_selector_css), int(timeout_seconds * 1000), settle_ms)
+
 def wait_for_gemini_ready(driver, prompt_selector_css, timeout_seconds=120, action_description="action"):
     print(f"Waiting for Gemini after '{action_description}' (max {timeout_seconds}s)...")
-    start_time = time.time(); last_err_check = 0
+    if USE_EVENT_DRIVEN_WAIT:
+        try:
+            result = wait_for_gemini_ready_event(driver, prompt_selector_css, timeout_seconds)
+            if isinstance(result, dict) and result.get("status") == "ready":
+                print(f"Gemini ready after '{action_description}' ({result.get('elapsed_ms')} ms, event-driven)."); return True
+            if isinstance(result, dict) and result.get("status") == "error":
+                driver.save_screenshot(f"gemini_err_{time.strftime('%Y%m%d%H%M%S')}.png"); raise Exception(f"Gemini error: {result.get('reason')}")
+            if isinstance(result, dict) and result.get("status") == "timeout":
+                driver.save_screenshot(f"gemini_timeout_{action_description}_{time.strftime('%Y%m%d%H%M%S')}.png")
+                raise TimeoutException(f"Gemini did not become ready after {timeout_seconds}s for '{action_description}' (reason: {result.get('reason')}, state: {result.get('state')}).")
+            print(f"  Event-driven wait returned unexpected result {result!r}. Falling back to polling.")
+        except TimeoutException: raise
+        except WebDriverException as e_event:
+            if "disconnected" in str(e_event) or "target window already closed" in str(e_event): raise
+            print(f"  Event-driven wait unavailable ({str(e_event).splitlines()[0] if str(e_event) else e_event}). Falling back to polling.")
+    return _wait_for_gemini_ready_polling(driver, prompt_selector_css, timeout_seconds, action_description)
+
+def _wait_for_gemini_ready_polling(driver, prompt_selector_css, timeout_seconds=120, action_description="action", poll_interval=0.5):
+    """Polling readiness check on page-state snapshots, used when the event-driven observer is disabled or fails."""
+    start_time = time.time(); gemini_error = None
     while time.time() - start_time < timeout_seconds:
         try:
-            if time.time() - last_err_check > 3: 
-                err_els = driver.find_elements(By.XPATH, GEMINI_ERROR_MESSAGE_XPATH)
-                if any(el.is_displayed() for el in err_els):
-                    err_txt = [el.text for el in err_els if el.is_displayed() and el.text]
-                    driver.save_screenshot(f"gemini_err_{time.strftime('%Y%m%d%H%M%S')}.png"); raise Exception(f"Gemini error: {err_txt}")
-                last_err_check = time.time()
-            sec_els = driver.find_elements(By.XPATH, GEMINI_JUST_A_SEC_XPATH) 
-            if any(el.is_displayed() for el in sec_els): print("  Gemini is thinking..."); time.sleep(1.5); continue
-            stop_vis = False; load_vis = False; prompt_ok = False
-            try:
-                if driver.find_element(By.XPATH, GEMINI_STOP_GENERATING_XPATH).is_displayed(): stop_vis = True
-            except: pass 
-            try:
-                if driver.find_element(By.XPATH, GEMINI_LOADING_SPINNER_XPATH).is_displayed(): load_vis = True
-            except: pass 
-            try: 
-                prompt_el = WebDriverWait(driver, 0.5).until(EC.element_to_be_clickable((By.CSS_SELECTOR, prompt_selector_css)))
-                if prompt_el.get_attribute("value") == "" or prompt_el.get_attribute("placeholder"):
-                    prompt_ok = True
-            except: pass 
-            if prompt_ok and not stop_vis and not load_vis: 
+            page_state = get_page_state(driver, prompt_selector_css)
+            if page_state["error"]: gemini_error = page_state["error"]; break
+            if page_state["busy"]: print("  Gemini is thinking...")
+            elif is_page_ready(page_state):
                 print(f"Gemini ready after '{action_description}'."); return True
-        except StaleElementReferenceException: print("  Stale element during wait, retrying...")
         except WebDriverException as e_wd_wait: 
             if "disconnected" in str(e_wd_wait) or "target window already closed" in str(e_wd_wait):
                 print(f"  Browser seems to have closed or disconnected during wait: {e_wd_wait}"); raise 
             print(f"  WebDriverException during wait: {e_wd_wait}")
         except Exception as e_w: print(f"  Unexpected error during wait_for_gemini_ready: {e_w}")
-        time.sleep(2.0) 
+        time.sleep(poll_interval) 
+    if gemini_error:
+        driver.save_screenshot(f"gemini_err_{time.strftime('%Y%m%d%H%M%S')}.png"); raise Exception(f"Gemini error: {gemini_error}")
     driver.save_screenshot(f"gemini_timeout_{action_description}_{time.strftime('%Y%m%d%H%M%S')}.png")
     raise TimeoutException(f"Gemini did not become ready after {timeout_seconds}s for '{action_description}'.")
 
 # --- 3. MAIN AUTOMATION SCRIPT ---
-def main():
+def prepare_files_for_upload(target_folder=None, bundle_and_pack=True, skip_files=None):
+    """Scans the project, writes the sitemap and applies the manifest/upload mode. Returns an upload plan dict or None.
+
+    With bundle_and_pack=False the plan stops at the file list (parallel mode bundles and packs per shard).
+    skip_files ({relative path: sha256}, from the checkpoint journal on --resume) drops files that were already sent
+    and have not changed since.
+    """
+    target_folder = target_folder or TARGET_FOLDER
+    with trace_span("scan") as span:
+        print("Scanning project (single pass for file tree and upload list)...")
+        scan_result = scan_project(target_folder, SUBFOLDERS_TO_SCAN, FOLDERS_TO_IGNORE_NAMES, FILES_TO_IGNORE_NAMES, ALLOWED_EXTENSIONS, SITEMAP_FILENAME)
+        print(f"Scanned {scan_result['dirs_scanned']} directories in {scan_result['scan_seconds']:.2f}s "
+              f"({scan_result['dirs_pruned']} ignored directories pruned, {scan_result['files_ignored']} ignored files skipped).")
+        span.update(dirs=scan_result["dirs_scanned"], pruned=scan_result["dirs_pruned"], files=len(scan_result["files"]))
+
+    sitemap_abs_path = os.path.join(scan_result["root"], SITEMAP_FILENAME)
+    manifest = load_manifest(target_folder); excluded = {}
+    if CLASSIFY_FILES:
+        with trace_span("classify", files=len(scan_result["files"])) as span:
+            classification = classify_files(scan_result, manifest, skip_paths={sitemap_abs_path})
+            excluded = classification["excluded"]
+            scan_result["files"] = [f for f in scan_result["files"] if f not in excluded]
+            span.update(sniffed=classification["sniffed"], cached=classification["cached"], excluded=len(excluded))
+        print(f"Content checks: {classification['sniffed']} files sniffed, {classification['cached']} verdicts cached, {len(excluded)} excluded.")
+        print_exclusion_report(excluded, scan_result["root"])
+
+    with trace_span("manifest") as span:
+        upload_delta = compute_upload_delta(scan_result, manifest, skip_paths={sitemap_abs_path})
+        span.update(hashed=upload_delta["hashed"], changed=len(upload_delta["added"]) + len(upload_delta["modified"]))
+    print(f"Manifest check: {len(upload_delta['added'])} added, {len(upload_delta['modified'])} modified, "
+          f"{len(upload_delta['unchanged'])} unchanged, {len(upload_delta['removed'])} removed ({upload_delta['hashed']} files hashed).")
+    content_files = [f for f in scan_result["files"] if f != sitemap_abs_path]
+    if not content_files: print(f"No files found to upload. Exiting."); return None
+    if UPLOAD_MODE == "incremental":
+        changed_rel_paths = set(upload_delta["added"]) | set(upload_delta["modified"])
+        content_files = [f for f in content_files if os.path.relpath(f, scan_result["root"]).replace(os.sep, "/") in changed_rel_paths]
+        if not content_files: print("Incremental mode: no files changed since the last upload. Exiting."); return None
+        print(f"Incremental mode: uploading {len(content_files)} changed files plus the refreshed sitemap.")
+    elif UPLOAD_MODE != "full": print(f"Warning: Unknown UPLOAD_MODE '{UPLOAD_MODE}', uploading all files.")
+    if skip_files:
+        remaining = []
+        for f in content_files:
+            rel_path = os.path.relpath(f, scan_result["root"]).replace(os.sep, "/")
+            if rel_path not in skip_files or skip_files[rel_path] != upload_delta["entries"].get(rel_path, {}).get("sha256"): remaining.append(f)
+        print(f"Resume: {len(content_files) - len(remaining)} files were already uploaded in this conversation, {len(remaining)} left.")
+        content_files = remaining
+        if not content_files: print("Resume: nothing left to upload. Exiting."); return None
+
+    aliases = {}
+    if DEDUPE_FILES:
+        content_files, aliases = dedupe_files(content_files, upload_delta["entries"], scan_result["root"])
+        alias_count = sum(len(a) for a in aliases.values())
+        if alias_count: print(f"Deduplication: {alias_count} identical copies of {len(aliases)} files skipped (listed as aliases in the sitemap).")
+
+    file_tree_string = scan_result["tree_text"]
+    if not file_tree_string or file_tree_string.strip().startswith("("): print(f"Warning: File tree generation: {file_tree_string}")
+    else: save_tree_as_sitemap(file_tree_string + exclusion_sitemap_section(excluded, scan_result["root"]) + alias_sitemap_section(aliases, scan_result["root"]),
+                               target_folder, SITEMAP_FILENAME)
+    include_file_in_scan(scan_result, sitemap_abs_path)
+    send_sitemap = sitemap_abs_path in scan_result["file_stats"] and SITEMAP_FILENAME not in (skip_files or {})
+    files_to_process = ([sitemap_abs_path] if send_sitemap else []) + content_files
+    print(f"Found {len(files_to_process)} unique files to process for upload.")
+
+    compaction = None; upload_sources = {} # upload_sources: workspace copy -> project file it stands for.
+    if COMPACT_MODE:
+        with trace_span("compact", files=len(content_files)) as span:
+            compaction = compact_files(content_files, scan_result["root"], scan_result["file_stats"])
+            for original, compacted in compaction["paths"].items():
+                st = os.stat(compacted); scan_result["file_stats"][compacted] = (st.st_size, st.st_mtime); upload_sources[compacted] = original
+            span.update(bytes_before=sum(r[1] for r in compaction["files"]), bytes_after=sum(r[2] for r in compaction["files"]), cached=compaction["cached"])
+        print_compaction_report(compaction, scan_result["root"])
+    upload_of = {original: compacted for compacted, original in upload_sources.items()}
+    upload_list = [upload_of.get(f, f) for f in files_to_process]
+    upload_members = {upload_of.get(f, f): [f] for f in files_to_process}; pinned_uploads = [sitemap_abs_path]; bundle_result = None
+    if not bundle_and_pack:
+        return {"target_folder": target_folder, "scan_result": scan_result, "manifest": manifest, "upload_delta": upload_delta,
+                "files_to_process": files_to_process, "upload_members": with_aliases(upload_members, aliases), "aliases": aliases,
+                "compaction": compaction, "upload_sources": upload_sources, "bundle_result": None, "batches": [], "packing_report": None,
+                "resumed": bool(skip_files)}
+    if BUNDLE_MODE:
+        with trace_span("bundle", files=len(files_to_process)):
+            bundle_result = bundle_files(upload_list, scan_result["root"], scan_result["file_stats"], keep_separate={sitemap_abs_path}, source_paths=upload_sources)
+        upload_list = bundle_result["upload_list"]; upload_members = bundle_result["members"]
+        pinned_uploads = [sitemap_abs_path, bundle_result["index_path"]]
+    with trace_span("pack", files=len(upload_list)):
+        file_batches_list, packing_report = pack_file_batches(upload_list, scan_result["file_stats"], pinned_first=pinned_uploads)
+    return {"target_folder": target_folder, "scan_result": scan_result, "manifest": manifest, "upload_delta": upload_delta,
+            "files_to_process": files_to_process, "upload_members": with_aliases(upload_members, aliases), "aliases": aliases,
+            "compaction": compaction, "upload_sources": upload_sources, "bundle_result": bundle_result,
+            "batches": file_batches_list, "packing_report": packing_report, "resumed": bool(skip_files)}
+
+def with_aliases(upload_members, aliases):
+    """Adds each representative's aliases to the upload that carries it, so the manifest records them once it is sent."""
+    if not aliases: return upload_members
+    return {upload_path: originals + [a for original in originals for a in aliases.get(original, [])] for upload_path, originals in upload_members.items()}
+
+def _prepare_upload_worker(target_folder, plan_future, bundle_and_pack=True, skip_files=None):
+    """Runs prepare_files_for_upload and resolves plan_future with the plan (or None), or with the exception it raised."""
+    try:
+        upload_plan = prepare_files_for_upload(target_folder, bundle_and_pack, skip_files)
+        if upload_plan: upload_plan["prepared_at"] = time.time()
+        plan_future.set_result(upload_plan)
+    except Exception as e_prepare: plan_future.set_exception(e_prepare)
+
+def start_upload_preparation(target_folder, in_background=OVERLAP_PREPARE_WITH_STARTUP, bundle_and_pack=True, skip_files=None):
+    """Starts the scan/hash/bundle/pack pipeline, in a worker thread if in_background.
+
+    Returns a Future of the upload plan: .result() blocks until it is ready and re-raises worker errors. Packing needs the
+    whole file list, so the plan (with all its batches) is handed over in one piece.
+    """
+    plan_future = Future()
+    if in_background:
+        print("Preparing files in the background while the browser starts...")
+        threading.Thread(target=_prepare_upload_worker, args=(target_folder, plan_future, bundle_and_pack, skip_files), name="upload-prepare", daemon=True).start()
+    else: _prepare_upload_worker(target_folder, plan_future, bundle_and_pack, skip_files)
+    return plan_future
+
+def lean_headless():
+    """True if this run's browser is headless (only ever with the lean profile; see LEAN_HEADLESS)."""
+    if BROWSER_PROFILE != "lean": return False
+    if LEAN_HEADLESS == "auto": return USE_CHROME_PROFILE
+    return LEAN_HEADLESS in ("1", "true", "yes")
+
+def apply_launch_profile(options, profile=None, headless=None):
+    """Adds the window, headless and memory flags of a launch profile ("standard" or "lean") to ChromeOptions."""
+    if (profile or BROWSER_PROFILE) != "lean":
+        options.add_argument("--start-maximized"); options.add_argument("--force-renderer-accessibility"); return
+    if lean_headless() if headless is None else headless: options.add_argument("--headless=new")
+    options.add_argument(f"--window-size={LEAN_WINDOW_SIZE[0]},{LEAN_WINDOW_SIZE[1]}")
+    for flag in LEAN_CHROME_FLAGS: options.add_argument(flag)
+
+def block_heavy_resources(driver, patterns=None):
+    """Blocks non-essential resource URLs (images, fonts, media, analytics) for the session through CDP. Returns True if applied."""
+    try:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": list(LEAN_BLOCKED_URL_PATTERNS if patterns is None else patterns)})
+        return True
+    except (WebDriverException, AttributeError) as e_cdp:
+        print(f"Warning: Could not enable resource blocking ({e_cdp}). Loading every resource."); return False
+
+def install_chromedriver():
+    """Installs/locates chromedriver through webdriver-manager. Returns the driver executable path."""
+    with trace_span("driver_install"):
+        return ChromeDriverManager().install()
+
+def launch_chrome_driver(user_data_dir=None, driver_path=None):
+    """Starts Chrome with the configured options, installing chromedriver first unless driver_path is given.
+
+    user_data_dir gives a fresh (non-profile) session its own profile directory, so parallel sessions don't collide.
+    """
+    print("\nSetting up Chrome WebDriver...")
+    service = Service(driver_path or install_chromedriver())
+    options = webdriver.ChromeOptions()
+    if USE_CHROME_PROFILE:
+        print(f"Using Chrome profile: '{CHROME_PROFILE_DIRECTORY}' from '{CHROME_USER_DATA_DIR}'")
+        options.add_argument(f"--user-data-dir={CHROME_USER_DATA_DIR}")
+        options.add_argument(f"--profile-directory={CHROME_PROFILE_DIRECTORY}")
+    else:
+        print("Launching fresh Chrome instance for automated login.")
+        if user_data_dir: options.add_argument(f"--user-data-dir={user_data_dir}")
+        options.add_argument("--disable-extensions")
+        options.add_argument("--no-sandbox"); options.add_argument("--disable-dev-shm-usage"); options.add_argument("--disable-gpu")
+        options.add_argument("--no-first-run"); options.add_argument("--no-default-browser-check"); options.add_argument("--disable-fre")
+        options.add_argument("--disable-default-apps"); options.add_argument("--disable-popup-blocking")
+        options.add_argument("--disable-component-update"); options.add_argument("--disable-background-timer-throttling")
+        options.add_argument("--disable-renderer-backgrounding"); options.add_argument("--disable-sync")
+        prefs = {"profile.default_content_setting_values.notifications": 2, "credentials_enable_service": False, 
+                 "profile.password_manager_enabled": False, "signin.allowed": False, "sync_promo.startup_count": -1, 
+                 "sync_promo.show_on_first_run_allowed": False, "browser.show_hub_popup_on_first_run": False,
+                 "browser.had_previous_crash": True, "browser.has_seen_welcome_page": True }
+        options.add_experimental_option("prefs", prefs)
+        options.add_experimental_option("excludeSwitches", ["enable-automation", "enable-logging"])
+        options.add_argument('--disable-blink-features=AutomationControlled')
+    apply_launch_profile(options)
+    
+    with trace_span("browser_launch", profile=BROWSER_PROFILE, headless=lean_headless()):
+        driver = webdriver.Chrome(service=service, options=options)
+        print(f"Chrome session established ({BROWSER_PROFILE} profile{', headless' if lean_headless() else ''}).")
+        if BROWSER_PROFILE == "lean": block_heavy_resources(driver)
+        else: driver.maximize_window(); record_removed_sleep("browser_startup_settle", 2.0) # maximize_window() is synchronous.
+        driver.get(GEMINI_URL)
+    print(f"Navigated to {GEMINI_URL}. URL: {driver.current_url}")
+    return driver
+
+def login_to_gemini(driver):
+    """Logs in (or confirms the profile session) and returns the working prompt selector."""
+    primary_prompt_selector = ".input-area rich-textarea" 
+    placeholder_prompt_selector = "rich-textarea[placeholder='Ask Gemini']" 
+    working_prompt_selector = primary_prompt_selector 
+
+    if not USE_CHROME_PROFILE:
+        print("Attempting automated login...")
+        try: 
+            WebDriverWait(driver, 3).until(EC.presence_of_element_located((By.CSS_SELECTOR, placeholder_prompt_selector)))
+            working_prompt_selector = placeholder_prompt_selector; print("Already logged in.")
+        except TimeoutException:
+            print("Prompt not visible, attempting sign-in flow.")
+            signin_btn_xpaths = ["//a[contains(translate(., 'SIGN IN', 'sign in'), 'sign in') and contains(@href, 'accounts.google.com')]", "//button[contains(translate(., 'SIGN IN', 'sign in'), 'sign in')]"]
+            if not find_with_locators(driver, "signin_button", [(By.XPATH, xp) for xp in signin_btn_xpaths], timeout=7, element_description="Gemini Page Sign In Button"):
+                raise Exception("Could not click Sign In on Gemini page.")
+            
+            WebDriverWait(driver, 15).until(EC.visibility_of_element_located((By.ID, "identifierId"))).send_keys(GOOGLE_EMAIL)
+            if not click_element_robustly(driver, (By.ID, "identifierNext"), element_description="Email Next Button", timeout=10): raise Exception("Failed to click Email Next.")
+            
+            WebDriverWait(driver, 15).until(EC.visibility_of_element_located((By.CSS_SELECTOR, "input[type='password'][name='Passwd']"))).send_keys(GOOGLE_PASSWORD)
+            if not click_element_robustly(driver, (By.ID, "passwordNext"), element_description="Password Next Button", timeout=10): raise Exception("Failed to click Password Next.")
+            
+            print("Login submitted. Waiting for the sign-in redirect before handling a potential NATIVE UI pop-up...")
+            adaptive_wait(driver, "post_login_redirect", lambda d: "accounts.google.com" not in d.current_url, replaced_sleep=8.0, poll_frequency=0.25)
+            
+            if lean_headless():
+                print("Headless browser: no native Chrome pop-up to dismiss.")
+            elif NATIVE_POPUP_DISMISS_IMAGE: 
+                with trace_span("native_popup"):
+                    region = browser_window_region(driver) if NATIVE_POPUP_SEARCH_WINDOW_ONLY else None
+                    if not call_pyautogui_image_clicker(NATIVE_POPUP_DISMISS_IMAGE, confidence=0.75, attempts=5, region=region):
+                        print(f"Warning: Image clicker for NATIVE pop-up '{NATIVE_POPUP_DISMISS_IMAGE}' may not have succeeded.")
+                    else:
+                        print(f"Image clicker for NATIVE pop-up '{NATIVE_POPUP_DISMISS_IMAGE}' seems to have succeeded.")
+            else:
+                print("NATIVE_POPUP_DISMISS_IMAGE not set in config, skipping native pop-up click attempt via image.")
+
+            print(f"Re-navigating to {GEMINI_URL} to ensure we are on the correct page...")
+            driver.get(GEMINI_URL) 
+            
+            wait_for_gemini_ready(driver, primary_prompt_selector, 90, "login & pop-up handling")
+            try: 
+                driver.find_element(By.CSS_SELECTOR, placeholder_prompt_selector); working_prompt_selector = placeholder_prompt_selector
+            except: working_prompt_selector = primary_prompt_selector
+            print(f"Login successful. Prompt '{working_prompt_selector}' ready.")
+    else: 
+         if "gemini.google.com/app" not in driver.current_url: driver.get(GEMINI_URL)
+         wait_for_gemini_ready(driver, primary_prompt_selector, 30, "profile page load")
+         print(f"Using profile. Prompt '{working_prompt_selector}' confirmed.")
+    return working_prompt_selector
+
+def select_gemini_model(driver):
+    """Switches to the target model if it is not already selected. Failures are logged, never raised."""
+    try:
+        print("Attempting Model Selection using Selenium...")
+        model_display_button_xpath = "//button[contains(@aria-label, 'model') or contains(@data-testid, 'model-switcher') or (.//span[contains(text(), 'Pro') or contains(text(), 'Flash') or contains(text(), 'Ultra') or contains(text(), 'Gemini')])]//span[1]"
+        current_model_text = ""
+        try:
+            model_button_element = find_with_locators(driver, "model_display", [(By.XPATH, model_display_button_xpath)], action="visible", timeout=5)
+            if not model_button_element: raise TimeoutException()
+            current_model_text = model_button_element.text.strip()
+            print(f"  Currently selected model (via Selenium): '{current_model_text}'")
+        except TimeoutException: print("  Could not determine current model text via Selenium (display element not found).")
+        except Exception as e_get_model: print(f"  Error getting current model text: {e_get_model}")
+
+        target_model_keywords = ["2.5 Pro", "Pro (preview)"] 
+        
+        if any(keyword.lower() in current_model_text.lower() for keyword in target_model_keywords):
+            print(f"  Target model ('{current_model_text}') seems already selected. Skipping model selection steps.")
+        else:
+            print(f"  Current model ('{current_model_text}') is not target. Attempting to switch...")
+            model_switcher_opener_xpath = "//button[contains(@aria-label, 'model') or contains(@data-testid, 'model-switcher') or (.//span[contains(text(), 'Pro') or contains(text(), 'Flash') or contains(text(), 'Ultra') or contains(text(), 'Gemini')])][.//mat-icon[contains(@fonticon, 'drop_down') or contains(@class, 'drop-down')]]"
+            if find_with_locators(driver, "model_switcher", [(By.XPATH, model_switcher_opener_xpath)], timeout=15, element_description="Model Switcher Opener Button"):
+                print("  Model switcher button clicked. Waiting for dropdown menu...")
+                pro_model_option_xpath = "//button[.//span[contains(text(), 'Gemini 2.5 Pro') and contains(text(), 'preview')]]" 
+                adaptive_wait(driver, "model_menu_open", EC.visibility_of_element_located((By.XPATH, pro_model_option_xpath)), replaced_sleep=3.0)
+                if find_with_locators(driver, "model_option", [(By.XPATH, pro_model_option_xpath)], timeout=15, element_description="Gemini 2.5 Pro Option"):
+                    print("  Model 'Gemini 2.5 Pro (preview)' selected successfully.")
+                else: print(f"  Failed to click 'Gemini 2.5 Pro (preview)' option. XPath used: {pro_model_option_xpath}")
+                adaptive_wait(driver, "model_menu_close", EC.invisibility_of_element_located((By.XPATH, pro_model_option_xpath)), replaced_sleep=1.5)
+            else: print(f"  Failed to click model switcher opener button. XPath used: {model_switcher_opener_xpath}")
+    except Exception as e_model_selenium:
+        print(f"Model selection process (Selenium) encountered an error or was skipped: {e_model_selenium}")
+
+def build_batch_message(i_batch, total_batches, total_files, sitemap_name=SITEMAP_FILENAME, part_label=None, resumed=False):
+    """Text sent with each batch so Gemini knows where it is in the upload."""
+    if i_batch == 0:
+        if resumed: msg_batch = f"Resuming the interrupted upload, Batch 1 of {total_batches}: more files of the same project (structure in '{sitemap_name}', sent earlier). Wait for all files."
+        elif UPLOAD_MODE == "incremental": msg_batch = f"Incremental update, Batch 1 of {total_batches}: these files were added or changed since my last upload and replace the earlier versions. Refreshed project structure is in '{sitemap_name}' (included). Wait for all files."
+        else: msg_batch = f"Uploading Batch 1 of {total_batches}. Project structure is in '{sitemap_name}' (included). Wait for all files."
+        if part_label: msg_batch += f" This conversation holds {part_label} of the project; '{sitemap_name}' lists only the files in this part."
+        if BUNDLE_MODE: msg_batch += f" Source files are concatenated into bundle_*.txt files, each file starting with a '===== FILE: <path> =====' header; '{BUNDLE_INDEX_FILENAME}' maps every path to its bundle."
+        return msg_batch
+    if i_batch < total_batches - 1: return f"Uploading Batch {i_batch+1} of {total_batches}. Please continue to wait."
+    if resumed: return f"Final Batch ({i_batch+1}/{total_batches}) of the resumed upload. All files are now attached."
+    return f"Final Batch ({i_batch+1}/{total_batches}). All {total_files} files, including '{sitemap_name}', are now attached."
+
+def _first_chip_appears(driver, chips_before, timeout):
+    """True once at least one new file chip is on the page (used to confirm a fast attach path worked)."""
+    try:
+        WebDriverWait(driver, timeout, poll_frequency=0.1).until(lambda d: get_page_state(d)["chips"] > chips_before); return True
+    except TimeoutException: return False
+
+def _late_chips_arrived(driver, chips_before, used_input):
+    """Called before falling back to the next attach path: True if the previous path's chips showed up after all.
+    Otherwise clears the input that path filled, so its files can't attach on top of the next path's."""
+    if get_page_state(driver)["chips"] > chips_before: return True
+    if used_input is not None:
+        try: driver.execute_script("arguments[0].value = '';", used_input)
+        except WebDriverException: pass
+    return False
+
+def attach_via_cached_input(driver, batch_item, chips_before):
+    """Sends the paths straight to the page's file input (cached per session).
+    Returns (chips started appearing, the input that received the paths or None)."""
+    file_input = FILE_INPUT_CACHE.get(driver.session_id)
+    try:
+        if file_input is not None: file_input.is_enabled() # Raises StaleElementReferenceException if the input was re-rendered.
+    except WebDriverException: file_input = None
+    if file_input is None:
+        file_input = driver.execute_script(GEMINI_FIND_FILE_INPUT_JS)
+        if file_input is None: return False, None
+    try: file_input.send_keys("\n".join(batch_item))
+    except WebDriverException as e_input:
+        print(f"  Cached file input rejected the files: {e_input.msg}")
+        FILE_INPUT_CACHE.pop(driver.session_id, None); return False, None
+    if not _first_chip_appears(driver, chips_before, FAST_ATTACH_VERIFY_SECONDS):
+        FILE_INPUT_CACHE.pop(driver.session_id, None); return False, file_input
+    FILE_INPUT_CACHE[driver.session_id] = file_input
+    return True, file_input
+
+def attach_via_drop(driver, batch_item, working_prompt_selector, chips_before):
+    """Loads the files into an offscreen helper input and drops them on the prompt area.
+    Returns (chips appeared, the helper input or None)."""
+    drop_input = None
+    try:
+        drop_input = driver.execute_script(GEMINI_DROP_INPUT_JS)
+        drop_input.send_keys("\n".join(batch_item))
+        drop_target = driver.find_element(By.CSS_SELECTOR, working_prompt_selector)
+        if not driver.execute_script(GEMINI_DROP_FILES_JS, drop_input, drop_target): return False, drop_input
+    except WebDriverException as e_drop:
+        print(f"  Drop-event attach failed: {e_drop.msg}"); return False, drop_input
+    return _first_chip_appears(driver, chips_before, FAST_ATTACH_VERIFY_SECONDS), drop_input
+
+def attach_via_upload_menu(driver, batch_item, i_batch):
+    """Original flow: Add/Attach icon -> "Upload files" -> file input. Caches the input it finds for later batches."""
+    with trace_span("menu_open", batch=i_batch):
+        add_icon_locators = [ 
+            (By.XPATH, "//button[@aria-label='Open upload file menu']"), 
+            (By.XPATH, "//button[.//mat-icon[@fonticon='add_2']]") 
+        ]
+        if not find_with_locators(driver, "add_icon", add_icon_locators, timeout=15, element_description="'Add/Attach' (Plus) Icon"):
+            raise Exception("Failed to click 'Add/Attach' (Plus) icon using Selenium.")
+        upload_btn_locators = [ 
+            (By.CSS_SELECTOR, "button[data-test-id='local-image-file-uploader-button']"), 
+            (By.XPATH, "//button[contains(normalize-space(.), 'Upload file') or contains(normalize-space(.), 'Upload from computer')]") 
+        ]
+        print("  'Add/Attach' icon clicked. Waiting for menu...")
+        adaptive_wait(driver, "upload_menu_open", EC.any_of(*(EC.visibility_of_element_located(loc) for loc in upload_btn_locators)), replaced_sleep=3.0)
+        if not find_with_locators(driver, "upload_button", upload_btn_locators, timeout=15, element_description="'Upload Files' button in menu"):
+            raise Exception("Failed to click 'Upload Files' button in menu using Selenium.")
+        print("  'Upload files' menu button clicked. Waiting for the file input to be ready...")
+        adaptive_wait(driver, "file_input_ready", EC.presence_of_element_located((By.CSS_SELECTOR, "input[type='file']")), replaced_sleep=3.5)
+        
+        file_input_locs = ["input[type='file']", "//input[@type='file' and (contains(@style,'display: none') or contains(@class,'hidden'))]"]
+        file_input = find_with_locators(driver, "file_input", [(By.XPATH, loc) if loc.startswith("//") else (By.CSS_SELECTOR, loc) for loc in file_input_locs],
+                                        action="present", timeout=5)
+        if not file_input: raise Exception("Selenium File input element for batch upload not found.")
+    print(f"  Selenium sending {len(batch_item)} file paths to input element...")
+    file_input.send_keys("\n".join(batch_item))
+    FILE_INPUT_CACHE[driver.session_id] = file_input
+
+def attach_batch_files(driver, batch_item, i_batch, working_prompt_selector, chips_before):
+    """Attaches a batch by the cheapest path that works: cached file input, drop event, then the upload menu. Returns the path used.
+
+    Before each fallback the chips are counted again: if the previous path's chips arrived late, the files are not sent twice.
+    A fast path that took the files without producing a chip is skipped for the rest of the browser session, so later
+    batches don't pay FAST_ATTACH_VERIFY_SECONDS for it again.
+    """
+    if FAST_ATTACH_ENABLED:
+        failed = FAST_ATTACH_FAILED.setdefault(driver.session_id, set())
+        if "cached_input" not in failed:
+            attached, used_input = attach_via_cached_input(driver, batch_item, chips_before)
+            if attached:
+                print(f"  Attached {len(batch_item)} files through the cached file input."); return "cached_input"
+            if _late_chips_arrived(driver, chips_before, used_input):
+                print(f"  Chips from the cached file input appeared after {FAST_ATTACH_VERIFY_SECONDS}s; not sending the files again."); return "cached_input"
+            if used_input is not None: # It took the files and nothing happened (no input yet is not a failure: the menu finds one).
+                failed.add("cached_input"); print("  The cached file input is ignored by the page; skipping it for this session.")
+        if "drop" not in failed:
+            attached, used_input = attach_via_drop(driver, batch_item, working_prompt_selector, chips_before)
+            if attached:
+                print(f"  Attached {len(batch_item)} files with a drop event on the prompt."); return "drop"
+            if _late_chips_arrived(driver, chips_before, used_input):
+                print(f"  Chips from the drop event appeared after {FAST_ATTACH_VERIFY_SECONDS}s; not sending the files again."); return "drop"
+            failed.add("drop"); print("  The drop event is ignored by the page; skipping it for this session.")
+        print("  Fast attach paths unavailable, using the upload menu.")
+    attach_via_upload_menu(driver, batch_item, i_batch)
+    return "menu"
+
+def upload_batch(driver, batch_item, i_batch, total_batches, total_files, working_prompt_selector, sitemap_name=SITEMAP_FILENAME, part_label=None, resumed=False, metrics=None):
+    """Attaches one batch of files, sends its message and waits for Gemini. Raises on failure.
+
+    metrics (a dict), if given, receives "files", "chips", "chip_seconds" (attach until chips seen), "ready_seconds" and
+    "sent" (True once the send button was clicked, so a later failure does not mean the files are missing from the chat).
+    """
+    if metrics is not None: metrics["sent"] = False
+    chips_before_batch_upload = get_page_state(driver)["chips"]; attach_started = time.time()
+    with trace_span("file_attach", batch=i_batch, files=len(batch_item)) as span:
+        span["method"] = attach_batch_files(driver, batch_item, i_batch, working_prompt_selector, chips_before_batch_upload)
+    with trace_span("chip_appear", batch=i_batch, files=len(batch_item)) as span:
+        # Waits for every chip of this batch (or at least one, once the ceiling is reached) instead of a size-based sleep.
+        if adaptive_wait(driver, "chips_appear", lambda d: get_page_state(d)["chips"] >= chips_before_batch_upload + len(batch_item),
+                         replaced_sleep=2.0 + len(batch_item) * 0.4, ceiling=20 + len(batch_item) * 2, poll_frequency=0.25) is None:
+            WebDriverWait(driver, 5, poll_frequency=0.25).until(lambda d: get_page_state(d)["chips"] > chips_before_batch_upload)
+        current_total_chips = get_page_state(driver)["chips"]
+        new_chips_this_batch = current_total_chips - chips_before_batch_upload
+        span["chips"] = new_chips_this_batch
+    if metrics is not None: metrics.update(files=len(batch_item), chips=new_chips_this_batch, chip_seconds=time.time() - attach_started)
+    print(f"  Detected {new_chips_this_batch} new file chips (total on page: {current_total_chips}).")
+    if new_chips_this_batch < len(batch_item): 
+        print(f"  Warning: Expected {len(batch_item)} new chips, but only {new_chips_this_batch} appeared. Some files might not have attached.")
+    
+    with trace_span("send", batch=i_batch):
+        prompt_el_batch = WebDriverWait(driver, 10).until(EC.element_to_be_clickable((By.CSS_SELECTOR, working_prompt_selector)))
+        actual_txt_area_batch = prompt_el_batch
+        try: actual_txt_area_batch = prompt_el_batch.find_element(By.CSS_SELECTOR, "div[contenteditable='true']")
+        except: pass 
+        
+        actual_txt_area_batch.send_keys(build_batch_message(i_batch, total_batches, total_files, sitemap_name, part_label, resumed))
+        adaptive_wait(driver, "send_button_ready", lambda d: get_page_state(d, working_prompt_selector)["send"], replaced_sleep=0.5)
+        
+        if not find_with_locators(driver, "send_button", [(By.XPATH, xp) for xp in GEMINI_SEND_BUTTON_XPATHS], timeout=7, element_description="Send button (batch message)"):
+            raise Exception("Failed to send batch message using Selenium.")
+        if metrics is not None: metrics["sent"] = True
+    
+    print("Batch message sent. Waiting for chips to clear & Gemini ready...")
+    with trace_span("wait_ready", batch=i_batch):
+        ready_started = time.time()
+        wait_for_gemini_ready(driver, working_prompt_selector, 180, f"batch {i_batch+1} submission") 
+        if metrics is not None: metrics["ready_seconds"] = time.time() - ready_started
+    
+    with trace_span("chips_clear", batch=i_batch):
+        try:
+            WebDriverWait(driver, 60, poll_frequency=0.25).until( 
+                lambda d: get_page_state(d)["chips"] < current_total_chips
+            )
+            print("File chips seem to have been processed/cleared for this batch.")
+        except TimeoutException: 
+            print("Warning: File chips did not fully clear as expected after this batch's message. Manual check advised.")
+    return new_chips_this_batch
+
+def batch_bytes(batch_item, file_stats):
+    """Total bytes of a batch, using scan stats where available."""
+    total = 0
+    for path in batch_item:
+        if path in file_stats: total += file_stats[path][0]
+        else:
+            try: total += os.path.getsize(path)
+            except OSError: pass
+    return total
+
+def new_batch_controller(max_files=None, min_files=None):
+    """AIMD state for the files-per-message limit; starts at the configured UPLOAD_BATCH_SIZE."""
+    max_files = max_files or env_int("UPLOAD_BATCH_SIZE", UPLOAD_BATCH_SIZE)
+    min_files = min(min_files or env_int("ADAPTIVE_BATCH_MIN_FILES", ADAPTIVE_BATCH_MIN_FILES), max_files)
+    return {"size": max_files, "min": min_files, "max": max_files, "decisions": []}
+
+def update_batch_controller(controller, metrics, i_batch):
+    """Sets the size of the next batch from the last one's metrics (see ADAPTIVE_BATCH_SIZE) and logs the decision."""
+    size = controller["size"]; files = metrics.get("files") or 1; reasons = []
+    missing = max(0, files - metrics.get("chips", files))
+    if metrics.get("failed_attempts"): reasons.append(f"{metrics['failed_attempts']} failed attempt(s)")
+    if missing: reasons.append(f"{missing} of {files} chips missing")
+    if reasons: new_size = max(controller["min"], size // 2)
+    else:
+        chip_per_file = metrics.get("chip_seconds", 0.0) / files; ready = metrics.get("ready_seconds", 0.0)
+        if chip_per_file > env_int("ADAPTIVE_SLOW_CHIP_SECONDS", ADAPTIVE_SLOW_CHIP_SECONDS): reasons.append(f"chips took {chip_per_file:.1f}s per file")
+        if ready > env_int("ADAPTIVE_SLOW_READY_SECONDS", ADAPTIVE_SLOW_READY_SECONDS): reasons.append(f"Gemini took {ready:.0f}s to answer")
+        if reasons: new_size = max(controller["min"], min(size - 1, size * 3 // 4))
+        elif files < size: new_size = size; reasons.append(f"fast and clean, but only {files} files were sent, so the limit was not tested")
+        else: new_size = min(controller["max"], size + 1); reasons.append(f"fast and clean (chips {chip_per_file:.1f}s per file, answer {ready:.1f}s)")
+    controller["size"] = new_size
+    controller["decisions"].append({"batch": i_batch, "from": size, "to": new_size, "reason": "; ".join(reasons)})
+    _write_trace_record({"type": "batch_size", "run": _TRACE_STATE["run_id"], "ts": time.time(), **controller["decisions"][-1], **metrics})
+    print(f"  Batch size: {size} -> {new_size} files ({'; '.join(reasons)}).")
+
+def take_batch(pending, max_files, file_stats):
+    """Removes and returns up to max_files paths from the front of pending, within the byte and token budgets (at least one)."""
+    max_bytes = env_int("UPLOAD_BATCH_MAX_BYTES", UPLOAD_BATCH_MAX_BYTES); max_tokens = env_int("UPLOAD_BATCH_MAX_TOKENS", UPLOAD_BATCH_MAX_TOKENS)
+    count = 0; total_bytes = 0; total_tokens = 0
+    for path in pending[:max_files]:
+        size = batch_bytes([path], file_stats)
+        if count and (total_bytes + size > max_bytes or total_tokens + estimate_tokens(size) > max_tokens): break
+        count += 1; total_bytes += size; total_tokens += estimate_tokens(size)
+    batch = pending[:count]; del pending[:count]
+    return batch
+
+def iter_sized_batches(packed_batches, total_uploads, controller, file_stats):
+    """Yields (i_batch, batch, estimated total batches), re-cutting the packed batches to the controller's current size.
+
+    Without a controller the packed batches pass through unchanged. With one, a packed batch that fits the current limit
+    is sent as it is; a larger one is cut, and its leftover files are topped up from the following batches (in packing
+    order, so the sitemap stays first) within the limit and the byte/token budgets.
+    """
+    if controller is None:
+        packed_batches = list(packed_batches)
+        for i_batch, batch_item in enumerate(packed_batches): yield i_batch, batch_item, len(packed_batches)
+        return
+    packed = iter(packed_batches); pending = []; i_batch = 0; taken = 0
+    while True:
+        size = controller["size"]
+        if not pending:
+            next_packed = next(packed, None)
+            if next_packed is None: return
+            if len(next_packed) <= size: batch_item = list(next_packed)
+            else: pending.extend(next_packed); batch_item = take_batch(pending, size, file_stats)
+        else:
+            while len(pending) < size:
+                next_packed = next(packed, None)
+                if next_packed is None: break
+                pending.extend(next_packed)
+            batch_item = take_batch(pending, size, file_stats)
+        taken += len(batch_item)
+        yield i_batch, batch_item, i_batch + 1 + -(-(total_uploads - taken) // controller["size"])
+        i_batch += 1
+
+def reload_conversation(driver, working_prompt_selector, conversation_url):
+    """Reloads the conversation (or a new chat if none exists yet), dropping files a failed attempt left attached."""
+    driver.get(conversation_url or GEMINI_URL)
+    wait_for_gemini_ready(driver, working_prompt_selector, 60, "conversation reload")
+
+def upload_batch_with_retries(driver, batch_item, i_batch, total_batches, total_files, working_prompt_selector, journal,
+                              upload_plan=None, file_stats=None, trace_fields=None, metrics=None, **batch_options):
+    """Uploads one batch, retrying with exponential backoff and splitting it in half once the retries are used up.
+
+    Every retry starts from a reloaded conversation. If the failed attempt had already sent its message (usually a
+    readiness timeout), the retry only reloads and waits for Gemini instead of uploading the same files again.
+    Parts are journaled as they finish (when upload_plan is given).
+    metrics (a dict) gets the measurements of the last attempt plus "failed_attempts", for the batch size controller.
+    Returns (sent upload paths, error): error is None once every part was sent, else the last error of the part that gave up.
+    """
+    retries = env_int("BATCH_RETRIES", BATCH_RETRIES, minimum=0); backoff = env_int("BATCH_RETRY_BACKOFF_SECONDS", BATCH_RETRY_BACKOFF_SECONDS, minimum=0)
+    file_stats = file_stats if file_stats is not None else (upload_plan["scan_result"]["file_stats"] if upload_plan else {})
+    pending = [list(batch_item)]; sent = []
+    metrics = metrics if metrics is not None else {}; metrics["failed_attempts"] = 0
+    while pending:
+        part = pending.pop(0); error = None; delivered = False
+        for attempt in range(retries + 1):
+            try:
+                if attempt:
+                    delay = backoff * 2 ** (attempt - 1)
+                    if delivered: print(f"  Batch {i_batch+1} was already sent; reloading in {delay}s to wait for Gemini (attempt {attempt + 1}/{retries + 1})...")
+                    else: print(f"  Retrying {len(part)} file(s) of batch {i_batch+1} in {delay}s (attempt {attempt + 1}/{retries + 1})...")
+                    time.sleep(delay); reload_conversation(driver, working_prompt_selector, journal["conversation"])
+                if not delivered: # Once sent, the reload above (which waits for readiness) is the whole retry.
+                    with trace_span("batch", batch=i_batch, attempt=attempt, files=len(part), bytes=batch_bytes(part, file_stats), **(trace_fields or {})):
+                        upload_batch(driver, part, i_batch, total_batches, total_files, working_prompt_selector, metrics=metrics, **batch_options)
+                error = None; break
+            except Exception as e_attempt:
+                error = e_attempt; print(f"ERROR in batch {i_batch+1} (attempt {attempt + 1}/{retries + 1}): {e_attempt}")
+                metrics["failed_attempts"] += 1
+                if metrics.get("sent") and not delivered:
+                    delivered = True; note_conversation_url(journal, driver) # So the reload reopens this conversation, not a new chat.
+                try: driver.save_screenshot(f"gemini_batch_err_{i_batch+1}_{time.strftime('%Y%m%d-%H%M%S')}.png")
+                except WebDriverException: pass
+                if upload_plan: journal_batch(journal, i_batch, part, upload_plan, "failed", attempt=attempt + 1, error=str(e_attempt))
+        if error is None:
+            note_conversation_url(journal, driver)
+            if upload_plan: journal_batch(journal, i_batch, part, upload_plan, "done")
+            sent.extend(part); continue
+        if delivered: # The files are in the conversation; only Gemini's answer never came. Don't split (that would re-send them).
+            if upload_plan: journal_batch(journal, i_batch, part, upload_plan, "done", ready=False)
+            sent.extend(part)
+            return sent, Exception(f"Batch {i_batch+1} was sent, but Gemini did not become ready after {retries + 1} attempts: {error}")
+        if len(part) > 1 and SPLIT_FAILED_BATCHES:
+            half = len(part) // 2
+            print(f"  Batch {i_batch+1} keeps failing; splitting its {len(part)} files into parts of {half} and {len(part) - half}.")
+            pending[:0] = [part[:half], part[half:]]
+            try: reload_conversation(driver, working_prompt_selector, journal["conversation"])
+            except Exception as e_reload: print(f"  Warning: Could not reload the conversation before the split: {e_reload}")
+            continue
+        return sent, Exception(f"Batch {i_batch+1} gave up on {len(part)} file(s) after {retries + 1} attempts: {error}")
+    return sent, None
+
+def upload_planned_batches(driver, working_prompt_selector, upload_plan, journal=None):
+    """Uploads the plan's batches, then records them in the manifest. Returns (uploaded_files, batches_done, gave_up).
+
+    Failed batches are retried and split (upload_batch_with_retries); when one finally gives up the remaining batches are
+    skipped, and the journal lets --resume continue from there. The manifest only records what was actually sent.
+    batches_done counts batches as sent, which differs from len(upload_plan["batches"]) once the adaptive limit re-cuts them.
+    """
+    journal = journal or new_journal(); file_stats = upload_plan["scan_result"]["file_stats"]
+    if not journal["conversation"]: note_conversation_url(journal, driver) # Continuing an open conversation (daemon --same-chat).
+    controller = new_batch_controller() if ADAPTIVE_BATCH_SIZE else None; metrics = {}
+    uploaded_files = []; batches_done = 0; gave_up = False
+    total_uploads = sum(len(b) for b in upload_plan["batches"])
+    for i_batch, batch_item, total_batches in iter_sized_batches(upload_plan["batches"], total_uploads, controller, file_stats):
+        print(f"\n--- Processing Batch {i_batch+1}/{total_batches} ---")
+        sent, error = upload_batch_with_retries(driver, batch_item, i_batch, total_batches, len(upload_plan["files_to_process"]),
+                                                working_prompt_selector, journal, upload_plan, metrics=metrics, resumed=upload_plan.get("resumed", False))
+        for upload_path in sent: uploaded_files.extend(upload_plan["upload_members"].get(upload_path, []))
+        if error:
+            print(f"ERROR: {error}")
+            print("Skipping remaining batches." + (" Run again with --resume to continue from this batch." if journal["path"] else "")); gave_up = True; break
+        batches_done += 1
+        if controller: update_batch_controller(controller, metrics, i_batch)
+    append_journal(journal, {"type": "end", "status": "failed" if gave_up else "complete", "batches_done": batches_done})
+    print("\nAll batches processed or stopped due to an error.")
+    if uploaded_files: save_manifest(record_uploaded_files(upload_plan["manifest"], upload_plan["upload_delta"], uploaded_files, upload_plan["scan_result"]["root"]), upload_plan["target_folder"])
+    return uploaded_files, batches_done, gave_up
+
+def build_tree_text_from_files(root_dir, file_paths):
+    """Renders a sitemap tree (same layout as scan_project) for an explicit list of files, e.g. one shard."""
+    abs_root_dir = os.path.abspath(root_dir); tree = {}
+    for abs_path in file_paths:
+        node = tree
+        parts = os.path.relpath(abs_path, abs_root_dir).split(os.sep)
+        for part in parts[:-1]: node = node.setdefault(part + os.sep, {})
+        node[parts[-1]] = None
+    tree_lines = [f"{os.path.basename(abs_root_dir)}/"]
+
+    def render(node, level): # level = path components below the root; root files share the top-level dirs' indent.
+        files = sorted(k for k, v in node.items() if v is None); subdirs = sorted(k for k, v in node.items() if v is not None)
+        for i, fn_item in enumerate(files):
+            prefix = "└── " if i == len(files) - 1 and not subdirs else "├── "
+            tree_lines.append(f"{'  ' * max(level, 1)}{prefix}{fn_item}")
+        for d in subdirs:
+            tree_lines.append(f"{'  ' * level}├── {d[:-1]}/"); render(node[d], level + 1)
+    render(tree, 0)
+    return "\n".join(tree_lines)
+
+def shard_files_by_directory(file_paths, root_dir, shard_count, file_stats=None):
+    """Splits files into shard_count shards without splitting directories, balanced by bytes (largest group first).
+
+    Groups by top-level directory; if that gives fewer groups than shards, groups one level deeper (up to 4 levels).
+    """
+    abs_root_dir = os.path.abspath(root_dir); file_stats = file_stats or {}
+    rel_parts = {p: os.path.relpath(p, abs_root_dir).split(os.sep) for p in file_paths}
+    for depth in range(1, 5):
+        groups = {}
+        for path, parts in rel_parts.items(): groups.setdefault(os.sep.join(parts[:min(depth, len(parts) - 1)]), []).append(path)
+        if len(groups) >= shard_count: break
+    group_sizes = {key: sum(file_stats[p][0] if p in file_stats else os.path.getsize(p) for p in paths) for key, paths in groups.items()}
+    shards = [[] for _ in range(shard_count)]; shard_bytes = [0] * shard_count
+    for key in sorted(groups, key=lambda k: (-group_sizes[k], k)):
+        target = shard_bytes.index(min(shard_bytes))
+        shards[target].extend(groups[key]); shard_bytes[target] += group_sizes[key]
+    return [sorted(shard) for shard in shards if shard]
+
+def build_upload_shards(upload_plan, shard_count, work_dir):
+    """Shards a prepared upload plan, writing a sitemap slice per shard and bundling/packing each shard separately."""
+    scan_result = upload_plan["scan_result"]; root = scan_result["root"]; file_stats = scan_result["file_stats"]; aliases = upload_plan.get("aliases", {})
+    upload_sources = upload_plan.get("upload_sources", {}); upload_of = {original: copy for copy, original in upload_sources.items()}
+    sitemap_abs_path = os.path.join(root, SITEMAP_FILENAME)
+    content_files = [f for f in upload_plan["files_to_process"] if f != sitemap_abs_path]
+    shard_file_lists = shard_files_by_directory(content_files, root, shard_count, file_stats)
+    sitemap_base, sitemap_ext = os.path.splitext(SITEMAP_FILENAME)
+    shards = []
+    for k, shard_files in enumerate(shard_file_lists):
+        shard_dir = os.path.join(work_dir, f"shard_{k + 1}"); os.makedirs(shard_dir, exist_ok=True)
+        sitemap_name = f"{sitemap_base}_part{k + 1}of{len(shard_file_lists)}{sitemap_ext}"
+        shard_aliases = {f: aliases[f] for f in shard_files if f in aliases}
+        slice_path = save_tree_as_sitemap(build_tree_text_from_files(root, shard_files + [a for v in shard_aliases.values() for a in v])
+                                          + alias_sitemap_section(shard_aliases, root), shard_dir, sitemap_name)
+        upload_list = [upload_of.get(f, f) for f in shard_files]; members = with_aliases({upload_of.get(f, f): [f] for f in shard_files}, aliases); pinned = [slice_path]
+        if BUNDLE_MODE:
+            bundle_result = bundle_files(upload_list, root, file_stats, output_dir=os.path.join(shard_dir, "bundles"), source_paths=upload_sources)
+            upload_list = bundle_result["upload_list"]; members = with_aliases(bundle_result["members"], aliases); pinned.append(bundle_result["index_path"])
+        members[slice_path] = []
+        batches, _ = pack_file_batches([slice_path] + upload_list, file_stats, pinned_first=pinned)
+        shards.append({"index": k, "files": shard_files, "sitemap_name": sitemap_name, "batches": batches, "upload_members": members,
+                       "label": f"part {k + 1} of {len(shard_file_lists)}"})
+    return shards
+
+# Serialises logins across parallel workers (pop-up handling and the image clicker are not per-window).
+PARALLEL_LOGIN_LOCK = threading.Lock()
+
+def _report_progress(progress, worker_index, message):
+    """Prints one aggregated progress line for all workers (thread-safe)."""
+    with progress["lock"]:
+        done = sum(w["batches_done"] for w in progress["workers"].values()); total = sum(w["batches_total"] for w in progress["workers"].values())
+        failed = sum(1 for w in progress["workers"].values() if w["status"] == "failed")
+        print(f"[Progress] worker {worker_index + 1}: {message} | all workers: {done}/{total} batches done, {failed} worker(s) failed")
+
+def _upload_shard_worker(worker_index, shard_state, progress, login_lock, profile_root, driver_path=None):
+    """One parallel session: launch Chrome with its own profile, log in, wait for its shard, upload it. Returns uploaded files."""
+    state = progress["workers"][worker_index]; uploaded_files = []; driver = None
+    try:
+        state["status"] = "starting"
+        driver = launch_chrome_driver(user_data_dir=os.path.join(profile_root, f"worker_{worker_index + 1}"), driver_path=driver_path)
+        state["driver"] = driver
+        with login_lock: # Logins (and the native pop-up clicker, which works on the whole screen) run one at a time.
+            with trace_span("login", worker=worker_index):
+                working_prompt_selector = login_to_gemini(driver)
+        with trace_span("model_selection", worker=worker_index):
+            select_gemini_model(driver)
+        shard_state["ready"].wait()
+        shards = shard_state["shards"] or []
+        if shard_state["error"] or worker_index >= len(shards):
+            state["status"] = "idle"; _report_progress(progress, worker_index, "no shard assigned"); return uploaded_files
+        shard = shards[worker_index]; file_stats = shard_state["file_stats"]
+        with progress["lock"]: state["batches_total"] = len(shard["batches"])
+        state["status"] = "uploading"
+        journal = new_journal() # In memory: retries reload this session's own conversation.
+        controller = new_batch_controller() if ADAPTIVE_BATCH_SIZE else None; metrics = {}
+        for i_batch, batch_item, total_batches in iter_sized_batches(shard["batches"], sum(len(b) for b in shard["batches"]), controller, file_stats):
+            with progress["lock"]: state["batches_total"] = state["batches_done"] + (total_batches - i_batch)
+            sent, error = upload_batch_with_retries(driver, batch_item, i_batch, total_batches, len(shard["files"]) + 1, working_prompt_selector, journal,
+                                                    file_stats=file_stats, trace_fields={"worker": worker_index}, metrics=metrics,
+                                                    sitemap_name=shard["sitemap_name"], part_label=shard["label"])
+            for upload_path in sent: uploaded_files.extend(shard["upload_members"].get(upload_path, []))
+            if error: raise error
+            with progress["lock"]: state["batches_done"] += 1
+            if controller: update_batch_controller(controller, metrics, i_batch)
+            _report_progress(progress, worker_index, f"batch {i_batch + 1}/{total_batches} done")
+        state["status"] = "done"
+    except Exception as e_worker:
+        state["status"] = "failed"; state["error"] = str(e_worker)
+        _report_progress(progress, worker_index, f"FAILED: {e_worker}")
+        if driver:
+            try: driver.save_screenshot(f"gemini_worker{worker_index + 1}_err_{time.strftime('%Y%m%d-%H%M%S')}.png")
+            except WebDriverException: pass # Browser already gone; the other workers' results must still reach the manifest.
+    return uploaded_files
+
+def run_parallel_upload(target_folder, worker_count):
+    """Uploads the project through worker_count concurrent browser sessions, one shard (and conversation) per session."""
+    print(f"Parallel mode: {worker_count} browser sessions.")
+    # Installed once, before the workers start: concurrent installs race on webdriver-manager's download/extract directory.
+    try: driver_path = install_chromedriver()
+    except Exception as e_install: print(f"ERROR installing chromedriver: {e_install}"); return []
+    work_dir = tempfile.mkdtemp(prefix="gemini_parallel_")
+    shard_state = {"ready": threading.Event(), "shards": None, "file_stats": {}, "error": None}
+    progress = {"lock": threading.Lock(), "workers": {k: {"status": "pending", "batches_done": 0, "batches_total": 0, "error": None}
+                                                       for k in range(worker_count)}}
+    plan_future = start_upload_preparation(target_folder, in_background=True, bundle_and_pack=False)
+    upload_plan = None; uploaded_files = []
+    try:
+        with ThreadPoolExecutor(max_workers=worker_count, thread_name_prefix="upload-worker") as pool:
+            futures = [pool.submit(_upload_shard_worker, k, shard_state, progress, PARALLEL_LOGIN_LOCK, os.path.join(work_dir, "profiles"), driver_path)
+                       for k in range(worker_count)]
+            try:
+                upload_plan = plan_future.result()
+                if upload_plan:
+                    with trace_span("shard", workers=worker_count):
+                        shard_state["shards"] = build_upload_shards(upload_plan, worker_count, work_dir)
+                    shard_state["file_stats"] = upload_plan["scan_result"]["file_stats"]
+                    print(f"Sharded {len(upload_plan['files_to_process'])} files into {len(shard_state['shards'])} shards: "
+                          + ", ".join(f"{len(sh['files'])} files/{len(sh['batches'])} batches" for sh in shard_state["shards"]))
+                else: shard_state["error"] = "nothing to upload"
+            except Exception as e_prepare:
+                shard_state["error"] = str(e_prepare); print(f"ERROR preparing files for parallel upload: {e_prepare}")
+            finally: shard_state["ready"].set()
+            for future in futures: uploaded_files.extend(future.result())
+    finally:
+        print("\nParallel upload summary:")
+        for k, w in sorted(progress["workers"].items()):
+            print(f"  Worker {k + 1}: {w['status']}, {w['batches_done']}/{w['batches_total']} batches" + (f", error: {w['error']}" if w["error"] else ""))
+        if uploaded_files and upload_plan:
+            save_manifest(record_uploaded_files(upload_plan["manifest"], upload_plan["upload_delta"], uploaded_files, upload_plan["scan_result"]["root"]), target_folder)
+        cleanup_upload_plan(upload_plan)
+        # Profiles stay in work_dir while their browsers remain open; only the upload copies are removed.
+        for name in os.listdir(work_dir):
+            if name.startswith("shard_"): shutil.rmtree(os.path.join(work_dir, name), ignore_errors=True)
+    return uploaded_files
+
+def main(resume=False):
     driver = None
     working_prompt_selector = None
+    upload_plan = None
+    journal = None; skip_files = None
 
     if not GOOGLE_EMAIL or not GOOGLE_PASSWORD:
         print("CRITICAL_ERROR: GEMINI_UPLOADER_EMAIL or GEMINI_UPLOADER_PASSWORD not set in .env file."); return
     if not TARGET_FOLDER or not os.path.isdir(TARGET_FOLDER):
         print(f"CRITICAL_ERROR: TARGET_FOLDER ('{TARGET_FOLDER}') is not set or does not exist."); return
 
-    try:
-        print("Generating file tree...")
-        file_tree_string = generate_file_tree_text(TARGET_FOLDER, SUBFOLDERS_TO_SCAN, FOLDERS_TO_IGNORE_NAMES, FILES_TO_IGNORE_NAMES, ALLOWED_EXTENSIONS)
-        if not file_tree_string or file_tree_string.strip().startswith("("): print(f"Warning: File tree generation: {file_tree_string}")
-        else: save_tree_as_sitemap(file_tree_string, TARGET_FOLDER, SITEMAP_FILENAME)
-        
-        files_to_process = get_all_files_to_process(TARGET_FOLDER, SUBFOLDERS_TO_SCAN, FOLDERS_TO_IGNORE_NAMES, FILES_TO_IGNORE_NAMES, ALLOWED_EXTENSIONS, SITEMAP_FILENAME)
-        if not files_to_process: print(f"No files found to upload. Exiting."); return
-
-        print("\nSetting up Chrome WebDriver...")
-        service = Service(ChromeDriverManager().install())
-        options = webdriver.ChromeOptions()
-        if USE_CHROME_PROFILE:
-            print(f"Using Chrome profile: '{CHROME_PROFILE_DIRECTORY}' from '{CHROME_USER_DATA_DIR}'")
-            options.add_argument(f"--user-data-dir={CHROME_USER_DATA_DIR}")
-            options.add_argument(f"--profile-directory={CHROME_PROFILE_DIRECTORY}")
+    if resume:
+        journal = load_journal(TARGET_FOLDER)
+        if not journal: print("Resume: no checkpoint journal in TARGET_FOLDER, starting a fresh upload.")
+        elif journal["complete"]: print("Resume: the last upload completed, nothing to resume."); return
         else:
-            print("Launching fresh Chrome instance for automated login.")
-            options.add_argument("--disable-extensions")
-            options.add_argument("--no-sandbox"); options.add_argument("--disable-dev-shm-usage"); options.add_argument("--disable-gpu")
-            options.add_argument("--no-first-run"); options.add_argument("--no-default-browser-check"); options.add_argument("--disable-fre")
-            options.add_argument("--disable-default-apps"); options.add_argument("--disable-popup-blocking")
-            options.add_argument("--disable-component-update"); options.add_argument("--disable-background-timer-throttling")
-            options.add_argument("--disable-renderer-backgrounding"); options.add_argument("--disable-sync")
-            prefs = {"profile.default_content_setting_values.notifications": 2, "credentials_enable_service": False, 
-                     "profile.password_manager_enabled": False, "signin.allowed": False, "sync_promo.startup_count": -1, 
-                     "sync_promo.show_on_first_run_allowed": False, "browser.show_hub_popup_on_first_run": False,
-                     "browser.had_previous_crash": True, "browser.has_seen_welcome_page": True }
-            options.add_experimental_option("prefs", prefs)
-            options.add_experimental_option("excludeSwitches", ["enable-automation", "enable-logging"])
-            options.add_argument('--disable-blink-features=AutomationControlled')
-        options.add_argument("--start-maximized")
-        options.add_argument("--force-renderer-accessibility") 
-        
-        driver = webdriver.Chrome(service=service, options=options)
-        print("Chrome session established."); time.sleep(1)
-        driver.maximize_window(); time.sleep(1) 
-        driver.get(GEMINI_URL)
-        print(f"Navigated to {GEMINI_URL}. URL: {driver.current_url}")
+            skip_files = journal["done"]
+            print(f"Resume: {len(skip_files)} files were already uploaded to {journal['conversation'] or 'an unknown conversation'}.")
+            if skip_files and not journal["conversation"]: print("Warning: The journal has no conversation URL; the remaining files go to a new conversation.")
 
-        primary_prompt_selector = ".input-area rich-textarea" 
-        placeholder_prompt_selector = "rich-textarea[placeholder='Ask Gemini']" 
-        working_prompt_selector = primary_prompt_selector 
+    worker_count = env_int("UPLOAD_WORKERS", UPLOAD_WORKERS)
+    if worker_count > 1 and USE_CHROME_PROFILE:
+        print("Warning: UPLOAD_WORKERS > 1 needs fresh browser sessions; USE_CHROME_PROFILE is on, so using 1 worker."); worker_count = 1
+    if worker_count > 1 and resume:
+        print("Warning: --resume continues a single conversation, so using 1 worker."); worker_count = 1
 
-        if not USE_CHROME_PROFILE:
-            print("Attempting automated login...")
-            try: 
-                WebDriverWait(driver, 3).until(EC.presence_of_element_located((By.CSS_SELECTOR, placeholder_prompt_selector)))
-                working_prompt_selector = placeholder_prompt_selector; print("Already logged in.")
-            except TimeoutException:
-                print("Prompt not visible, attempting sign-in flow.")
-                signin_btn_xpaths = ["//a[contains(translate(., 'SIGN IN', 'sign in'), 'sign in') and contains(@href, 'accounts.google.com')]", "//button[contains(translate(., 'SIGN IN', 'sign in'), 'sign in')]"]
-                if not any(click_element_robustly(driver, (By.XPATH, xp), element_description="Gemini Page Sign In Button", timeout=7) for xp in signin_btn_xpaths):
-                    raise Exception("Could not click Sign In on Gemini page.")
-                
-                WebDriverWait(driver, 15).until(EC.visibility_of_element_located((By.ID, "identifierId"))).send_keys(GOOGLE_EMAIL)
-                if not click_element_robustly(driver, (By.ID, "identifierNext"), element_description="Email Next Button", timeout=10): raise Exception("Failed to click Email Next.")
-                
-                WebDriverWait(driver, 15).until(EC.visibility_of_element_located((By.CSS_SELECTOR, "input[type='password'][name='Passwd']"))).send_keys(GOOGLE_PASSWORD)
-                if not click_element_robustly(driver, (By.ID, "passwordNext"), element_description="Password Next Button", timeout=10): raise Exception("Failed to click Password Next.")
-                
-                print("Login submitted. Pausing for potential NATIVE UI pop-up...")
-                time.sleep(8) 
-                
-                if NATIVE_POPUP_DISMISS_IMAGE: 
-                    if not call_pyautogui_image_clicker(NATIVE_POPUP_DISMISS_IMAGE, confidence=0.75, attempts=5, timeout_subproc=25):
-                        print(f"Warning: PyAutoGUI (image) clicker for NATIVE pop-up '{NATIVE_POPUP_DISMISS_IMAGE}' may not have succeeded.")
-                    else:
-                        print(f"PyAutoGUI (image) clicker for NATIVE pop-up '{NATIVE_POPUP_DISMISS_IMAGE}' seems to have succeeded.")
-                else:
-                    print("NATIVE_POPUP_DISMISS_IMAGE not set in config, skipping native pop-up click attempt via image.")
-
-                print(f"Re-navigating to {GEMINI_URL} to ensure we are on the correct page...")
-                driver.get(GEMINI_URL) 
-                
-                wait_for_gemini_ready(driver, primary_prompt_selector, 90, "login & pop-up handling")
-                try: 
-                    driver.find_element(By.CSS_SELECTOR, placeholder_prompt_selector); working_prompt_selector = placeholder_prompt_selector
-                except: working_prompt_selector = primary_prompt_selector
-                print(f"Login successful. Prompt '{working_prompt_selector}' ready.")
-        else: 
-             if "gemini.google.com/app" not in driver.current_url: driver.get(GEMINI_URL)
-             wait_for_gemini_ready(driver, primary_prompt_selector, 30, "profile page load")
-             print(f"Using profile. Prompt '{working_prompt_selector}' confirmed.")
-
-        # --- Model Selection (Using Selenium Clicks) ---
-        try:
-            print("Attempting Model Selection using Selenium...")
-            model_display_button_xpath = "//button[contains(@aria-label, 'model') or contains(@data-testid, 'model-switcher') or (.//span[contains(text(), 'Pro') or contains(text(), 'Flash') or contains(text(), 'Ultra') or contains(text(), 'Gemini')])]//span[1]"
-            current_model_text = ""
-            try:
-                model_button_element = WebDriverWait(driver, 5).until(EC.visibility_of_element_located((By.XPATH, model_display_button_xpath)))
-                current_model_text = model_button_element.text.strip()
-                print(f"  Currently selected model (via Selenium): '{current_model_text}'")
-            except TimeoutException: print("  Could not determine current model text via Selenium (display element not found).")
-            except Exception as e_get_model: print(f"  Error getting current model text: {e_get_model}")
+    start_trace(target_folder=os.path.abspath(TARGET_FOLDER), upload_mode=UPLOAD_MODE, bundle_mode=BUNDLE_MODE, overlap=OVERLAP_PREPARE_WITH_STARTUP, workers=worker_count, resume=resume)
+    uploaded_files = []; batches_done = 0
+    if worker_count > 1:
+        try: uploaded_files = run_parallel_upload(TARGET_FOLDER, worker_count)
+        except Exception as e_parallel: print(f"--- PARALLEL UPLOAD ERROR ---: {e_parallel}")
+        finally:
+            print_wait_summary(); print_locator_summary()
+            end_trace(files_uploaded=len(uploaded_files), workers=worker_count)
+            print("\n--- Script Finished ---\nBrowsers remain open. Close manually.")
+        return
+    try:
+        plan_future = start_upload_preparation(TARGET_FOLDER, skip_files=skip_files)
+        if not OVERLAP_PREPARE_WITH_STARTUP:
+            # Sequential mode: nothing to upload means no reason to start the browser at all.
+            upload_plan = plan_future.result()
+            if not upload_plan: return
 
-            target_model_keywords = ["2.5 Pro", "Pro (preview)"] 
-            
-            if any(keyword.lower() in current_model_text.lower() for keyword in target_model_keywords):
-                print(f"  Target model ('{current_model_text}') seems already selected. Skipping model selection steps.")
-            else:
-                print(f"  Current model ('{current_model_text}') is not target. Attempting to switch...")
-                model_switcher_opener_xpath = "//button[contains(@aria-label, 'model') or contains(@data-testid, 'model-switcher') or (.//span[contains(text(), 'Pro') or contains(text(), 'Flash') or contains(text(), 'Ultra') or contains(text(), 'Gemini')])][.//mat-icon[contains(@fonticon, 'drop_down') or contains(@class, 'drop-down')]]"
-                if click_element_robustly(driver, (By.XPATH, model_switcher_opener_xpath), element_description="Model Switcher Opener Button", timeout=15):
-                    print("  Model switcher button clicked. Pausing for dropdown menu...")
-                    time.sleep(3.0) 
-                    pro_model_option_xpath = "//button[.//span[contains(text(), 'Gemini 2.5 Pro') and contains(text(), 'preview')]]" 
-                    if click_element_robustly(driver, (By.XPATH, pro_model_option_xpath), element_description="Gemini 2.5 Pro Option", timeout=15):
-                        print("  Model 'Gemini 2.5 Pro (preview)' selected successfully.")
-                    else: print(f"  Failed to click 'Gemini 2.5 Pro (preview)' option. XPath used: {pro_model_option_xpath}")
-                    time.sleep(1.5) 
-                else: print(f"  Failed to click model switcher opener button. XPath used: {model_switcher_opener_xpath}")
-        except Exception as e_model_selenium:
-            print(f"Model selection process (Selenium) encountered an error or was skipped: {e_model_selenium}")
+        driver = launch_chrome_driver()
+        with trace_span("login"):
+            working_prompt_selector = login_to_gemini(driver)
+        with trace_span("model_selection"):
+            select_gemini_model(driver)
+        if journal and journal["conversation"]:
+            print(f"Resume: reopening conversation {journal['conversation']}")
+            with trace_span("resume_conversation"):
+                reload_conversation(driver, working_prompt_selector, journal["conversation"])
+
+        if OVERLAP_PREPARE_WITH_STARTUP:
+            prompt_ready_at = time.time()
+            with trace_span("wait_for_prepare"):
+                upload_plan = plan_future.result()
+            if not upload_plan: return
+            idle = time.time() - prompt_ready_at
+            if idle > 0.05: print(f"Waited {idle:.1f}s for file preparation after the prompt was ready.")
+            else: print(f"File preparation finished {prompt_ready_at - upload_plan['prepared_at']:.1f}s before the prompt was ready (fully overlapped).")
 
         # --- File Upload Process (Using Selenium Clicks) ---
-        file_batches_list = list(batch_files(files_to_process)) 
-        send_btn_xpaths_for_files = ["//button[@aria-label='Send message']", "//button[@data-testid='send-button']"]
-        
-        for i_batch, batch_item in enumerate(file_batches_list):
-            if not batch_item: continue
-            print(f"\n--- Processing Batch {i_batch+1}/{len(file_batches_list)} ---")
-            file_chip_css = "div[data-test-id='file-preview']" 
-            chips_before_batch_upload = len(driver.find_elements(By.CSS_SELECTOR, file_chip_css))
-            try:
-                add_icon_locators = [ 
-                    (By.XPATH, "//button[@aria-label='Open upload file menu']"), 
-                    (By.XPATH, "//button[.//mat-icon[@fonticon='add_2']]") 
-                ]
-                add_icon_clicked_success = False
-                for loc_tuple in add_icon_locators:
-                    if click_element_robustly(driver, loc_tuple, element_description="'Add/Attach' (Plus) Icon", timeout=15):
-                        add_icon_clicked_success = True; break
-                if not add_icon_clicked_success: raise Exception("Failed to click 'Add/Attach' (Plus) icon using Selenium.")
-                print("  'Add/Attach' icon clicked. Pausing for menu...")
-                time.sleep(3.0) 
-
-                upload_btn_locators = [ 
-                    (By.CSS_SELECTOR, "button[data-test-id='local-image-file-uploader-button']"), 
-                    (By.XPATH, "//button[contains(normalize-space(.), 'Upload file') or contains(normalize-space(.), 'Upload from computer')]") 
-                ]
-                upload_button_clicked_success = False
-                for loc_tuple in upload_btn_locators:
-                    if click_element_robustly(driver, loc_tuple, element_description="'Upload Files' button in menu", timeout=15):
-                        upload_button_clicked_success = True; break
-                if not upload_button_clicked_success:
-                    raise Exception("Failed to click 'Upload Files' button in menu using Selenium.")
-                print("  'Upload files' menu button clicked. Pausing for OS file dialog to be ready...")
-                time.sleep(3.5) 
-                
-                file_input_locs = ["input[type='file']", "//input[@type='file' and (contains(@style,'display: none') or contains(@class,'hidden'))]"]
-                file_input = None
-                for loc_str_val in file_input_locs:
-                    try:
-                        file_input = WebDriverWait(driver, 5).until(EC.presence_of_element_located((By.XPATH, loc_str_val) if loc_str_val.startswith("//") else (By.CSS_SELECTOR, loc_str_val)))
-                        break 
-                    except TimeoutException: continue
-                if not file_input: raise Exception("Selenium File input element for batch upload not found.")
-                
-                print(f"  Selenium sending {len(batch_item)} file paths to input element...")
-                file_input.send_keys("\n".join(batch_item)) 
-                time.sleep(2.0 + len(batch_item) * 0.4) 
-                
-                WebDriverWait(driver, 20 + len(batch_item) * 2).until( 
-                    lambda d: len(d.find_elements(By.CSS_SELECTOR, file_chip_css)) > chips_before_batch_upload 
-                )
-                current_total_chips = len(driver.find_elements(By.CSS_SELECTOR, file_chip_css))
-                new_chips_this_batch = current_total_chips - chips_before_batch_upload
-                print(f"  Detected {new_chips_this_batch} new file chips (total on page: {current_total_chips}).")
-                if new_chips_this_batch < len(batch_item): 
-                    print(f"  Warning: Expected {len(batch_item)} new chips, but only {new_chips_this_batch} appeared. Some files might not have attached.")
-                
-                prompt_el_batch = WebDriverWait(driver, 10).until(EC.element_to_be_clickable((By.CSS_SELECTOR, working_prompt_selector)))
-                actual_txt_area_batch = prompt_el_batch
-                try: actual_txt_area_batch = prompt_el_batch.find_element(By.CSS_SELECTOR, "div[contenteditable='true']")
-                except: pass 
-                
-                if i_batch == 0: msg_batch = f"Uploading Batch 1 of {len(file_batches_list)}. Project structure is in '{SITEMAP_FILENAME}' (included). Wait for all files."
-                elif i_batch < len(file_batches_list) - 1: msg_batch = f"Uploading Batch {i_batch+1} of {len(file_batches_list)}. Please continue to wait."
-                else: msg_batch = f"Final Batch ({i_batch+1}/{len(file_batches_list)}). All {len(files_to_process)} files, including '{SITEMAP_FILENAME}', are now attached."
-                actual_txt_area_batch.send_keys(msg_batch); time.sleep(0.5)
-                
-                send_batch_msg_ok = False 
-                for xpath_send in send_btn_xpaths_for_files: 
-                    if click_element_robustly(driver, (By.XPATH, xpath_send), element_description="Send button (batch message)", timeout=7): send_batch_msg_ok = True; break
-                if not send_batch_msg_ok: raise Exception("Failed to send batch message using Selenium.")
-                
-                print("Batch message sent. Waiting for chips to clear & Gemini ready...")
-                wait_for_gemini_ready(driver, working_prompt_selector, 180, f"batch {i_batch+1} submission") 
-                
-                try:
-                    WebDriverWait(driver, 60).until( 
-                        lambda d: len(d.find_elements(By.CSS_SELECTOR, file_chip_css)) < current_total_chips or \
-                                  len(d.find_elements(By.CSS_SELECTOR, file_chip_css)) == 0
-                    )
-                    print("File chips seem to have been processed/cleared for this batch.")
-                except TimeoutException: 
-                    print("Warning: File chips did not fully clear as expected after this batch's message. Manual check advised.")
-            except Exception as e_batch_item_exc:
-                print(f"ERROR in batch {i_batch+1}: {e_batch_item_exc}")
-                driver.save_screenshot(f"gemini_batch_err_{i_batch+1}_{time.strftime('%Y%m%d-%H%M%S')}.png")
-                print("Skipping remaining batches."); break 
-        print("\nAll batches processed or stopped due to an error.")
+        journal = start_journal(TARGET_FOLDER, resume_from=journal)
+        uploaded_files, batches_done, _ = upload_planned_batches(driver, working_prompt_selector, upload_plan, journal)
     except Exception as e_main_exc:
         print(f"--- MAIN SCRIPT ERROR ---: {e_main_exc}")
         if driver:
             print(f"Current URL at error: {driver.current_url if hasattr(driver, 'current_url') else 'N/A'}")
             driver.save_screenshot(f"gemini_main_error_{time.strftime('%Y%m%d-%H%M%S')}.png")
     finally:
+        cleanup_upload_plan(upload_plan)
+        print_wait_summary(); print_locator_summary()
+        end_trace(batches_done=batches_done, files_uploaded=len(uploaded_files))
         print("\n--- Script Finished ---")
         if driver: print("Browser remains open. Close manually.")
         else: print("Browser not started/failed.")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Uploads TARGET_FOLDER's files to a Gemini conversation in batches.")
+    parser.add_argument("--resume", action="store_true", help="Continue the last interrupted upload (checkpoint journal) in the same conversation.")
+    cli_args = parser.parse_args()
     print("--- Gemini Uploader Script ---")
-    try: main()
+    try: main(resume=cli_args.resume)
     except Exception as e_global_script: print(f"--- GLOBAL SCRIPT ERROR ---: {e_global_script}")
     finally: input("Press Enter to exit console.")
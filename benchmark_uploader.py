@@ -0,0 +1,352 @@
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+# Offline benchmark harness for Gemini_File_Uploader.py. No Google account needed:
+#   python benchmark_uploader.py serve [--port 8765]              -> serve the mock Gemini page only
+#   python benchmark_uploader.py make-repo DEST [--files 2000 ...] -> generate a synthetic target folder
+#   python benchmark_uploader.py run [--files 2000 ...] [--no-browser] -> scan/batch/browser timings end to end
+#   python benchmark_uploader.py launch [--runs 3]                -> startup/page load/memory of the standard vs lean launch profile
+# Mock page behaviour is tuned with query parameters: gen_ms (fake "generating" time after each send),
+# attach_ms (per-file chip delay), menu_ms (upload menu open delay), error_every (show an error every Nth send),
+# no_drop=1 (ignore files dropped on the prompt, to exercise the upload menu fallback) and assets/asset_kb/asset_ms
+# (number, size and server delay of images and fonts on the page, like the real page's heavy resources).
+
+MOCK_GEMINI_HTML = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Mock Gemini</title>
+<style>
+  body { font-family: sans-serif; margin: 0; padding: 16px; }
+  rich-textarea { display: block; min-height: 40px; border: 1px solid #888; padding: 6px; }
+  [contenteditable] { min-height: 24px; outline: none; }
+  #upload-menu { display: none; border: 1px solid #ccc; padding: 4px; }
+  .chips { display: flex; flex-wrap: wrap; gap: 4px; margin: 6px 0; }
+  div[data-test-id='file-preview'] { border: 1px solid #4a4; padding: 2px 6px; font-size: 12px; }
+  #stop-btn { display: none; }
+</style></head>
+<body>
+<div id="conversation"></div>
+<div class="input-area">
+  <div class="chips" id="chips"></div>
+  <rich-textarea placeholder="Ask Gemini"><div contenteditable="true" id="editor"></div></rich-textarea>
+  <button aria-label="Open upload file menu" id="add-btn">+</button>
+  <div id="upload-menu"><button data-test-id="local-image-file-uploader-button" id="upload-btn">Upload files</button></div>
+  <button aria-label="Send message" id="send-btn" disabled>Send</button>
+  <button aria-label="Stop generating" id="stop-btn">Stop</button>
+</div>
+<script>
+  const params = new URLSearchParams(location.search);
+  const genMs = +(params.get('gen_ms') || 1500), attachMs = +(params.get('attach_ms') || 40);
+  const menuMs = +(params.get('menu_ms') || 150), errorEvery = +(params.get('error_every') || 0), noDrop = params.get('no_drop') === '1';
+  const $ = id => document.getElementById(id);
+  let sends = 0, pendingChips = 0;
+  const refreshSend = () => { $('send-btn').disabled = pendingChips > 0 || ($('editor').innerText.trim() === '' && !$('chips').children.length); };
+  $('editor').addEventListener('input', refreshSend);
+  $('add-btn').addEventListener('click', () => setTimeout(() => { $('upload-menu').style.display = 'block'; }, menuMs));
+  const addChips = files => {
+    pendingChips += files.length; refreshSend();
+    files.forEach((f, i) => setTimeout(() => {
+      const chip = document.createElement('div'); chip.setAttribute('data-test-id', 'file-preview'); chip.textContent = f.name;
+      $('chips').appendChild(chip); pendingChips--; refreshSend();
+    }, attachMs * (i + 1)));
+  };
+  $('upload-btn').addEventListener('click', () => {
+    $('upload-menu').style.display = 'none';
+    let input = document.querySelector("input[type='file']:not(#gemini-uploader-drop-input)");
+    if (!input) {
+      input = document.createElement('input'); input.type = 'file'; input.multiple = true; input.style.display = 'none';
+      input.addEventListener('change', () => { addChips(Array.from(input.files)); input.value = ''; });
+      document.body.appendChild(input);
+    }
+  });
+  const prompt = document.querySelector('rich-textarea');
+  ['dragenter', 'dragover'].forEach(type => prompt.addEventListener(type, e => e.preventDefault()));
+  prompt.addEventListener('drop', e => { e.preventDefault(); if (!noDrop) addChips(Array.from(e.dataTransfer.files)); });
+  $('send-btn').addEventListener('click', () => {
+    sends++; const text = $('editor').innerText.trim(); const attached = $('chips').children.length;
+    $('editor').innerText = ''; $('send-btn').disabled = true; $('stop-btn').style.display = 'inline-block';
+    const busy = document.createElement('div'); busy.textContent = 'Generating...'; $('conversation').appendChild(busy);
+    setTimeout(() => {
+      busy.remove(); $('stop-btn').style.display = 'none'; $('chips').innerHTML = '';
+      const reply = document.createElement('div');
+      if (errorEvery && sends % errorEvery === 0) { reply.className = 'response-error'; reply.textContent = 'Something went wrong'; }
+      else reply.textContent = 'Received ' + attached + ' files: ' + text.slice(0, 60);
+      $('conversation').appendChild(reply); refreshSend();
+    }, genMs);
+  });
+</script>
+</body></html>
+"""
+
+MOCK_ASSET_TYPES = {".png": "image/png", ".woff2": "font/woff2"}
+
+def mock_asset_tags(count, asset_kb, asset_ms):
+    """Image and font tags for the mock page: count assets, alternating PNG images and WOFF2 fonts."""
+    query = f"kb={asset_kb}&ms={asset_ms}"; tags = []
+    for i in range(count):
+        if i % 2: tags.append(f"<style>@font-face {{ font-family: mockfont{i}; src: url('/asset/font_{i}.woff2?{query}'); }} "
+                              f"#mock-assets .f{i} {{ font-family: mockfont{i}; }}</style><span class='f{i}'>icon</span>")
+        else: tags.append(f"<img src='/asset/img_{i}.png?{query}' width='24' height='24' alt=''>")
+    return f"<div id='mock-assets'>{''.join(tags)}</div>"
+
+class MockGeminiHandler(BaseHTTPRequestHandler):
+    """Serves MOCK_GEMINI_HTML for every GET path (so /app?gen_ms=... works like the real URL), and /asset/ files."""
+    def do_GET(self):
+        url = urlsplit(self.path); params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        if url.path.startswith("/asset/"):
+            time.sleep(int(params.get("ms", 0)) / 1000.0)
+            body = os.urandom(int(params.get("kb", 50)) * 1024); content_type = MOCK_ASSET_TYPES.get(os.path.splitext(url.path)[1], "application/octet-stream")
+        else:
+            html = MOCK_GEMINI_HTML
+            if int(params.get("assets", 0)):
+                html = html.replace('<div id="conversation"></div>', mock_asset_tags(int(params["assets"]), params.get("asset_kb", 50), params.get("asset_ms", 50))
+                                    + '<div id="conversation"></div>', 1)
+            body = html.encode("utf-8"); content_type = "text/html; charset=utf-8"
+        self.send_response(200)
+        self.send_header("Content-Type", content_type); self.send_header("Content-Length", str(len(body)))
+        self.end_headers(); self.wfile.write(body)
+
+    def log_message(self, format, *args): pass # Keep benchmark output readable.
+
+def start_mock_server(port=0):
+    """Starts the mock Gemini server in a daemon thread. Returns (server, base_url)."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), MockGeminiHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/app"
+
+SYNTHETIC_EXTENSIONS = [".py", ".js", ".ts", ".md", ".json", ".css", ".html", ".yaml", ".txt", ".go"]
+
+def make_synthetic_repo(dest_dir, files=2000, depth=3, dirs_per_level=4, min_size=200, max_size=20000,
+                        ignored_files=500, duplicate_ratio=0.0, seed=1234):
+    """Generates a synthetic project tree of text files. Returns {"files", "bytes", "ignored_files"}.
+
+    Files are spread over a dirs_per_level^depth directory tree with log-uniform sizes between min_size and
+    max_size. ignored_files are written under node_modules/ and .git/ (the scanner should prune them) and
+    duplicate_ratio of the files are byte-identical copies of earlier ones.
+    """
+    rng = random.Random(seed)
+    dirs = [""]; frontier = [""]
+    for level in range(depth):
+        frontier = [os.path.join(d, f"pkg{level}_{i}") for d in frontier for i in range(dirs_per_level)]
+        dirs += frontier
+    written = []; total_bytes = 0
+    for i in range(files):
+        rel_dir = rng.choice(dirs); ext = rng.choice(SYNTHETIC_EXTENSIONS)
+        path = os.path.join(dest_dir, rel_dir, f"file_{i:06d}{ext}")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if written and rng.random() < duplicate_ratio:
+            with open(rng.choice(written), "rb") as src: content = src.read()
+        else:
+            size = int(min_size * (max_size / min_size) ** rng.random())
+            line = f"# synthetic line for {ext} file {i} " + "x" * 40 + "\n"
+            content = (line * (size // len(line) + 1))[:size].encode("utf-8")
+        with open(path, "wb") as f: f.write(content)
+        written.append(path); total_bytes += len(content)
+    for i in range(ignored_files):
+        ignored_dir = os.path.join(dest_dir, "node_modules" if i % 2 == 0 else ".git", f"dep{i % 50}")
+        os.makedirs(ignored_dir, exist_ok=True)
+        with open(os.path.join(ignored_dir, f"index_{i}.js"), "w", encoding="utf-8") as f: f.write("module.exports = {};\n")
+    return {"files": files, "bytes": total_bytes, "ignored_files": ignored_files}
+
+def launch_benchmark_driver(headless=True):
+    """Starts a local Chrome for the mock page (Selenium Manager resolves chromedriver, no network login needed)."""
+    from selenium import webdriver
+    options = webdriver.ChromeOptions()
+    if headless: options.add_argument("--headless=new")
+    for arg in ("--no-sandbox", "--disable-dev-shm-usage", "--disable-gpu", "--window-size=1280,900"): options.add_argument(arg)
+    return webdriver.Chrome(options=options)
+
+def process_tree_rss_mb(root_pid):
+    """Resident memory (MB) of a process and all its descendants (psutil if installed, else /proc on Linux). None if unknown."""
+    try:
+        import psutil
+        root = psutil.Process(root_pid)
+        return sum(p.memory_info().rss for p in [root] + root.children(recursive=True)) / 1e6
+    except ImportError: pass
+    except Exception: return None
+    if not os.path.isdir("/proc"): return None
+    parents = {}
+    for name in os.listdir("/proc"):
+        if not name.isdigit(): continue
+        try:
+            with open(f"/proc/{name}/stat", "r") as f: parents[int(name)] = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, ValueError, IndexError): continue
+    tree = {root_pid}; grown = True
+    while grown:
+        children = {pid for pid, ppid in parents.items() if ppid in tree and pid not in tree}
+        tree |= children; grown = bool(children)
+    total_kb = 0
+    for pid in tree:
+        try:
+            with open(f"/proc/{pid}/status", "r") as f:
+                total_kb += next((int(line.split()[1]) for line in f if line.startswith("VmRSS:")), 0)
+        except (OSError, ValueError): continue
+    return total_kb * 1024 / 1e6
+
+def run_launch_benchmark(args):
+    """Launches Chrome with the standard and the lean profile against the mock page; compares startup, page load and memory."""
+    import Gemini_File_Uploader as uploader
+    from selenium import webdriver
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+
+    server, mock_url = start_mock_server(args.port)
+    page_url = mock_url + f"?assets={args.assets}&asset_kb={args.asset_kb}&asset_ms={args.asset_ms}"
+    print(f"BENCH: Mock page with {args.assets} images/fonts ({args.asset_kb} KB, {args.asset_ms} ms each): {page_url}")
+    results = {}
+    try:
+        for profile in ("standard", "lean"):
+            for run in range(args.runs):
+                options = webdriver.ChromeOptions()
+                for arg in ("--no-sandbox", "--disable-dev-shm-usage", "--disable-gpu"): options.add_argument(arg)
+                if profile == "standard" and args.headless: options.add_argument("--headless=new") # No display on this runner.
+                uploader.apply_launch_profile(options, profile, headless=not args.lean_headed)
+                start = time.time(); driver = webdriver.Chrome(options=options); started = time.time()
+                try:
+                    if profile == "lean": uploader.block_heavy_resources(driver)
+                    elif not args.headless: driver.maximize_window()
+                    driver.get(page_url)
+                    WebDriverWait(driver, 60).until(EC.presence_of_element_located((By.CSS_SELECTOR, ".input-area rich-textarea")))
+                    loaded = time.time()
+                    resources = driver.execute_script("return performance.getEntriesByType('resource').filter(r => r.transferSize > 0).length")
+                    time.sleep(args.settle) # Let the renderer settle before sampling memory.
+                    rss = process_tree_rss_mb(driver.service.process.pid)
+                finally: driver.quit()
+                results.setdefault(profile, []).append({"startup": started - start, "load": loaded - started, "rss": rss, "resources": resources})
+                print(f"BENCH: {profile} run {run + 1}: startup {started - start:.2f}s, page load {loaded - started:.2f}s, "
+                      f"{resources} resources fetched, RSS {f'{rss:.0f} MB' if rss is not None else 'n/a'}")
+    finally: server.shutdown()
+
+    median = lambda values: sorted(values)[len(values) // 2] if values else None
+    print(f"\n{'profile':<10}{'startup s':>11}{'page load s':>13}{'resources':>11}{'RSS MB':>9}")
+    for profile, runs in results.items():
+        rss = median([r["rss"] for r in runs if r["rss"] is not None])
+        rss_text = f"{rss:.0f}" if rss is not None else "n/a"
+        print(f"{profile:<10}{median([r['startup'] for r in runs]):>11.2f}{median([r['load'] for r in runs]):>13.2f}"
+              f"{median([r['resources'] for r in runs]):>11}{rss_text:>9}")
+    return 0
+
+def run_benchmark(args):
+    import Gemini_File_Uploader as uploader
+    import trace_report
+
+    work_dir = tempfile.mkdtemp(prefix="gemini_bench_")
+    repo_dir = args.repo or os.path.join(work_dir, "repo")
+    trace_dir = os.path.join(work_dir, "traces")
+    uploader.LOCATOR_STATS_PATH = os.path.join(work_dir, "locator_stats.json") # Mock-page results must not train the real locator stats.
+    uploader.COMPACT_CACHE_DIR = os.path.join(work_dir, "compact_cache")
+    driver = None; server = None; upload_plan = None
+    try:
+        if not args.repo:
+            print(f"BENCH: Generating synthetic repo ({args.files} files) in {repo_dir}...")
+            gen = make_synthetic_repo(repo_dir, files=args.files, depth=args.depth, dirs_per_level=args.dirs_per_level,
+                                      min_size=args.min_size, max_size=args.max_size, ignored_files=args.ignored_files,
+                                      duplicate_ratio=args.duplicate_ratio, seed=args.seed)
+            print(f"BENCH: {gen['files']} files, {gen['bytes'] / 1e6:.1f} MB (+{gen['ignored_files']} in ignored dirs).")
+        uploader.BUNDLE_MODE = args.bundle; uploader.COMPACT_MODE = args.compact
+        uploader.start_trace(trace_dir, benchmark=True, repo=repo_dir, bundle_mode=args.bundle, compact_mode=args.compact)
+        run_start = time.time()
+        upload_plan = uploader.prepare_files_for_upload(repo_dir)
+        if not upload_plan: print("BENCH: Nothing to upload."); return 1
+        report = upload_plan["packing_report"]
+        print(f"BENCH: {len(upload_plan['files_to_process'])} files -> {report['batches']} batches "
+              f"(fixed-count: {report['fixed_count_batches']}).")
+
+        if not args.no_browser:
+            server, mock_url = start_mock_server(args.port)
+            uploader.GEMINI_URL = mock_url + f"?gen_ms={args.gen_ms}&attach_ms={args.attach_ms}&menu_ms={args.menu_ms}" + ("&no_drop=1" if args.no_drop else "")
+            uploader.FAST_ATTACH_ENABLED = not args.no_fast_attach
+            print(f"BENCH: Mock Gemini at {uploader.GEMINI_URL}")
+            with uploader.trace_span("browser_launch"):
+                driver = launch_benchmark_driver(headless=not args.headed)
+                driver.get(uploader.GEMINI_URL)
+            prompt_selector = ".input-area rich-textarea"
+            uploader.wait_for_gemini_ready(driver, prompt_selector, 30, "mock page load")
+            batches = upload_plan["batches"][:args.max_batches] if args.max_batches else upload_plan["batches"]
+            file_stats = upload_plan["scan_result"]["file_stats"]
+            for i_batch, batch_item in enumerate(batches):
+                with uploader.trace_span("batch", batch=i_batch, files=len(batch_item), bytes=uploader.batch_bytes(batch_item, file_stats)):
+                    uploader.upload_batch(driver, batch_item, i_batch, len(batches), len(upload_plan["files_to_process"]), prompt_selector)
+        total_seconds = time.time() - run_start
+        uploader.end_trace(benchmark_seconds=total_seconds)
+
+        print(f"\nBENCH: End-to-end {total_seconds:.2f}s")
+        trace_report.print_report(trace_report.load_trace_records([trace_dir]))
+        uploader.print_wait_summary(); uploader.print_locator_summary()
+        if args.keep_traces:
+            os.makedirs(args.keep_traces, exist_ok=True)
+            for name in os.listdir(trace_dir): shutil.copy(os.path.join(trace_dir, name), args.keep_traces)
+            print(f"BENCH: Trace copied to {args.keep_traces}")
+        return 0
+    finally:
+        if driver: driver.quit()
+        if server: server.shutdown()
+        uploader.cleanup_upload_plan(upload_plan)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def add_repo_shape_args(parser):
+    parser.add_argument("--files", type=int, default=2000, help="Number of files to generate.")
+    parser.add_argument("--depth", type=int, default=3, help="Directory nesting depth.")
+    parser.add_argument("--dirs-per-level", type=int, default=4, help="Subdirectories per directory.")
+    parser.add_argument("--min-size", type=int, default=200, help="Smallest file size in bytes.")
+    parser.add_argument("--max-size", type=int, default=20000, help="Largest file size in bytes.")
+    parser.add_argument("--ignored-files", type=int, default=500, help="Files placed in node_modules/.git (should be pruned).")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.0, help="Fraction of files that duplicate earlier ones.")
+    parser.add_argument("--seed", type=int, default=1234, help="Random seed for a reproducible tree.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmark harness for Gemini_File_Uploader.py.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    serve_p = sub.add_parser("serve", help="Serve the mock Gemini page until interrupted.")
+    serve_p.add_argument("--port", type=int, default=8765)
+    repo_p = sub.add_parser("make-repo", help="Generate a synthetic target folder.")
+    repo_p.add_argument("dest")
+    add_repo_shape_args(repo_p)
+    run_p = sub.add_parser("run", help="Run scan, batching and (optionally) browser upload against the mock page.")
+    add_repo_shape_args(run_p)
+    run_p.add_argument("--repo", help="Benchmark an existing folder instead of generating one.")
+    run_p.add_argument("--no-browser", action="store_true", help="Only time the scan/manifest/bundle/pack pipeline.")
+    run_p.add_argument("--headed", action="store_true", help="Show the browser window.")
+    run_p.add_argument("--bundle", action="store_true", help="Enable BUNDLE_MODE for the run.")
+    run_p.add_argument("--compact", action="store_true", help="Enable COMPACT_MODE for the run.")
+    run_p.add_argument("--max-batches", type=int, default=0, help="Only upload the first N batches.")
+    run_p.add_argument("--port", type=int, default=0, help="Mock server port (default: any free port).")
+    run_p.add_argument("--gen-ms", type=int, default=1500, help="Mock 'generating' time after each send.")
+    run_p.add_argument("--attach-ms", type=int, default=40, help="Mock per-file chip delay.")
+    run_p.add_argument("--menu-ms", type=int, default=150, help="Mock upload menu open delay.")
+    run_p.add_argument("--no-fast-attach", action="store_true", help="Always attach through the upload menu (FAST_ATTACH_ENABLED off).")
+    run_p.add_argument("--no-drop", action="store_true", help="Make the mock page ignore dropped files.")
+    run_p.add_argument("--keep-traces", help="Copy the run's JSONL trace into this directory.")
+    launch_p = sub.add_parser("launch", help="Compare startup, page load and memory of the standard and lean browser profiles.")
+    launch_p.add_argument("--runs", type=int, default=3, help="Launches per profile (medians are reported).")
+    launch_p.add_argument("--assets", type=int, default=40, help="Images/fonts on the mock page.")
+    launch_p.add_argument("--asset-kb", type=int, default=60, help="Size of each image/font.")
+    launch_p.add_argument("--asset-ms", type=int, default=80, help="Server delay for each image/font.")
+    launch_p.add_argument("--settle", type=float, default=2.0, help="Seconds to wait after load before sampling memory.")
+    launch_p.add_argument("--headless", action="store_true", help="Run the standard profile headless too (runners without a display).")
+    launch_p.add_argument("--lean-headed", action="store_true", help="Run the lean profile with a window (as with LEAN_HEADLESS=false).")
+    launch_p.add_argument("--port", type=int, default=0, help="Mock server port (default: any free port).")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        server, url = start_mock_server(args.port)
+        print(f"BENCH: Mock Gemini page at {url} (Ctrl+C to stop)")
+        try:
+            while True: time.sleep(3600)
+        except KeyboardInterrupt: server.shutdown()
+    elif args.command == "make-repo":
+        result = make_synthetic_repo(args.dest, files=args.files, depth=args.depth, dirs_per_level=args.dirs_per_level,
+                                     min_size=args.min_size, max_size=args.max_size, ignored_files=args.ignored_files,
+                                     duplicate_ratio=args.duplicate_ratio, seed=args.seed)
+        print(f"BENCH: Wrote {result['files']} files ({result['bytes'] / 1e6:.1f} MB) to {args.dest}")
+    elif args.command == "launch":
+        sys.exit(run_launch_benchmark(args))
+    else:
+        sys.exit(run_benchmark(args))
@@ -0,0 +1,159 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+# In-process image locator for native (non-web) pop-ups: NumPy template matching on screenshot arrays.
+#   python image_locator.py --image use_guest_button.png [--confidence 0.8] [--region L,T,W,H]  -> find and click
+# Offline tests on synthetic screenshots (no display needed): python -m pytest test_image_locator.py
+# Scores are zero-mean normalized cross-correlation (-1..1), the same scale as pyautogui/OpenCV "confidence".
+
+COARSE_SCALE = 4 # The first pass runs on screenshot and template downscaled by this factor.
+MIN_COARSE_TEMPLATE_SIDE = 8 # Smallest template side (px) left after downscaling; smaller templates use a smaller factor.
+COARSE_CANDIDATES = 3 # Best coarse positions that are refined at full resolution.
+LAST_HIT_MARGIN = 24 # Pixels around the last hit that are searched first (a pop-up usually reappears in the same place).
+
+_LAST_HITS = {} # cache_key -> (left, top) of the last match, in screenshot pixels.
+_TEMPLATES = {} # path -> grayscale template array.
+
+def to_gray(image):
+    """Float grayscale array from an RGB(A) or grayscale array (or PIL image)."""
+    array = np.asarray(image, dtype=np.float64)
+    if array.ndim == 3: array = array[..., :3] @ np.array([0.299, 0.587, 0.114])
+    return array
+
+def downscale(array, factor):
+    """Block-mean downscale by an integer factor (edge rows/columns that don't fill a block are dropped)."""
+    if factor <= 1: return array
+    h, w = array.shape[0] // factor, array.shape[1] // factor
+    return array[:h * factor, :w * factor].reshape(h, factor, w, factor).mean(axis=(1, 3))
+
+def ncc_map(image, template):
+    """Zero-mean normalized cross-correlation of template at every position of image where it fits entirely.
+
+    The correlation runs through one FFT product and the per-window means/variances come from integral images,
+    so the cost does not grow with the template size. Flat windows score 0.
+    """
+    ih, iw = image.shape; th, tw = template.shape
+    if th > ih or tw > iw: return np.zeros((0, 0))
+    t = template - template.mean(); t_norm = np.sqrt((t * t).sum())
+    if t_norm == 0: return np.zeros((ih - th + 1, iw - tw + 1))
+    # Circular correlation is exact for these positions: the template never wraps around the edge.
+    corr = np.fft.irfft2(np.fft.rfft2(image) * np.conj(np.fft.rfft2(t, s=image.shape)), s=image.shape)[:ih - th + 1, :iw - tw + 1]
+    window_sums = []
+    for values in (image, image * image):
+        ii = np.pad(values.cumsum(0).cumsum(1), ((1, 0), (1, 0)))
+        window_sums.append(ii[th:, tw:] - ii[:-th, tw:] - ii[th:, :-tw] + ii[:-th, :-tw])
+    window_var = np.maximum(window_sums[1] - window_sums[0] ** 2 / (th * tw), 0.0) # th*tw times the window variance.
+    denom = np.sqrt(window_var) * t_norm
+    scores = np.zeros_like(corr)
+    np.divide(corr, denom, out=scores, where=denom > 1e-6 * t_norm)
+    return scores
+
+def _best_in_window(screen, template, left, top, margin):
+    """Full-resolution search for template around (left, top) +/- margin. Returns (left, top, score) or None."""
+    th, tw = template.shape
+    y0 = max(0, top - margin); x0 = max(0, left - margin)
+    crop = screen[y0:min(screen.shape[0], top + th + margin), x0:min(screen.shape[1], left + tw + margin)]
+    scores = ncc_map(crop, template)
+    if not scores.size: return None
+    y, x = np.unravel_index(np.argmax(scores), scores.shape)
+    return (x0 + int(x), y0 + int(y), float(scores[y, x]))
+
+def _top_peaks(scores, count, spread):
+    """Positions of the count highest scores, at least spread cells apart (simple non-maximum suppression)."""
+    scores = scores.copy(); peaks = []
+    for _ in range(count):
+        y, x = np.unravel_index(np.argmax(scores), scores.shape)
+        if not np.isfinite(scores[y, x]) or (peaks and scores[y, x] <= -1): break
+        peaks.append((int(y), int(x)))
+        scores[max(0, y - spread):y + spread + 1, max(0, x - spread):x + spread + 1] = -np.inf
+    return peaks
+
+def find_template(screen, template, region=None, confidence=0.8, scale=None, cache_key=None):
+    """Finds template in a screenshot array. region = (left, top, width, height) limits the search (ROI).
+
+    Tries the last hit for cache_key first, then a coarse search on downscaled arrays whose best candidates are
+    refined at full resolution; if none reaches confidence, the whole area is searched at full resolution.
+    Returns {"found", "x", "y" (match center), "confidence", "box" (left, top, w, h), "method" ("cached", "coarse"
+    or "full"), "seconds"}, or None if the template is larger than the search area.
+    """
+    start = time.time(); screen = to_gray(screen); template = to_gray(template)
+    th, tw = template.shape; off_x = off_y = 0
+    if region:
+        left, top, width, height = (int(v) for v in region)
+        left, top = max(0, left), max(0, top)
+        area = screen[top:top + height, left:left + width]
+        if area.shape[0] >= th and area.shape[1] >= tw: screen = area; off_x, off_y = left, top # Else the ROI is off-screen: search everything.
+    if screen.shape[0] < th or screen.shape[1] < tw: return None
+
+    def result(hit, method):
+        x, y, score = hit
+        if score >= confidence and cache_key is not None: _LAST_HITS[cache_key] = (off_x + x, off_y + y)
+        return {"found": score >= confidence, "x": off_x + x + tw // 2, "y": off_y + y + th // 2, "confidence": score,
+                "box": (off_x + x, off_y + y, tw, th), "method": method, "seconds": time.time() - start}
+
+    if cache_key in _LAST_HITS:
+        last_x, last_y = _LAST_HITS[cache_key]
+        hit = _best_in_window(screen, template, last_x - off_x, last_y - off_y, LAST_HIT_MARGIN)
+        if hit and hit[2] >= confidence: return result(hit, "cached")
+    factor = scale if scale is not None else max(1, min(COARSE_SCALE, min(th, tw) // MIN_COARSE_TEMPLATE_SIDE))
+    if factor > 1:
+        coarse = ncc_map(downscale(screen, factor), downscale(template, factor))
+        if coarse.size:
+            hits = [_best_in_window(screen, template, x * factor, y * factor, 2 * factor)
+                    for y, x in _top_peaks(coarse, COARSE_CANDIDATES, max(1, min(th, tw) // (2 * factor)))]
+            best = max((h for h in hits if h), key=lambda h: h[2], default=None)
+            if best and best[2] >= confidence: return result(best, "coarse")
+    # No template-sized coarse hit (small or thin buttons can blur away when downscaled): search at full resolution.
+    scores = ncc_map(screen, template)
+    y, x = np.unravel_index(np.argmax(scores), scores.shape)
+    return result((int(x), int(y), float(scores[y, x])), "full")
+
+def load_template(image_path):
+    """Grayscale array of an image file (Pillow), cached per path."""
+    if image_path not in _TEMPLATES:
+        from PIL import Image
+        with Image.open(image_path) as img: _TEMPLATES[image_path] = to_gray(img.convert("RGB"))
+    return _TEMPLATES[image_path]
+
+def grab_screen():
+    """Screenshot as an RGB array plus the screenshot-pixels-per-screen-point ratio (2.0 on most HiDPI displays)."""
+    import pyautogui # Imported here: it needs a display, and the matcher itself does not.
+    shot = pyautogui.screenshot()
+    return np.asarray(shot.convert("RGB")), shot.size[0] / float(pyautogui.size()[0])
+
+def locate_on_screen(image_path, region=None, confidence=0.8):
+    """Finds an image on the screen. region is in screen points. Returns find_template's result in screen points, or None."""
+    screen, ratio = grab_screen()
+    pixel_region = tuple(int(v * ratio) for v in region) if region else None
+    match = find_template(screen, load_template(image_path), pixel_region, confidence, cache_key=image_path)
+    if match and ratio != 1:
+        match.update(x=int(match["x"] / ratio), y=int(match["y"] / ratio), box=tuple(int(v / ratio) for v in match["box"]))
+    return match
+
+def click_image(image_path, region=None, confidence=0.8, attempts=5, interval=0.5):
+    """Looks for an image up to attempts times and clicks its center once found. Returns the last match (or None)."""
+    import pyautogui
+    match = None
+    for attempt in range(attempts):
+        match = locate_on_screen(image_path, region, confidence)
+        if match and match["found"]:
+            pyautogui.click(match["x"], match["y"]); return match
+        if attempt < attempts - 1: time.sleep(interval)
+    return match
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Finds an image on the screen with NumPy template matching and clicks it.")
+    parser.add_argument("--image", help="Image file of the button to click (relative paths are looked up next to this script).")
+    parser.add_argument("--confidence", type=float, default=0.8, help="Minimum match score (0..1).")
+    parser.add_argument("--attempts", type=int, default=5, help="Screenshots to try before giving up.")
+    parser.add_argument("--region", help="Search only in LEFT,TOP,WIDTH,HEIGHT (screen points).")
+    args = parser.parse_args()
+
+    if not args.image: parser.error("--image is required.")
+    image_path = args.image if os.path.isabs(args.image) else os.path.join(os.path.dirname(os.path.abspath(__file__)), args.image)
+    found = click_image(image_path, tuple(int(v) for v in args.region.split(",")) if args.region else None, args.confidence, args.attempts)
+    if found and found["found"]: print(f"IMAGE_LOCATOR: Clicked '{args.image}' at ({found['x']}, {found['y']}), confidence {found['confidence']:.3f}."); sys.exit(0)
+    print(f"IMAGE_LOCATOR: '{args.image}' not found" + (f" (best confidence {found['confidence']:.3f})." if found else ".")); sys.exit(1)
@@ -0,0 +1,107 @@
+import numpy as np
+import pytest
+
+import image_locator
+
+# Offline tests for image_locator.find_template on synthetic screenshots: no display, browser or image files needed.
+
+def synthetic_case(rng, size=(720, 1280), template_size=(40, 150)):
+    """A low-contrast noisy 'screenshot' with a button-like template pasted at a random spot. Returns (screen, template, left, top)."""
+    screen = (rng.integers(0, 256, size=size + (3,)) * 0.3 + 120).astype(np.uint8)
+    th, tw = template_size
+    template = np.full((th, tw, 3), 235, dtype=np.uint8)
+    template[th // 4:th - th // 4, tw // 6:tw - tw // 6] = rng.integers(0, 80, size=(th - 2 * (th // 4), tw - 2 * (tw // 6), 3)) # "Label" text.
+    template[:2] = template[-2:] = template[:, :2] = template[:, -2:] = 60 # Border.
+    top = int(rng.integers(0, size[0] - th)); left = int(rng.integers(0, size[1] - tw))
+    screen[top:top + th, left:left + tw] = template
+    return screen, template, left, top
+
+@pytest.fixture(autouse=True)
+def clear_last_hits():
+    image_locator._LAST_HITS.clear(); yield; image_locator._LAST_HITS.clear()
+
+@pytest.mark.parametrize("seed", range(5))
+def test_exact_match(seed):
+    screen, template, left, top = synthetic_case(np.random.default_rng(seed))
+    match = image_locator.find_template(screen, template, confidence=0.9)
+    assert match["found"] and match["method"] == "coarse"
+    assert match["box"] == (left, top, template.shape[1], template.shape[0])
+    assert (match["x"], match["y"]) == (left + template.shape[1] // 2, top + template.shape[0] // 2)
+    assert match["confidence"] == pytest.approx(1.0, abs=1e-6)
+
+def test_brightness_change_and_noise():
+    rng = np.random.default_rng(10)
+    screen, template, left, top = synthetic_case(rng)
+    noisy = np.clip(screen * 0.8 + 30 + rng.normal(0, 12, screen.shape), 0, 255).astype(np.uint8)
+    match = image_locator.find_template(noisy, template, confidence=0.7)
+    assert match["found"] and 0.7 <= match["confidence"] < 1.0
+    assert abs(match["box"][0] - left) <= 1 and abs(match["box"][1] - top) <= 1
+
+def test_region_of_interest():
+    screen, template, left, top = synthetic_case(np.random.default_rng(11))
+    region = (left - 50, top - 30, template.shape[1] + 100, template.shape[0] + 60)
+    match = image_locator.find_template(screen, template, region=region, confidence=0.9)
+    assert match["found"] and match["box"][:2] == (left, top) and match["confidence"] > 0.99
+
+def test_region_excluding_the_button_finds_nothing():
+    screen, template, left, top = synthetic_case(np.random.default_rng(12), template_size=(40, 150))
+    region = (0, 0, 300, 200) if left > 300 or top > 200 else (900, 500, 300, 200)
+    match = image_locator.find_template(screen, template, region=region, confidence=0.8)
+    assert not match["found"] and match["confidence"] < 0.8
+
+def test_region_too_small_falls_back_to_whole_screen():
+    screen, template, left, top = synthetic_case(np.random.default_rng(13))
+    match = image_locator.find_template(screen, template, region=(0, 0, 10, 10), confidence=0.9)
+    assert match["found"] and match["box"][:2] == (left, top)
+
+def test_last_hit_cache():
+    screen, template, left, top = synthetic_case(np.random.default_rng(14))
+    first = image_locator.find_template(screen, template, confidence=0.9, cache_key="button")
+    second = image_locator.find_template(screen, template, confidence=0.9, cache_key="button")
+    assert first["method"] == "coarse" and second["method"] == "cached"
+    assert second["box"][:2] == (left, top) and second["confidence"] > 0.99
+
+def test_moved_button_ignores_stale_cache_entry():
+    screen, template, left, top = synthetic_case(np.random.default_rng(15))
+    th, tw = template.shape[:2]
+    image_locator.find_template(screen, template, confidence=0.9, cache_key="button")
+    moved = screen.copy(); moved[top:top + th, left:left + tw] = 128
+    new_top, new_left = (top + 200) % (screen.shape[0] - th), (left + 300) % (screen.shape[1] - tw)
+    moved[new_top:new_top + th, new_left:new_left + tw] = template
+    match = image_locator.find_template(moved, template, confidence=0.9, cache_key="button")
+    assert match["found"] and match["method"] != "cached" and match["box"][:2] == (new_left, new_top)
+    assert image_locator._LAST_HITS["button"] == (new_left, new_top)
+
+def test_missing_button_is_not_found():
+    rng = np.random.default_rng(16)
+    _, template, _, _ = synthetic_case(rng)
+    absent = rng.integers(100, 160, size=(720, 1280, 3)).astype(np.uint8)
+    match = image_locator.find_template(absent, template, confidence=0.8, cache_key="button")
+    assert not match["found"] and match["confidence"] < 0.3
+    assert "button" not in image_locator._LAST_HITS
+
+def test_small_template_uses_full_resolution():
+    screen, template, left, top = synthetic_case(np.random.default_rng(17), size=(200, 300), template_size=(12, 20))
+    match = image_locator.find_template(screen, template, confidence=0.9)
+    assert match["found"] and match["method"] == "full" and match["box"][:2] == (left, top)
+
+def test_thin_pattern_lost_by_downscaling_falls_back_to_full_resolution():
+    rng = np.random.default_rng(18)
+    screen = rng.integers(100, 160, size=(400, 600)).astype(np.uint8)
+    template = np.tile(np.array([20, 230], dtype=np.uint8), (16, 32)) # 1px stripes average to flat gray when downscaled.
+    screen[150:166, 250:314] = template
+    match = image_locator.find_template(screen, template, confidence=0.9)
+    assert match["found"] and match["method"] == "full" and match["box"][:2] == (250, 150)
+
+def test_template_larger_than_screen():
+    screen, template, _, _ = synthetic_case(np.random.default_rng(19), size=(200, 300), template_size=(12, 20))
+    assert image_locator.find_template(template, screen) is None
+
+def test_ncc_map_matches_direct_computation():
+    rng = np.random.default_rng(20)
+    image = rng.random((30, 40)); template = rng.random((7, 9))
+    scores = image_locator.ncc_map(image, template)
+    t = template - template.mean()
+    for y, x in [(0, 0), (5, 11), (23, 31)]:
+        window = image[y:y + 7, x:x + 9] - image[y:y + 7, x:x + 9].mean()
+        assert scores[y, x] == pytest.approx((window * t).sum() / np.sqrt((window ** 2).sum() * (t ** 2).sum()))
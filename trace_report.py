@@ -0,0 +1,88 @@
+import os
+import sys
+import json
+import glob
+import argparse
+import math
+
+# Default location of the JSONL traces written by Gemini_File_Uploader.py (see TRACE_DIR there).
+DEFAULT_TRACE_DIR = os.environ.get("TRACE_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "upload_traces")
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values: return 0.0
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+def load_trace_records(paths):
+    """Reads span/run records from trace files or directories of trace_*.jsonl files. Bad lines are skipped."""
+    trace_files = []
+    for path in paths:
+        if os.path.isdir(path): trace_files.extend(sorted(glob.glob(os.path.join(path, "trace_*.jsonl"))))
+        elif os.path.isfile(path): trace_files.append(path)
+        else: print(f"TRACE_REPORT: Warning: '{path}' not found, skipping.")
+    records = []
+    for trace_file in trace_files:
+        with open(trace_file, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line: continue
+                try: records.append(json.loads(line))
+                except ValueError: print(f"TRACE_REPORT: Warning: Skipping malformed line in '{trace_file}'.")
+    return records
+
+def aggregate_phases(records):
+    """Groups span durations by phase: {phase: {"count", "failed", "p50", "p95", "mean", "total"}}."""
+    durations = {}; failed = {}
+    for r in records:
+        if r.get("type") != "span": continue
+        durations.setdefault(r["phase"], []).append(r["duration"])
+        if not r.get("ok", True): failed[r["phase"]] = failed.get(r["phase"], 0) + 1
+    stats = {}
+    for phase, values in durations.items():
+        values.sort()
+        stats[phase] = {"count": len(values), "failed": failed.get(phase, 0), "p50": percentile(values, 50),
+                        "p95": percentile(values, 95), "mean": sum(values) / len(values), "total": sum(values)}
+    return stats
+
+def batch_throughput(records, run_id=None):
+    """Files/s and MB/s over all successful batch spans (optionally for one run)."""
+    batches = [r for r in records if r.get("type") == "span" and r.get("phase") == "batch" and r.get("ok", True)
+               and (run_id is None or r.get("run") == run_id)]
+    seconds = sum(r["duration"] for r in batches)
+    files = sum(r.get("files", 0) for r in batches); total_bytes = sum(r.get("bytes", 0) for r in batches)
+    return {"batches": len(batches), "files": files, "bytes": total_bytes, "seconds": seconds,
+            "files_per_s": files / seconds if seconds else 0.0, "mb_per_s": total_bytes / 1e6 / seconds if seconds else 0.0}
+
+def print_report(records, by_run=False):
+    runs = sorted({r.get("run") for r in records if r.get("run")})
+    print(f"TRACE_REPORT: {len(runs)} run(s), {sum(1 for r in records if r.get('type') == 'span')} spans.\n")
+    print(f"{'phase':<18}{'count':>7}{'failed':>8}{'p50 s':>10}{'p95 s':>10}{'mean s':>10}{'total s':>11}")
+    for phase, st in sorted(aggregate_phases(records).items(), key=lambda kv: -kv[1]["total"]):
+        print(f"{phase:<18}{st['count']:>7}{st['failed']:>8}{st['p50']:>10.2f}{st['p95']:>10.2f}{st['mean']:>10.2f}{st['total']:>11.1f}")
+    tp = batch_throughput(records)
+    print(f"\nThroughput: {tp['files']} files / {tp['bytes'] / 1e6:.2f} MB in {tp['batches']} batches over {tp['seconds']:.1f}s "
+          f"-> {tp['files_per_s']:.2f} files/s, {tp['mb_per_s']:.3f} MB/s")
+    if by_run:
+        # Per-run p50s make regressions (e.g. after a Gemini UI change) easy to spot run over run.
+        print(f"\n{'run':<26}{'batches':>8}{'files/s':>9}{'MB/s':>8}  p50 per phase")
+        for run_id in runs:
+            run_records = [r for r in records if r.get("run") == run_id]
+            tp = batch_throughput(records, run_id)
+            p50s = ", ".join(f"{phase}={st['p50']:.1f}" for phase, st in sorted(aggregate_phases(run_records).items()))
+            print(f"{run_id:<26}{tp['batches']:>8}{tp['files_per_s']:>9.2f}{tp['mb_per_s']:>8.3f}  {p50s}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Aggregates Gemini uploader JSONL traces into per-phase p50/p95 and throughput.")
+    parser.add_argument("paths", nargs="*", default=[DEFAULT_TRACE_DIR], help="Trace files or directories (default: TRACE_DIR).")
+    parser.add_argument("--by-run", action="store_true", help="Also print per-run throughput and per-phase p50.")
+    parser.add_argument("--last", type=int, default=0, help="Only include the N most recent runs.")
+    args = parser.parse_args()
+
+    trace_records = load_trace_records(args.paths)
+    if args.last > 0:
+        keep_runs = set(sorted({r.get("run") for r in trace_records if r.get("run")})[-args.last:])
+        trace_records = [r for r in trace_records if r.get("run") in keep_runs]
+    if not trace_records:
+        print("TRACE_REPORT: No trace records found."); sys.exit(1)
+    print_report(trace_records, by_run=args.by_run)
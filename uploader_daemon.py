@@ -0,0 +1,275 @@
+import os
+import sys
+import json
+import time
+import queue
+import socket
+import hmac
+import secrets
+import argparse
+import threading
+import socketserver
+from dotenv import load_dotenv
+
+# Long-lived uploader daemon: starts Chrome once, logs in, selects the model and keeps that session warm.
+# Upload jobs are then sent over a local socket and go straight to scanning and the batch loop:
+#   python uploader_daemon.py serve [--port 8766]                       -> start the daemon (uses your .env like the main script)
+#   python uploader_daemon.py submit /path/to/project [--wait] [options] -> queue an upload job
+#   python uploader_daemon.py status | stop                             -> inspect or stop the daemon
+# Protocol: one JSON request line per connection, one JSON response line back (127.0.0.1 only).
+# Every request carries the token that serve writes to DAEMON_TOKEN_PATH (readable by the owner only), so other local
+# users can't submit folders into the owner's logged-in Gemini account or stop the daemon.
+
+load_dotenv() # Before reading UPLOADER_DAEMON_PORT: the uploader module (which also loads .env) is only imported by serve.
+
+DAEMON_HOST = "127.0.0.1"
+DAEMON_PORT = int(os.environ.get("UPLOADER_DAEMON_PORT") or 8766)
+DAEMON_TOKEN_PATH = os.environ.get("UPLOADER_DAEMON_TOKEN_FILE") or os.path.join(os.path.expanduser("~"), ".gemini_uploader_daemon_token")
+KEEPALIVE_SECONDS = 300 # Idle interval between session health checks (a dead browser is relaunched and logged in again).
+
+# Job keys that map onto Gemini_File_Uploader module settings, applied for the duration of one job.
+JOB_MODULE_SETTINGS = {"upload_mode": "UPLOAD_MODE", "bundle": "BUNDLE_MODE", "compact": "COMPACT_MODE", "subfolders": "SUBFOLDERS_TO_SCAN",
+                       "extensions": "ALLOWED_EXTENSIONS", "ignore_folders": "FOLDERS_TO_IGNORE_NAMES", "ignore_files": "FILES_TO_IGNORE_NAMES"}
+# Batch limits are read through env_int (the .env override wins over the module constant), so jobs set them the same way.
+JOB_ENV_SETTINGS = {"batch_size": "UPLOAD_BATCH_SIZE", "batch_max_bytes": "UPLOAD_BATCH_MAX_BYTES", "batch_max_tokens": "UPLOAD_BATCH_MAX_TOKENS"}
+
+def write_daemon_token(path=DAEMON_TOKEN_PATH):
+    """Creates a fresh random token in a file only the owner can read (mode 0600). Returns the token."""
+    token = secrets.token_hex(32)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f: f.write(token)
+    os.chmod(path, 0o600) # The file may predate this run with looser permissions.
+    return token
+
+def read_daemon_token(path=DAEMON_TOKEN_PATH):
+    """The running daemon's token, or None if the token file can't be read."""
+    try:
+        with open(path, "r") as f: return f.read().strip()
+    except OSError: return None
+
+def send_request(request, port=DAEMON_PORT, timeout=None):
+    """Sends one JSON request (with the daemon token) to the daemon and returns its JSON response."""
+    request = dict(request, token=read_daemon_token())
+    with socket.create_connection((DAEMON_HOST, port), timeout=10) as sock:
+        sock.settimeout(timeout)
+        sock.sendall((json.dumps(request) + "\n").encode("utf-8"))
+        response = b""
+        while not response.endswith(b"\n"):
+            chunk = sock.recv(65536)
+            if not chunk: break
+            response += chunk
+    return json.loads(response.decode("utf-8")) if response else {"ok": False, "error": "no response from daemon"}
+
+def apply_job_settings(uploader, job):
+    """Applies a job's settings to the uploader module and os.environ. Returns a function that restores the previous values."""
+    saved_module = {}; saved_env = {}
+    for key, attr in JOB_MODULE_SETTINGS.items():
+        if job.get(key) is None: continue
+        saved_module[attr] = getattr(uploader, attr)
+        value = job[key]
+        if attr in ("FOLDERS_TO_IGNORE_NAMES", "FILES_TO_IGNORE_NAMES"): value = list(saved_module[attr]) + list(value) # Extends, never replaces.
+        setattr(uploader, attr, value)
+    for key, env_name in JOB_ENV_SETTINGS.items():
+        if job.get(key) is None: continue
+        saved_env[env_name] = os.environ.get(env_name); os.environ[env_name] = str(job[key])
+
+    def restore():
+        for attr, value in saved_module.items(): setattr(uploader, attr, value)
+        for env_name, value in saved_env.items():
+            if value is None: os.environ.pop(env_name, None)
+            else: os.environ[env_name] = value
+    return restore
+
+def new_daemon_state(uploader):
+    """Shared daemon state: the warm session plus the job queue (jobs run one at a time on the main thread)."""
+    return {"uploader": uploader, "driver": None, "prompt_selector": None, "session_started": None, "jobs": queue.Queue(),
+            "current_job": None, "history": [], "next_job_id": 1, "lock": threading.Lock(), "stopping": False}
+
+def warm_up_session(state):
+    """Cold start, paid once: driver install, Chrome launch, login, native pop-up and model selection."""
+    uploader = state["uploader"]; start = time.time()
+    state["driver"] = uploader.launch_chrome_driver()
+    state["prompt_selector"] = uploader.login_to_gemini(state["driver"])
+    uploader.select_gemini_model(state["driver"])
+    state["session_started"] = time.time()
+    print(f"DAEMON: Browser session warm after {state['session_started'] - start:.1f}s.")
+
+def session_alive(state):
+    if not state["driver"]: return False
+    try: state["driver"].current_url; return True
+    except Exception: return False
+
+def ensure_session(state):
+    """Relaunches and logs in again if the browser was closed or the session died."""
+    if session_alive(state): return
+    print("DAEMON: Browser session lost, starting a new one...")
+    if state["driver"]:
+        try: state["driver"].quit()
+        except Exception: pass
+    warm_up_session(state)
+
+def open_new_conversation(state):
+    """Opens a fresh Gemini chat in the warm session so each job gets its own conversation."""
+    uploader = state["uploader"]
+    state["driver"].get(uploader.GEMINI_URL)
+    uploader.wait_for_gemini_ready(state["driver"], state["prompt_selector"], 30, "new conversation")
+    uploader.select_gemini_model(state["driver"])
+
+def submit_job(state, request):
+    """Queues a job. Returns (job, None) or (None, error message)."""
+    if not request.get("target_folder") or not os.path.isdir(request["target_folder"]):
+        return None, f"target_folder '{request.get('target_folder')}' does not exist."
+    with state["lock"]:
+        job = dict(request, id=state["next_job_id"], status="queued", submitted_at=time.time(), done=threading.Event())
+        state["next_job_id"] += 1
+    state["jobs"].put(job)
+    return job, None
+
+def public_job(job):
+    return {k: v for k, v in job.items() if k not in ("done", "command", "wait")}
+
+def daemon_status(state):
+    with state["lock"]:
+        current = state["current_job"]["id"] if state["current_job"] else None
+        history = [public_job(job) for job in state["history"][-10:]]
+    session_age = round(time.time() - state["session_started"], 1) if state["session_started"] else None
+    return {"ok": True, "session_alive": session_alive(state), "session_age_s": session_age,
+            "current_job": current, "queued": state["jobs"].qsize(), "recent_jobs": history}
+
+def run_job(state, job):
+    """Runs one job in the warm session: fresh chat (unless same_chat), scan/pack, then straight into the batch loop."""
+    uploader = state["uploader"]
+    job_start = time.time(); job["status"] = "running"
+    restore = apply_job_settings(uploader, job)
+    del uploader.WAIT_RECORDS[:]; del uploader.REMOVED_SLEEPS[:]
+    uploader.start_trace(target_folder=os.path.abspath(job["target_folder"]), daemon=True, job=job["id"],
+                         upload_mode=uploader.UPLOAD_MODE, bundle_mode=uploader.BUNDLE_MODE)
+    uploaded_files = []; batches_done = 0; upload_plan = None
+    try:
+        ensure_session(state)
+        if job.get("new_chat", True) and state["history"]: open_new_conversation(state)
+        upload_plan = uploader.start_upload_preparation(job["target_folder"], in_background=False).result()
+        if not upload_plan: job["status"] = "nothing_to_upload"; return
+        job["first_batch_after_s"] = round(time.time() - job_start, 2)
+        print(f"DAEMON: Job {job['id']}: first batch starts {job['first_batch_after_s']}s after the job started.")
+        uploaded_files, batches_done, gave_up = uploader.upload_planned_batches(state["driver"], state["prompt_selector"], upload_plan)
+        job["status"] = "partial" if gave_up else "done"
+    except Exception as e_job:
+        job["status"] = "failed"; job["error"] = str(e_job)
+        print(f"DAEMON: Job {job['id']} failed: {e_job}")
+    finally:
+        uploader.cleanup_upload_plan(upload_plan)
+        uploader.print_wait_summary(); uploader.print_locator_summary()
+        uploader.end_trace(batches_done=batches_done, files_uploaded=len(uploaded_files))
+        restore()
+        job.update(batches_done=batches_done, files_uploaded=len(uploaded_files), seconds=round(time.time() - job_start, 2))
+
+class DaemonRequestHandler(socketserver.StreamRequestHandler):
+    """Handles one JSON request line; the daemon state is attached to the server as server.daemon_state."""
+
+    def handle(self):
+        state = self.server.daemon_state
+        try: request = json.loads(self.rfile.readline().decode("utf-8"))
+        except ValueError: return self.reply({"ok": False, "error": "invalid JSON request"})
+        if not isinstance(request, dict) or not hmac.compare_digest(str(request.pop("token", None) or ""), self.server.daemon_token):
+            return self.reply({"ok": False, "error": f"unauthorized: the token in {DAEMON_TOKEN_PATH} is missing or wrong"})
+        command = request.get("command")
+        if command == "submit":
+            job, error = submit_job(state, request)
+            if error: return self.reply({"ok": False, "error": error})
+            if not request.get("wait"): return self.reply({"ok": True, "job": job["id"], "queued": state["jobs"].qsize()})
+            job["done"].wait()
+            return self.reply({"ok": job["status"] in ("done", "nothing_to_upload"), **public_job(job)})
+        if command == "status": return self.reply(daemon_status(state))
+        if command == "stop":
+            state["stopping"] = True; state["jobs"].put(None)
+            return self.reply({"ok": True, "stopping": True})
+        self.reply({"ok": False, "error": f"unknown command '{command}'"})
+
+    def reply(self, response):
+        self.wfile.write((json.dumps(response, default=str) + "\n").encode("utf-8"))
+
+def serve_daemon(uploader, port=DAEMON_PORT):
+    """Warms the session, listens for requests and runs queued jobs until stopped."""
+    state = new_daemon_state(uploader)
+    socketserver.ThreadingTCPServer.allow_reuse_address = True
+    server = socketserver.ThreadingTCPServer((DAEMON_HOST, port), DaemonRequestHandler)
+    server.daemon_threads = True; server.daemon_state = state; server.daemon_token = write_daemon_token()
+    try:
+        warm_up_session(state)
+        threading.Thread(target=server.serve_forever, name="daemon-socket", daemon=True).start()
+        print(f"DAEMON: Listening on {DAEMON_HOST}:{port}. Submit jobs with: python uploader_daemon.py submit <folder>")
+        while not state["stopping"]:
+            try: job = state["jobs"].get(timeout=KEEPALIVE_SECONDS)
+            except queue.Empty: # Idle keep-alive check; a failed relaunch is retried at the next check or job.
+                try: ensure_session(state)
+                except Exception as e_session: print(f"DAEMON: Could not restore the browser session: {e_session}")
+                continue
+            if job is None: continue
+            with state["lock"]: state["current_job"] = job
+            print(f"\nDAEMON: Running job {job['id']} for {job['target_folder']}...")
+            try: run_job(state, job)
+            finally:
+                with state["lock"]: state["current_job"] = None; state["history"].append(job)
+                job["done"].set()
+            print(f"DAEMON: Job {job['id']} {job['status']}: {job['batches_done']} batches, {job['files_uploaded']} files in {job['seconds']}s.")
+    except KeyboardInterrupt: print("DAEMON: Interrupted.")
+    finally:
+        server.shutdown(); server.server_close()
+        if state["driver"]:
+            try: state["driver"].quit()
+            except Exception: pass
+        try: os.remove(DAEMON_TOKEN_PATH)
+        except OSError: pass
+        print("DAEMON: Stopped.")
+
+def build_submit_request(args):
+    request = {"command": "submit", "target_folder": os.path.abspath(args.target_folder), "wait": args.wait, "new_chat": not args.same_chat}
+    if args.mode: request["upload_mode"] = args.mode
+    if args.bundle is not None: request["bundle"] = args.bundle
+    if args.compact is not None: request["compact"] = args.compact
+    if args.subfolders is not None: request["subfolders"] = args.subfolders.split(",")
+    if args.extensions: request["extensions"] = [e if e.startswith(".") else "." + e for e in args.extensions.split(",")]
+    if args.ignore_folders: request["ignore_folders"] = args.ignore_folders.split(",")
+    if args.ignore_files: request["ignore_files"] = args.ignore_files.split(",")
+    for key in ("batch_size", "batch_max_bytes", "batch_max_tokens"):
+        if getattr(args, key): request[key] = getattr(args, key)
+    return request
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keeps a logged-in Gemini browser session warm and runs upload jobs against it.")
+    parser.add_argument("--port", type=int, default=DAEMON_PORT, help="Local daemon port (default: UPLOADER_DAEMON_PORT or 8766).")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("serve", help="Start the browser, log in and wait for jobs.")
+    submit_p = sub.add_parser("submit", help="Queue an upload job.")
+    submit_p.add_argument("target_folder")
+    submit_p.add_argument("--wait", action="store_true", help="Block until the job finishes and print its result.")
+    submit_p.add_argument("--mode", choices=["full", "incremental"], help="UPLOAD_MODE for this job.")
+    submit_p.add_argument("--bundle", dest="bundle", action="store_true", default=None, help="Enable BUNDLE_MODE for this job.")
+    submit_p.add_argument("--no-bundle", dest="bundle", action="store_false", help="Disable BUNDLE_MODE for this job.")
+    submit_p.add_argument("--compact", dest="compact", action="store_true", default=None, help="Enable COMPACT_MODE for this job.")
+    submit_p.add_argument("--no-compact", dest="compact", action="store_false", help="Disable COMPACT_MODE for this job.")
+    submit_p.add_argument("--subfolders", help="Comma-separated SUBFOLDERS_TO_SCAN ('' or leading comma includes the root).")
+    submit_p.add_argument("--extensions", help="Comma-separated ALLOWED_EXTENSIONS, e.g. py,md,toml.")
+    submit_p.add_argument("--ignore-folders", help="Comma-separated folder names to ignore in addition to the defaults.")
+    submit_p.add_argument("--ignore-files", help="Comma-separated file names to ignore in addition to the defaults.")
+    submit_p.add_argument("--batch-size", type=int, help="Max files per batch.")
+    submit_p.add_argument("--batch-max-bytes", type=int, help="Max bytes per batch.")
+    submit_p.add_argument("--batch-max-tokens", type=int, help="Max estimated tokens per batch.")
+    submit_p.add_argument("--same-chat", action="store_true", help="Upload into the current conversation instead of a new chat.")
+    sub.add_parser("status", help="Show the session state and recent jobs.")
+    sub.add_parser("stop", help="Finish the running job, then stop the daemon and close the browser.")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        import Gemini_File_Uploader as uploader
+        if not uploader.GOOGLE_EMAIL or not uploader.GOOGLE_PASSWORD:
+            print("CRITICAL_ERROR: GEMINI_UPLOADER_EMAIL or GEMINI_UPLOADER_PASSWORD not set in .env file."); sys.exit(1)
+        serve_daemon(uploader, args.port)
+    else:
+        request = build_submit_request(args) if args.command == "submit" else {"command": args.command}
+        try: response = send_request(request, args.port)
+        except OSError as e_conn:
+            print(f"DAEMON: Could not reach the daemon on {DAEMON_HOST}:{args.port} ({e_conn}). Start it with: python uploader_daemon.py serve"); sys.exit(1)
+        print(json.dumps(response, indent=1, default=str))
+        sys.exit(0 if response.get("ok") else 1)